@@ -0,0 +1,152 @@
+"""partition posts and votes by month
+
+Revision ID: 3b9e4d7a1c25
+Revises: 712ebbbcf8f2
+Create Date: 2026-10-19 12:20:08.418305
+
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e4d7a1c25'
+down_revision: Union[str, Sequence[str], None] = '712ebbbcf8f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions created past the current month; `python -m app.maintenance.partitions ensure` keeps this up
+MONTHS_AHEAD = 3
+
+POST_COLUMNS = 'id, title, content, published, rating, created_at, category, user_id'
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_month_partitions(first: date, last: date) -> None:
+    month = first
+    while month <= last:
+        bounds = f"FROM ('{month} 00:00:00+00') TO ('{_add_months(month, 1)} 00:00:00+00')"
+        op.execute(f"CREATE TABLE posts_p{month:%Y_%m} PARTITION OF posts FOR VALUES {bounds}")
+        op.execute(f"CREATE TABLE votes_p{month:%Y_%m} PARTITION OF votes FOR VALUES {bounds}")
+        month = _add_months(month, 1)
+    # No DEFAULT partition: with one, Postgres can no longer read the partitions in created_at
+    # order and stop at LIMIT, every newest-first page becomes a Merge Append over all months
+
+
+def _create_feed_indexes() -> None:
+    # Same indexes as 712ebbbcf8f2; on a partitioned table they are created on every partition
+    op.create_index('idx_posts_published_created', 'posts', [sa.text('created_at DESC'), sa.text('id DESC')],
+                    postgresql_where=sa.text('published'))
+    op.create_index('idx_posts_user_created_id', 'posts', ['user_id', sa.text('created_at DESC'), sa.text('id DESC')])
+    op.create_index('idx_posts_category_created', 'posts', ['category', sa.text('created_at DESC')])
+    op.create_index('idx_votes_post_dir', 'votes', ['post_id', 'dir'])
+    op.create_index('idx_votes_user_post', 'votes', ['user_id', 'post_id'], postgresql_include=['dir'])
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+
+    # Keep the id sequence alive while the old table is dropped
+    op.execute("ALTER SEQUENCE posts_id_seq OWNED BY NONE")
+    op.rename_table('votes', 'votes_unpartitioned')
+    op.rename_table('posts', 'posts_unpartitioned')
+
+    # The partition key has to be part of every unique constraint, so the primary key
+    # becomes (id, created_at). ids still come from the sequence and stay unique.
+    # created_at used to default to the timestamp the column was added at ('now()' as a string)
+    op.create_table('posts',
+                    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('posts_id_seq')"), nullable=False),
+                    sa.Column('title', sa.String(100), nullable=False),
+                    sa.Column('content', sa.String(), nullable=False),
+                    sa.Column('published', sa.Boolean(), server_default=sa.text('true'), nullable=True),
+                    sa.Column('rating', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('category', sa.String(50), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    postgresql_partition_by='RANGE (created_at)')
+
+    # Votes carry their post's created_at and are partitioned on it, so a month of posts and
+    # its votes live in partitions with the same bounds and are pruned and archived together
+    op.create_table('votes',
+                    sa.Column('post_id', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('dir', sa.Integer(), nullable=False),
+                    sa.Column('post_created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+                    postgresql_partition_by='RANGE (post_created_at)')
+
+    current = datetime.now(timezone.utc).date().replace(day=1)
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM posts_unpartitioned")).scalar()
+    first = min(oldest.astimezone(timezone.utc).date().replace(day=1), current) if oldest else current
+    _create_month_partitions(first, _add_months(current, MONTHS_AHEAD))
+
+    op.execute(f"INSERT INTO posts ({POST_COLUMNS}) SELECT {POST_COLUMNS} FROM posts_unpartitioned")
+    op.execute("""
+        INSERT INTO votes (post_id, user_id, dir, post_created_at)
+        SELECT v.post_id, v.user_id, v.dir, p.created_at
+        FROM votes_unpartitioned v JOIN posts_unpartitioned p ON p.id = v.post_id
+    """)
+    op.drop_table('votes_unpartitioned')
+    op.drop_table('posts_unpartitioned')
+    op.execute("ALTER SEQUENCE posts_id_seq OWNED BY posts.id")
+
+    op.create_primary_key('posts_pkey', 'posts', ['id', 'created_at'])
+    op.create_foreign_key('fk_posts_user_id', 'posts', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_primary_key('votes_pkey', 'votes', ['post_id', 'user_id', 'post_created_at'])
+    op.create_foreign_key('votes_user_id_fkey', 'votes', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('votes_post_id_fkey', 'votes', 'posts', ['post_id', 'post_created_at'],
+                          ['id', 'created_at'], ondelete='CASCADE')
+    _create_feed_indexes()
+
+    # Same frozen default as posts.created_at had
+    op.alter_column('users', 'created_at', server_default=sa.text('now()'))
+
+    # posts and votes partitions share bounds, so joins and aggregates on (id, created_at) can run
+    # partition by partition, each side using its own partition's indexes. Both are off by default
+    for setting in ('enable_partitionwise_join', 'enable_partitionwise_aggregate'):
+        op.execute(f"DO $$ BEGIN EXECUTE format('ALTER DATABASE %I SET {setting} = on', current_database()); END $$")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for setting in ('enable_partitionwise_join', 'enable_partitionwise_aggregate'):
+        op.execute(f"DO $$ BEGIN EXECUTE format('ALTER DATABASE %I RESET {setting}', current_database()); END $$")
+
+    op.execute("ALTER SEQUENCE posts_id_seq OWNED BY NONE")
+    op.rename_table('votes', 'votes_partitioned')
+    op.rename_table('posts', 'posts_partitioned')
+
+    op.create_table('posts',
+                    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('posts_id_seq')"), nullable=False),
+                    sa.Column('title', sa.String(100), nullable=False),
+                    sa.Column('content', sa.String(), nullable=False),
+                    sa.Column('published', sa.Boolean(), server_default=sa.text('true'), nullable=True),
+                    sa.Column('rating', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('category', sa.String(50), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False))
+    op.create_table('votes',
+                    sa.Column('post_id', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('dir', sa.Integer(), nullable=False))
+
+    op.execute(f"INSERT INTO posts ({POST_COLUMNS}) SELECT {POST_COLUMNS} FROM posts_partitioned")
+    op.execute("INSERT INTO votes (post_id, user_id, dir) SELECT post_id, user_id, dir FROM votes_partitioned")
+    # Drops the partitions too; partitions detached by the maintenance command are left alone
+    op.drop_table('votes_partitioned')
+    op.drop_table('posts_partitioned')
+    op.execute("ALTER SEQUENCE posts_id_seq OWNED BY posts.id")
+
+    op.create_primary_key('posts_pkey', 'posts', ['id'])
+    op.create_foreign_key('fk_posts_user_id', 'posts', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_primary_key('votes_pkey', 'votes', ['post_id', 'user_id'])
+    op.create_foreign_key('votes_user_id_fkey', 'votes', 'users', ['user_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('votes_post_id_fkey', 'votes', 'posts', ['post_id'], ['id'], ondelete='CASCADE')
+    _create_feed_indexes()
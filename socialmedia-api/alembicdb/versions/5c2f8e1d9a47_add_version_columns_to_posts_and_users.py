@@ -0,0 +1,35 @@
+"""add version columns to posts and users
+
+Revision ID: 5c2f8e1d9a47
+Revises: 3b9e4d7a1c25
+Create Date: 2026-10-19 13:05:37.512904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2f8e1d9a47'
+down_revision: Union[str, Sequence[str], None] = '3b9e4d7a1c25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Bumped by every write that changes GET /posts/{id} or GET /users/{id}, so ETag and
+    # Last-Modified can be answered from these columns without the aggregate queries.
+    # Constant defaults: adding them does not rewrite the tables
+    for table in ('posts', 'users'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+        op.add_column(table, sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('users', 'posts'):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
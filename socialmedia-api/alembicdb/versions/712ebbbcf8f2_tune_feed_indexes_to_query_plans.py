@@ -0,0 +1,74 @@
+"""tune feed indexes to query plans
+
+Revision ID: 712ebbbcf8f2
+Revises: f6738c74acf3
+Create Date: 2026-10-19 10:12:41.204118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '712ebbbcf8f2'
+down_revision: Union[str, Sequence[str], None] = 'f6738c74acf3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY so building the indexes does not block writes on a live database
+    with op.get_context().autocommit_block():
+        # Chronological/trending feeds: published posts newest first, id breaks ties in pagination
+        op.create_index('idx_posts_published_created', 'posts', [sa.text('created_at DESC'), sa.text('id DESC')],
+                        postgresql_where=sa.text('published'), postgresql_concurrently=True)
+
+        # Newest posts of one author: following feed (per followee top-N) and profile pages.
+        # id is in the key so the page comes straight off the index without heap fetches
+        op.create_index('idx_posts_user_created_id', 'posts', ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+                        postgresql_concurrently=True)
+
+        # Recommendations (category IN preferred) and per-category listings
+        op.create_index('idx_posts_category_created', 'posts', ['category', sa.text('created_at DESC')],
+                        postgresql_concurrently=True)
+
+        # "What did this user vote on": recommendations, get_user_votes_for_posts, has_liked lookups.
+        # dir is included so these are index only scans
+        op.create_index('idx_votes_user_post', 'votes', ['user_id', 'post_id'],
+                        postgresql_include=['dir'], postgresql_concurrently=True)
+
+        # Followers of a user; follower_id in the key makes the join to users index only
+        op.create_index('idx_followers_following_follower', 'followers', ['following_id', 'follower_id'],
+                        postgresql_concurrently=True)
+
+        # Superseded by the indexes above
+        op.drop_index('idx_posts_published', table_name='posts', postgresql_concurrently=True)  # boolean, never selective
+        op.drop_index('idx_posts_created_at', table_name='posts', postgresql_concurrently=True)
+        op.drop_index('idx_posts_category', table_name='posts', postgresql_concurrently=True)
+        op.drop_index('idx_posts_user_created', table_name='posts', postgresql_concurrently=True)
+        op.drop_index('idx_followers_following_id', table_name='followers', postgresql_concurrently=True)
+        # Same leading column as the (follower_id, following_id) primary key
+        op.drop_index('idx_followers_follower_id', table_name='followers', postgresql_concurrently=True)
+        # Duplicate of the index behind uq_users_username
+        op.drop_index('idx_users_username', table_name='users', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('idx_users_username', 'users', ['username'], postgresql_concurrently=True)
+        op.create_index('idx_followers_follower_id', 'followers', ['follower_id'], postgresql_concurrently=True)
+        op.create_index('idx_followers_following_id', 'followers', ['following_id'], postgresql_concurrently=True)
+        op.create_index('idx_posts_user_created', 'posts', ['user_id', 'created_at'], postgresql_concurrently=True)
+        op.create_index('idx_posts_category', 'posts', ['category'], postgresql_concurrently=True)
+        op.create_index('idx_posts_created_at', 'posts', ['created_at'], postgresql_concurrently=True)
+        op.create_index('idx_posts_published', 'posts', ['published'], postgresql_concurrently=True)
+
+        op.drop_index('idx_followers_following_follower', table_name='followers', postgresql_concurrently=True)
+        op.drop_index('idx_votes_user_post', table_name='votes', postgresql_concurrently=True)
+        op.drop_index('idx_posts_category_created', table_name='posts', postgresql_concurrently=True)
+        op.drop_index('idx_posts_user_created_id', table_name='posts', postgresql_concurrently=True)
+        op.drop_index('idx_posts_published_created', table_name='posts', postgresql_concurrently=True)
@@ -0,0 +1,48 @@
+"""add outbox events
+
+Revision ID: 8d41b6f0e2c3
+Revises: 5c2f8e1d9a47
+Create Date: 2026-10-19 15:42:11.804126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41b6f0e2c3'
+down_revision: Union[str, Sequence[str], None] = '5c2f8e1d9a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'outbox_events',
+        sa.Column('id', sa.BigInteger(), sa.Identity(), primary_key=True),
+        # Id of the writing transaction. Ids are taken in insert order but become visible in
+        # commit order; (txid, id) below the oldest running transaction is final (app/events.py)
+        sa.Column('txid', sa.BigInteger(), server_default=sa.text('pg_current_xact_id()::text::bigint'), nullable=False),
+        sa.Column('topic', sa.String(50), nullable=False),
+        sa.Column('payload', postgresql.JSONB(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    )
+    op.create_index('idx_outbox_events_txid_id', 'outbox_events', ['txid', 'id'])
+    op.create_table(
+        'outbox_checkpoints',
+        sa.Column('consumer', sa.String(100), primary_key=True),
+        sa.Column('txid', sa.BigInteger(), nullable=False),
+        sa.Column('event_id', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('outbox_checkpoints')
+    op.drop_index('idx_outbox_events_txid_id', table_name='outbox_events')
+    op.drop_table('outbox_events')
@@ -0,0 +1,48 @@
+"""add hot score to posts
+
+Revision ID: 9f1c3a7e5b20
+Revises: e2a6f4b8d913
+Create Date: 2026-10-19 21:05:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f1c3a7e5b20'
+down_revision: Union[str, Sequence[str], None] = 'e2a6f4b8d913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Upvotes - downvotes and the hot rank of GET /posts/?feed_type=hot, moved by every vote
+    # (versions.touch_voted_post). The rank only changes with votes, so it can be stored and
+    # indexed. Defaults evaluated once: adding the columns does not rewrite the table
+    op.add_column('posts', sa.Column('net_votes', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('posts', sa.Column('hot_score', sa.Float(),
+                                     server_default=sa.text('extract(epoch from now())::float8 / 45000'), nullable=False))
+    # One pass over the posts, every one of them rewritten once
+    op.execute("""
+        UPDATE posts p SET net_votes = c.net_votes,
+                           hot_score = log(greatest(abs(c.net_votes), 1)) * sign(c.net_votes)
+                                       + extract(epoch from p.created_at)::float8 / 45000
+        FROM (SELECT q.id, q.created_at, coalesce(sum(v.dir), 0)::int AS net_votes
+              FROM posts q LEFT JOIN votes v ON v.post_id = q.id AND v.post_created_at = q.created_at
+              GROUP BY q.id, q.created_at) c
+        WHERE p.id = c.id AND p.created_at = c.created_at
+    """)
+    # feed_type=hot: one index scan per partition, merged, stopping after skip+limit rows each
+    op.create_index('idx_posts_published_hot', 'posts', [sa.text('hot_score DESC'), sa.text('id DESC')],
+                    postgresql_where=sa.text('published'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_posts_published_hot', table_name='posts')
+    op.drop_column('posts', 'hot_score')
+    op.drop_column('posts', 'net_votes')
@@ -0,0 +1,39 @@
+"""add mutual flag to followers
+
+Revision ID: b7e3c9a14f02
+Revises: 8d41b6f0e2c3
+Create Date: 2026-10-19 18:12:04.331870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3c9a14f02'
+down_revision: Union[str, Sequence[str], None] = '8d41b6f0e2c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # True on both rows of a pair of users who follow each other, maintained by the
+    # follow and unfollow writes (see FollowerRepository). Constant default: no rewrite
+    op.add_column('followers', sa.Column('mutual', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+    op.execute("""
+        UPDATE followers f SET mutual = true
+        WHERE EXISTS (SELECT 1 FROM followers r
+                      WHERE r.follower_id = f.following_id AND r.following_id = f.follower_id)
+    """)
+    # GET /follow/mutual: a user's mutual follows in following_id order
+    op.create_index('idx_followers_mutual', 'followers', ['follower_id', 'following_id'],
+                    postgresql_where=sa.text('mutual'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_followers_mutual', table_name='followers')
+    op.drop_column('followers', 'mutual')
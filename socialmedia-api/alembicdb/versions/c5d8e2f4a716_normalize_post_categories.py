@@ -0,0 +1,57 @@
+"""normalize post categories
+
+Revision ID: c5d8e2f4a716
+Revises: 9f1c3a7e5b20
+Create Date: 2026-10-19 23:12:08.406215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d8e2f4a716'
+down_revision: Union[str, Sequence[str], None] = '9f1c3a7e5b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # One row per distinct category, numbered with an integer: the category indexes and the
+    # GROUP BY of recommendations work on ints instead of strings. Not a smallint, any post can
+    # name a new category and 32767 of them would exhaust the identity. posts.category stays,
+    # it is the name every read returns
+    op.create_table('categories',
+                    sa.Column('id', sa.Integer(), sa.Identity(), primary_key=True),
+                    sa.Column('name', sa.String(50), nullable=False),
+                    sa.UniqueConstraint('name', name='uq_categories_name'))
+    op.execute("INSERT INTO categories (name) SELECT DISTINCT category FROM posts ORDER BY category")
+
+    # One pass over the posts, every one of them rewritten once
+    op.add_column('posts', sa.Column('category_id', sa.Integer(), nullable=True))
+    op.execute("UPDATE posts p SET category_id = c.id FROM categories c WHERE c.name = p.category")
+    op.alter_column('posts', 'category_id', nullable=False)
+    op.create_foreign_key('fk_posts_category_id', 'posts', 'categories', ['category_id'], ['id'])
+
+    # GET /posts/category/{name}: the newest or hottest published posts of one category come
+    # off one index scan per partition. The (category_id, created_at) prefix also serves the
+    # category IN (preferred) AND created_at >= cutoff of recommendations
+    op.create_index('idx_posts_category_published_created', 'posts',
+                    ['category_id', sa.text('created_at DESC'), sa.text('id DESC')], postgresql_where=sa.text('published'))
+    op.create_index('idx_posts_category_published_hot', 'posts',
+                    ['category_id', sa.text('hot_score DESC'), sa.text('id DESC')], postgresql_where=sa.text('published'))
+    # Superseded by the first one
+    op.drop_index('idx_posts_category_created', table_name='posts')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('idx_posts_category_created', 'posts', ['category', sa.text('created_at DESC')])
+    op.drop_index('idx_posts_category_published_hot', table_name='posts')
+    op.drop_index('idx_posts_category_published_created', table_name='posts')
+    op.drop_constraint('fk_posts_category_id', 'posts', type_='foreignkey')
+    op.drop_column('posts', 'category_id')
+    op.drop_table('categories')
@@ -0,0 +1,42 @@
+"""add follow counters to users
+
+Revision ID: e2a6f4b8d913
+Revises: b7e3c9a14f02
+Create Date: 2026-10-19 19:40:51.204417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a6f4b8d913'
+down_revision: Union[str, Sequence[str], None] = 'b7e3c9a14f02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Moved by every follow and unfollow (see versions.touch_follows); served instead of
+    # counting the followers table once a count reaches EXACT_COUNT_LIMIT
+    op.add_column('users', sa.Column('followers_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('users', sa.Column('following_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.execute("""
+        UPDATE users u SET followers_count = c.n
+        FROM (SELECT following_id AS id, count(*) AS n FROM followers GROUP BY following_id) c
+        WHERE u.id = c.id
+    """)
+    op.execute("""
+        UPDATE users u SET following_count = c.n
+        FROM (SELECT follower_id AS id, count(*) AS n FROM followers GROUP BY follower_id) c
+        WHERE u.id = c.id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'following_count')
+    op.drop_column('users', 'followers_count')
@@ -0,0 +1,45 @@
+"""Bounds how many requests a worker processes at once by the size of its connection pool.
+
+FastAPI runs sync dependencies, sync endpoints and the exit of get_db (the commit) as
+separate hops onto a pool of 40 threads. With more requests in flight than the pool has
+connections, every thread can end up waiting for a connection while the requests that
+hold the connections wait for a thread to commit and give them back; nothing moves until
+pool_timeout fails them all. Admitting at most db_pool_size requests keeps the queue in
+the event loop, where waiting costs nothing, and leaves the db_max_overflow connections to
+streamed responses and the background tasks, which open sessions of their own.
+
+A request leaves as soon as its response starts, get_db has committed and closed by then,
+so a long stream (GET /posts/live, exports) does not hold a place. The streams that hold a
+connection for their whole body are bounded by StreamLimit (app/streaming.py) instead.
+"""
+import asyncio
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class AdmissionLimit:
+    def __init__(self, app: ASGIApp, limit: int):
+        self.app = app
+        self.slots = asyncio.Semaphore(limit)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        await self.slots.acquire()
+        admitted = True
+
+        def leave() -> None:
+            nonlocal admitted
+            if admitted:
+                admitted = False
+                self.slots.release()
+
+        async def send_and_leave(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                leave()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_leave)
+        finally:
+            leave()
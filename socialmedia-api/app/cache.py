@@ -0,0 +1,351 @@
+"""Two-tier read-through cache: a bounded LRU in each worker (L1) in front of a store all workers share (L2).
+
+Each kind of cached value gets a namespace with its own TTLs and size, and its own counters
+in GET /admin/metrics:
+
+    users = cache.namespace("users", ttl=300, max_entries=10000)
+    record = users.get(user_id, lambda: load_user(user_id), tags=(f"user:{user_id}",))
+
+A read looks in L1, then in L2, and only then calls load(), once for all the concurrent
+callers of a key (single_flight.py). None from load() means "no such value" and is cached
+too, for negative_ttl, so requests naming missing ids do not all reach the database.
+
+The L2 is anything with the Redis commands of Store: a Redis named by cache_l2_url, or
+MemoryStore, an in-process fake for tests. Without cache_l2_url there is no L2 and each
+worker loads its own values. Values go to the L2 as MessagePack, so they must be made of
+plain types (dicts, lists, strings, numbers, aware datetimes), never ORM objects. An L2
+that fails or times out only costs its counter in l2_errors: the value is loaded instead.
+
+Stampedes:
+- TTLs are spread by +-cache_ttl_jitter, so values loaded together do not expire together.
+- Before it expires, an entry is refreshed early by one reader with a probability that
+  grows as the expiry nears, and faster for values that are slow to load
+  (cache_early_refresh_beta; "optimal probabilistic cache stampede prevention"). The other
+  readers keep getting the entry meanwhile.
+
+Invalidation is by tags, strings naming what a value was built from ("user:3"):
+- cache.invalidate(tag) drops the tagged entries of this worker's L1 and bumps the tag's
+  version in the L2. L2 entries keep the versions of their tags from before their load, so
+  an entry of an older version is never served, and neither is one loaded while its tag was
+  invalidated. Writes call it right after their flush.
+- Until they commit, a reader may load the old value again; consumers of the write's
+  outbox event therefore invalidate once more after the commit: a shared consumer calls
+  cache.invalidate, a per-process one cache.evict_local in every worker's L1. L1 entries
+  are also checked against the L2 again after their namespace's local_ttl.
+"""
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Protocol, Set, Tuple
+import msgpack
+from .config import settings
+from .repositories.database.single_flight import single_flight
+
+
+class Store(Protocol):
+    """The Redis commands the L2 needs; redis.Redis has them"""
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]: ...
+
+    def set(self, name: str, value: bytes, ex: Optional[int] = None) -> Any: ...
+
+    def delete(self, *names: str) -> int: ...
+
+    def incr(self, name: str) -> int: ...
+
+
+class MemoryStore:
+    """Store kept in this process, for tests and single worker setups"""
+
+    def __init__(self):
+        # name -> (value, expires at on the monotonic clock or None)
+        self._values: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, name: str) -> Optional[bytes]:
+        item = self._values.get(name)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self._values[name]
+            return None
+        return None if item is None else item[0]
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [self._live(key) for key in keys]
+
+    def set(self, name: str, value: bytes, ex: Optional[int] = None) -> bool:
+        with self._lock:
+            self._values[name] = (value, None if ex is None else time.monotonic() + ex)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            value = int(self._live(name) or 0) + 1
+            self._values[name] = (str(value).encode(), None)
+        return value
+
+
+def open_store(url: str) -> Optional[Store]:
+    """The L2 named by url: none for "", a MemoryStore for memory://, a Redis client for redis:// or rediss://"""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryStore()
+    import redis  # Only deployments with a shared L2 install it
+    return redis.Redis.from_url(url, socket_timeout=settings.cache_l2_timeout,
+                                socket_connect_timeout=settings.cache_l2_timeout)
+
+
+class Record:
+    """A cached value, or the fact that there is none; expires_at is wall clock time, shared by all workers"""
+    __slots__ = ("found", "value", "expires_at", "delta")
+
+    def __init__(self, found: bool, value: Any, expires_at: float, delta: float):
+        self.found = found
+        self.value = value
+        self.expires_at = expires_at
+        # Seconds the load took; slower loads are refreshed earlier
+        self.delta = delta
+
+    def due(self, beta: float) -> bool:
+        """Whether this read should load the value again: always once it has expired, and before
+        that with a probability that grows towards the expiry"""
+        return time.time() - self.delta * beta * math.log(1.0 - random.random()) >= self.expires_at
+
+
+class Namespace:
+    def __init__(self, cache: "Cache", name: str, ttl: float, max_entries: int, negative_ttl: float,
+                 local_ttl: Optional[float]):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.local_ttl = ttl if local_ttl is None else local_ttl
+        # key -> (record, checked against the L2 until, on the monotonic clock, tags)
+        self._entries: "OrderedDict[Hashable, Tuple[Record, float, Tuple[str, ...]]]" = OrderedDict()
+        self._tagged: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self._loads = single_flight(f"cache:{name}")
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.early_refreshes = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, load: Callable[[], Any], tags: Iterable[str] = ()) -> Any:
+        """The value of key, calling load() when neither tier has it; None when load() found nothing"""
+        tags = tuple(tags)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                record, local_until, _ = entry
+                if record.due(self.cache.early_refresh_beta):
+                    if record.expires_at > time.time():
+                        self.early_refreshes += 1
+                elif local_until > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._count_hit(record, l1=True)
+                    return record.value
+        return self._loads.do(key, lambda: self._fill(key, load, tags))
+
+    def _count_hit(self, record: Record, l1: bool) -> None:
+        if l1:
+            self.l1_hits += 1
+        else:
+            self.l2_hits += 1
+        if not record.found:
+            self.negative_hits += 1
+
+    def _fill(self, key: Hashable, load: Callable[[], Any], tags: Tuple[str, ...]) -> Any:
+        loading = self.cache.begin_load(tags)
+        try:
+            record, versions = self.cache.read_l2(self.name, key, tags)
+            if record is not None and not record.due(self.cache.early_refresh_beta):
+                with self._lock:
+                    self._count_hit(record, l1=False)
+            else:
+                with self._lock:
+                    self.misses += 1
+                record = self._load(key, load, versions)
+        except BaseException:
+            self.cache.end_load(loading)
+            raise
+        self._store(key, record, tags, loading)
+        return record.value
+
+    def _load(self, key: Hashable, load: Callable[[], Any], versions: Optional[List[int]]) -> Record:
+        started = time.monotonic()
+        value = load()
+        delta = time.monotonic() - started
+        ttl = (self.ttl if value is not None else self.negative_ttl) * self.cache.jittered()
+        record = Record(value is not None, value, time.time() + ttl, delta)
+        if versions is not None:
+            self.cache.write_l2(self.name, key, record, versions, ttl)
+        return record
+
+    def _store(self, key: Hashable, record: Record, tags: Tuple[str, ...], loading: Tuple[str, ...]) -> None:
+        # A tag invalidated while the value was read leaves it out of L1: it may predate the write
+        if not self.cache.end_load(loading):
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (record, time.monotonic() + self.local_ttl, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[2]:
+                keys = self._tagged.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tagged[tag]
+
+    def evict_tags(self, tags: Iterable[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tagged.get(tag, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def forget(self, key: Hashable) -> None:
+        """Drop key from both tiers"""
+        with self._lock:
+            self._drop(key)
+        self.cache.delete_l2(self.name, key)
+
+    def clear(self) -> None:
+        """Drop this worker's entries"""
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"entries": len(self._entries), "l1_hits": self.l1_hits, "l2_hits": self.l2_hits,
+                     "misses": self.misses, "negative_hits": self.negative_hits,
+                     "early_refreshes": self.early_refreshes, "evictions": self.evictions,
+                     "invalidations": self.invalidations}
+        return {**stats, "coalesced": self._loads.stats()["shared"]}
+
+
+class Cache:
+    def __init__(self, store: Optional[Store], prefix: str, ttl_jitter: float, early_refresh_beta: float):
+        self.store = store
+        self.prefix = prefix
+        self.ttl_jitter = ttl_jitter
+        self.early_refresh_beta = early_refresh_beta
+        self.namespaces: Dict[str, Namespace] = {}
+        self._lock = threading.Lock()
+        # Tags with loads in flight, and those of them invalidated since
+        self._loading: Dict[str, int] = {}
+        self._changed: Set[str] = set()
+        self.l2_errors = 0
+        self.last_l2_error: Optional[str] = None
+
+    def namespace(self, name: str, ttl: float, max_entries: int, negative_ttl: Optional[float] = None,
+                  local_ttl: Optional[float] = None) -> Namespace:
+        """The namespace name, created on first use; local_ttl bounds how long L1 trusts an entry without the L2"""
+        with self._lock:
+            if name not in self.namespaces:
+                self.namespaces[name] = Namespace(
+                    self, name, ttl, max_entries, settings.cache_negative_ttl if negative_ttl is None else negative_ttl, local_ttl)
+            return self.namespaces[name]
+
+    def jittered(self) -> float:
+        return random.uniform(1 - self.ttl_jitter, 1 + self.ttl_jitter)
+
+    def invalidate(self, *tags: str) -> None:
+        """Drop the values built from tags, from this worker's L1 and for every worker from the L2"""
+        self.evict_local(*tags)
+        if self.store is not None and tags:
+            for tag in tags:
+                self._l2(lambda: self.store.incr(self._tag_key(tag)))
+
+    def evict_local(self, *tags: str) -> None:
+        """Drop the values built from tags from this worker's L1 only"""
+        with self._lock:
+            self._changed.update(tag for tag in tags if tag in self._loading)
+            namespaces = list(self.namespaces.values())
+        for namespace in namespaces:
+            namespace.evict_tags(tags)
+
+    def begin_load(self, tags: Tuple[str, ...]) -> Tuple[str, ...]:
+        with self._lock:
+            for tag in tags:
+                self._loading[tag] = self._loading.get(tag, 0) + 1
+        return tags
+
+    def end_load(self, tags: Tuple[str, ...]) -> bool:
+        """Whether none of tags was invalidated since begin_load"""
+        with self._lock:
+            unchanged = not any(tag in self._changed for tag in tags)
+            for tag in tags:
+                self._loading[tag] -= 1
+                if not self._loading[tag]:
+                    del self._loading[tag]
+                    self._changed.discard(tag)
+        return unchanged
+
+    def _key(self, namespace: str, key: Hashable) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.prefix}:tag:{tag}"
+
+    def _l2(self, command: Callable[[], Any]) -> Any:
+        try:
+            return command()
+        except Exception as exc:
+            with self._lock:
+                self.l2_errors += 1
+                self.last_l2_error = repr(exc)
+            return None
+
+    def read_l2(self, namespace: str, key: Hashable, tags: Tuple[str, ...]) -> Tuple[Optional[Record], Optional[List[int]]]:
+        """The L2 record of key if its tags are current, and the current versions of tags; (None, None) without an L2"""
+        if self.store is None:
+            return None, None
+        values = self._l2(lambda: self.store.mget([self._key(namespace, key), *(self._tag_key(tag) for tag in tags)]))
+        if values is None:
+            return None, None  # Nothing written back either, the L2 is failing
+        versions = [int(version or 0) for version in values[1:]]
+        if values[0] is None:
+            return None, versions
+        found, value, expires_at, delta, stored_versions = msgpack.unpackb(values[0], timestamp=3)
+        if stored_versions != versions:
+            return None, versions
+        return Record(found, value, expires_at, delta), versions
+
+    def write_l2(self, namespace: str, key: Hashable, record: Record, versions: List[int], ttl: float) -> None:
+        packed = msgpack.packb([record.found, record.value, record.expires_at, record.delta, versions], datetime=True)
+        self._l2(lambda: self.store.set(self._key(namespace, key), packed, ex=max(1, math.ceil(ttl))))
+
+    def delete_l2(self, namespace: str, key: Hashable) -> None:
+        if self.store is not None:
+            self._l2(lambda: self.store.delete(self._key(namespace, key)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            namespaces = list(self.namespaces.values())
+            l2 = {"store": type(self.store).__name__ if self.store is not None else None,
+                  "errors": self.l2_errors, "last_error": self.last_l2_error}
+        return {"l2": l2, **{namespace.name: namespace.stats() for namespace in namespaces}}
+
+
+cache = Cache(open_store(settings.cache_l2_url), settings.cache_key_prefix, settings.cache_ttl_jitter,
+              settings.cache_early_refresh_beta)
@@ -0,0 +1,117 @@
+"""Compresses response bodies with brotli or gzip, whichever the client accepts and the settings prefer.
+
+A feed page is mostly the same keys over and over ("Upvotes", "Downvotes", the nested owner),
+which both codings shrink to a fraction. Bodies below compression_minimum_size are sent as
+they are: the header and the work cost more than the bytes saved. A body, or a chunk of a
+stream, of compression_thread_size bytes and more is compressed in a worker thread, so a
+large export does not hold the event loop while every other request on the worker waits.
+
+Only the media types in COMPRESSIBLE_TYPES are compressed. Server-Sent Events are left out:
+each event has to reach the client as soon as it is sent. Streamed NDJSON is compressed
+chunk by chunk, each chunk flushed so the client can decode what it has received.
+
+Validators are kept: the ETags are weak, and a compressed body is the same representation.
+"""
+import zlib
+from typing import Optional, Sequence
+
+import brotli
+from anyio import to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .negotiation import negotiate
+
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "application/x-ndjson", "text/plain")
+ENCODINGS = ("br", "gzip")
+
+
+class Encoder:
+    """Compressor of one response body, in one piece or chunk by chunk"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: a gzip header and trailer around the deflate stream
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def encode(self, chunk: bytes, last: bool) -> bytes:
+        """chunk compressed, with everything before it flushed; the end of the stream if last"""
+        if self.encoding == "br":
+            return self.compressor.process(chunk) + (self.compressor.finish() if last else self.compressor.flush())
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class Compression:
+    def __init__(self, app: ASGIApp, encodings: Sequence[str] = ENCODINGS, minimum_size: int = 1024,
+                 thread_size: int = 65536, gzip_level: int = 6, brotli_quality: int = 4):
+        unknown = set(encodings).difference(ENCODINGS)
+        if unknown:
+            raise ValueError(f"Unknown encodings {', '.join(sorted(unknown))}, expected some of {', '.join(ENCODINGS)}")
+        self.app = app
+        self.encodings = tuple(encodings)
+        self.minimum_size = minimum_size
+        self.thread_size = thread_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def accepted(self, scope: Scope) -> Optional[str]:
+        """The encoding to answer scope with, None to answer uncompressed"""
+        accept_encoding = Headers(scope=scope).get("accept-encoding")
+        # Without Accept-Encoding any coding is acceptable, but clients that send none rarely decode one
+        if not self.encodings or not accept_encoding:
+            return None
+        return negotiate(accept_encoding, self.encodings)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = self.accepted(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start: Optional[Message] = None
+        encoder: Optional[Encoder] = None
+
+        async def encode(chunk: bytes, last: bool) -> bytes:
+            if len(chunk) >= self.thread_size:
+                return await to_thread.run_sync(encoder.encode, chunk, last)
+            return encoder.encode(chunk, last)
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                # Held back until the first body tells whether the response is compressed
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                compressible = (
+                    "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                    and (more_body or len(body) >= self.minimum_size)
+                )
+                if compressible:
+                    encoder = Encoder(encoding, self.gzip_level, self.brotli_quality)
+                    body = await encode(body, not more_body)
+                    headers["Content-Encoding"] = encoding
+                    if more_body:
+                        del headers["Content-Length"]
+                    else:
+                        headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+                await send(start)
+                start = None
+            elif encoder is not None:
+                message = {**message, "body": await encode(body, not more_body)}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+        # An app that started its response without a body
+        if start is not None:
+            await send(start)
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -9,6 +10,76 @@ class Settings(BaseSettings):
     secret_key: str 
     algorithm: str
     access_token_expire_minutes: int
+    # Users allowed on the /admin routes, e.g. ADMIN_USER_IDS=[1,2]
+    admin_user_ids: List[int] = []
+    # GET /posts/{id} payloads kept in memory per worker, and for how many seconds
+    hot_post_cache_size: int = 10000
+    hot_post_cache_ttl: float = 30
+    # GET /posts/live: how often vote count changes are pushed, and how many posts one stream may watch
+    live_votes_tick_ms: int = 250
+    live_votes_max_posts: int = 200
+    # Outbox dispatcher (app/events.py): how often it polls, how many events one batch holds, and
+    # whether API workers deliver to shared consumers (false when python -m app.maintenance.outbox run does)
+    outbox_poll_ms: int = 500
+    outbox_batch_size: int = 500
+    outbox_shared_consumers: bool = True
+    # Follower and following counts below this are counted exactly; from it on the counters
+    # kept on users are served and flagged approximate
+    exact_count_limit: int = 10000
+    # Connection pool of each worker process; a deployment holds up to
+    # WEB_CONCURRENCY * (db_pool_size + db_max_overflow) connections. A worker processes at
+    # most db_pool_size requests at once (app/admission.py), the overflow is left to streamed
+    # responses and background tasks. At most db_max_streams NDJSON streams and exports run at
+    # once (app/streaming.py), keep it below db_max_overflow
+    db_pool_size: int = 10
+    db_max_overflow: int = 5
+    db_pool_timeout: float = 30
+    db_max_streams: int = 3
+    # Event loop and HTTP parser of the gunicorn workers (app/workers.py): auto, uvloop or asyncio; auto, httptools or h11
+    uvicorn_loop: str = "auto"
+    uvicorn_http: str = "auto"
+
+    # GET /posts/?feed_type=following: "sql" reads the page with one query, "rings" merges the
+    # newest posts of each followed author kept in memory (repositories/database/author_rings.py),
+    # author_ring_size posts for each of at most author_rings_max_authors authors per worker
+    following_feed_engine: str = "sql"
+    author_ring_size: int = 32
+    author_rings_max_authors: int = 20000
+    # Response compression (app/compression.py): the codings offered, in order of preference
+    # (empty to turn it off), the smallest body compressed, the smallest body or stream chunk
+    # compressed in a worker thread instead of on the event loop, and the level of each coding
+    compression_encodings: List[str] = ["br", "gzip"]
+    compression_minimum_size: int = 1024
+    compression_thread_size: int = 65536
+    gzip_level: int = 6
+    brotli_quality: int = 4
+    # Bloom filters of every email and username (repositories/database/user_filters.py), so
+    # registrations and contact imports of unknown names skip the database: built by each worker when it
+    # starts and again every user_filter_rebuild_seconds, with this rate of false positives
+    user_filters_enabled: bool = True
+    user_filter_false_positive_rate: float = 0.01
+    user_filter_rebuild_seconds: int = 600
+    # GET /posts/category/{name} (repositories/database/category_cache.py): the first
+    # category_page_size posts of a category kept per sort, for at most category_pages_max_lists
+    # (category, sort) pairs per worker; hot lists are also reloaded after category_hot_page_ttl seconds
+    category_page_size: int = 100
+    category_pages_max_lists: int = 1000
+    category_hot_page_ttl: float = 30
+    # Two-tier cache (app/cache.py): the L2 shared by all workers, "" for none, redis://host:6379/0
+    # (needs the redis package) or memory:// for an in-process fake, and how long its commands may
+    # take; TTLs are spread by +-cache_ttl_jitter, entries refreshed early before they expire more
+    # eagerly the larger cache_early_refresh_beta (0 turns it off), and missing values cached cache_negative_ttl seconds
+    cache_l2_url: str = ""
+    cache_l2_timeout: float = 0.05
+    cache_key_prefix: str = "charcha"
+    cache_ttl_jitter: float = 0.1
+    cache_early_refresh_beta: float = 1.0
+    cache_negative_ttl: float = 30
+    # Users authenticated by oauth2.get_current_user kept in the cache, per worker, for how many
+    # seconds, and after how many seconds a worker checks its copy against the L2 again
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 300
+    user_cache_local_ttl: float = 30
 
     class Config:
         env_file = ".env"
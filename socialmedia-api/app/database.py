@@ -1,24 +1,95 @@
-from sqlalchemy import create_engine
+import threading
+from typing import Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-import psycopg2
-import time
-from psycopg2.extras import RealDictCursor
+from sqlalchemy.orm import Session, sessionmaker
 from .config import settings
 
 SQLALCHEMY_DATABASE_URL = f'postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}'
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Statements executed by this process, by where their SQL came from (see compiled_cache_stats)
+_cache_outcomes = {"hits": 0, "misses": 0, "uncached": 0}
+_cache_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """The engine of this process, created on first use.
+
+    Importing the app loads no driver and builds no pool, so a worker answers sooner after
+    it starts and tools that never touch the database do not pay for it.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                # One pool per worker process (see gunicorn.conf.py)
+                _engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=settings.db_pool_size,
+                                        max_overflow=settings.db_max_overflow, pool_timeout=settings.db_pool_timeout)
+                event.listen(_engine, "after_cursor_execute", _count_cache_outcome)
+    return _engine
+
+
+def _count_cache_outcome(conn, cursor, statement, parameters, context, executemany):
+    outcome = "hits" if context.cache_hit is CACHE_HIT else "misses" if context.cache_hit is CACHE_MISS else "uncached"
+    with _cache_lock:
+        _cache_outcomes[outcome] += 1
+
+
+def compiled_cache_stats() -> dict:
+    """hits: SQL taken from the engine's compiled cache; misses: compiled, then cached;
+    uncached: compiled every time (no cache key, or raw driver SQL)"""
+    with _cache_lock:
+        stats = dict(_cache_outcomes)
+    cached = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / cached if cached else None
+    return stats
+
+
+def dispose_engine(close: bool = True) -> None:
+    """Drop the pooled connections, if this process created the engine at all"""
+    if _engine is not None:
+        _engine.dispose(close=close)
+
+
+def __getattr__(name: str):
+    # `from app.database import engine` keeps working and creates the engine then
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazySession(Session):
+    """Session bound to get_engine() when it first needs a connection"""
+
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
+
+
+# Objects stay loaded after a commit, so nothing is read back just to build a response
+SessionLocal = sessionmaker(class_=LazySession, autocommit=False, autoflush=False, expire_on_commit=False)
 
 Base=declarative_base()
 
+# Session.info key: repositories only flush the writes of such a session, its owner commits them
+UNIT_OF_WORK = "unit_of_work"
+
 
 def get_db():
-    db = SessionLocal()
+    """Session of one request, committed once after the endpoint returned and rolled back if it raised"""
+    db = SessionLocal(info={UNIT_OF_WORK: True})
     try:
         yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
     finally:
         db.close()
 
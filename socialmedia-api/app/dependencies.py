@@ -7,6 +7,8 @@ from .repositories.database.user_repository import UserRepository
 from .repositories.database.vote_repository import VoteRepository
 from .repositories.database.follower_repository import FollowerRepository
 from .repositories.database.feed_repository import FeedRepository
+from .repositories.database.bulk_repository import BulkRepository
+from .repositories.database.outbox_repository import OutboxRepository
 
 # Repository Dependencies
 def get_post_repository(db: Session = Depends(get_db)) -> PostRepository:
@@ -22,4 +24,10 @@ def get_follower_repository(db: Session = Depends(get_db)) -> FollowerRepository
     return RepositoryFactory.create_follower_repository(db)
 
 def get_feed_repository(db: Session = Depends(get_db)) -> FeedRepository:
-    return RepositoryFactory.create_feed_repository(db)
\ No newline at end of file
+    return RepositoryFactory.create_feed_repository(db)
+
+def get_bulk_repository(db: Session = Depends(get_db)) -> BulkRepository:
+    return RepositoryFactory.create_bulk_repository(db)
+
+def get_outbox_repository(db: Session = Depends(get_db)) -> OutboxRepository:
+    return RepositoryFactory.create_outbox_repository(db)
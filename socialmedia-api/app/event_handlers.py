@@ -0,0 +1,75 @@
+"""Consumers of the outbox events (see app/events.py). Imported by app.main to register them."""
+from datetime import datetime
+from typing import List
+from .cache import cache
+from .events import Event, bus
+from .repositories.database.author_rings import author_rings
+from .repositories.database.category_cache import category_pages
+from .repositories.database.outbox_repository import (POST_CREATED, POST_UPDATED, POST_DELETED, POST_IMPORTED, VOTE_IMPORTED,
+                                                      USER_CREATED, USER_UPDATED)
+from .repositories.database.post_cache import hot_posts
+from .repositories.database.user_filters import user_filters
+from .repositories.database.user_repository import user_tag
+
+
+@bus.consumer("hot-posts", topics=("post.", "vote."), shared=False)
+async def evict_hot_posts(events: List[Event]) -> None:
+    # Writes evict their post from the cache of the worker that made them. The cache is
+    # keyed by version, so other workers never serve the old entry either, but they would
+    # keep it until it ages out; this drops it from every worker
+    for event in events:
+        post_id = event.payload.get("post_id")
+        if post_id is not None:
+            hot_posts.invalidate(post_id)
+
+
+@bus.consumer("hot-post-owners", topics=(USER_UPDATED,), shared=False)
+async def evict_hot_post_owners(events: List[Event]) -> None:
+    # A new name bumps the user's posts, so old entries are never served again; this drops them
+    for event in events:
+        hot_posts.invalidate_owner(event.payload["user_id"])
+
+
+@bus.consumer("author-rings", topics=(POST_CREATED, POST_DELETED, POST_IMPORTED), shared=False)
+async def update_author_rings(events: List[Event]) -> None:
+    # Every worker keeps rings of its own; applying an event twice changes nothing
+    for event in events:
+        if event.topic == POST_IMPORTED:
+            author_rings.clear()  # The event does not name the posts
+        elif event.topic == POST_CREATED:
+            payload = event.payload
+            author_rings.add(payload["user_id"], datetime.fromisoformat(payload["created_at"]), payload["post_id"])
+        else:
+            author_rings.remove(event.payload["user_id"], event.payload["post_id"])
+
+
+@bus.consumer("category-pages", topics=(POST_CREATED, POST_UPDATED, POST_DELETED, POST_IMPORTED, VOTE_IMPORTED), shared=False)
+async def invalidate_category_pages(events: List[Event]) -> None:
+    # Written by other workers; until this runs, a page of theirs is only caught if a post left it
+    for event in events:
+        category_id = event.payload.get("category_id")
+        if category_id is None:
+            category_pages.clear()  # Imports, which do not name their categories
+        else:
+            category_pages.invalidate(category_id)
+
+
+@bus.consumer("user-filters", topics=(USER_CREATED, USER_UPDATED), shared=False)
+async def add_to_user_filters(events: List[Event]) -> None:
+    # Names written by other workers; until this runs, registrations of them reach the unique
+    # constraints and contact imports miss them
+    for event in events:
+        user_filters.add(event.payload.get("email"), event.payload.get("username"))
+
+
+@bus.consumer("user-cache", topics=(USER_CREATED, USER_UPDATED))
+async def invalidate_user_cache(events: List[Event]) -> None:
+    # The write invalidated the user right after its flush; a reader may have cached the old
+    # record again before the commit, so the L2 entries go once more now that it is in
+    cache.invalidate(*(user_tag(event.payload["user_id"]) for event in events))
+
+
+@bus.consumer("user-cache-local", topics=(USER_CREATED, USER_UPDATED), shared=False)
+async def evict_user_cache(events: List[Event]) -> None:
+    # The same for the L1 of every worker, which a shared consumer only reaches in one of them
+    cache.evict_local(*(user_tag(event.payload["user_id"]) for event in events))
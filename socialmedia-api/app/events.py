@@ -0,0 +1,191 @@
+"""In-process event bus fed from the transactional outbox (repositories/database/outbox_repository.py).
+
+Consumers are async functions registered on `bus` for topic prefixes. They receive events
+in batches, in the order the outbox defines, so side effects that do not have to finish
+before the response (cache eviction, counters, notifications) run here instead of inside
+the request:
+
+    @bus.consumer("search-index", topics=("post.",))
+    async def index_posts(events: List[Event]) -> None:
+        ...
+
+Delivery is at least once. A consumer's position only moves after its handler returned,
+so a handler that raises gets the same batch again after a backoff, and handlers must
+tolerate seeing an event twice.
+
+A shared consumer (the default) runs once across all workers: its position is a row in
+outbox_checkpoints, claimed by one dispatcher at a time. A per-process consumer runs in
+every worker with an in-memory position that starts at the head of the outbox when the
+worker starts, which suits in-memory state such as the hot post cache.
+
+Each poll uses one session. The per-process consumers share one read of the outbox, from
+the position of the one furthest behind, and each gets the events past its own position.
+"""
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .database import SessionLocal
+from .repositories.repository_factory import RepositoryFactory
+
+# Longest wait before a failed batch is retried
+MAX_BACKOFF_SECONDS = 30
+
+
+@dataclass(frozen=True)
+class Event:
+    id: int
+    txid: int
+    topic: str
+    payload: dict
+    created_at: datetime
+
+
+Handler = Callable[[List[Event]], Awaitable[None]]
+
+
+@dataclass
+class Consumer:
+    name: str
+    topics: Tuple[str, ...]
+    handler: Handler
+    shared: bool
+    # In-memory position of a per-process consumer
+    position: Optional[Tuple[int, int]] = None
+    failures: int = 0
+    retry_at: float = 0.0
+
+    def wants(self, topic: str) -> bool:
+        return any(topic.startswith(prefix) for prefix in self.topics)
+
+
+class EventBus:
+    def __init__(self):
+        self.consumers: Dict[str, Consumer] = {}
+
+    def consumer(self, name: str, topics: Tuple[str, ...] = ("",), shared: bool = True):
+        """Register the decorated coroutine for events whose topic starts with one of topics"""
+        def register(handler: Handler) -> Handler:
+            if name in self.consumers:
+                raise ValueError(f"Consumer {name} is already registered")
+            self.consumers[name] = Consumer(name, tuple(topics), handler, shared)
+            return handler
+        return register
+
+
+class Dispatcher:
+    def __init__(self, bus: EventBus, poll_seconds: float, batch_size: int, shared: bool = True, per_process: bool = True):
+        self.bus = bus
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        # Which kinds of consumer this dispatcher delivers to; the maintenance CLI runs no
+        # per-process consumers, their state lives in the API workers
+        self.shared = shared
+        self.per_process = per_process
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                delivered = await self.dispatch_once()
+            except Exception as exc:
+                print(f"outbox dispatcher: {exc}")
+                delivered = 0
+            # A full batch means more events are waiting
+            if delivered < self.batch_size:
+                await asyncio.sleep(self.poll_seconds)
+
+    async def dispatch_once(self) -> int:
+        """Hand every due consumer its next batch; the largest batch size read"""
+        now = asyncio.get_running_loop().time()
+        due = [consumer for consumer in self.bus.consumers.values()
+               if consumer.retry_at <= now and (self.shared if consumer.shared else self.per_process)]
+        if not due:
+            return 0
+        db = SessionLocal()
+        try:
+            outbox_repo = RepositoryFactory.create_outbox_repository(db)
+            read = await self._deliver_per_process(outbox_repo, [consumer for consumer in due if not consumer.shared])
+            for consumer in due:
+                if consumer.shared:
+                    read = max(read, await self._deliver_shared(outbox_repo, consumer))
+            return read
+        finally:
+            # Rolls back and so releases an unsaved claim
+            await run_in_threadpool(db.close)
+
+    async def _deliver_per_process(self, outbox_repo, consumers: List[Consumer]) -> int:
+        if not consumers:
+            return 0
+
+        def read() -> List[Event]:
+            if any(consumer.position is None for consumer in consumers):
+                head = outbox_repo.head()
+                for consumer in consumers:
+                    if consumer.position is None:
+                        consumer.position = head
+            events = self._events(outbox_repo.read_events(min(consumer.position for consumer in consumers), self.batch_size))
+            outbox_repo.db.rollback()  # no transaction left open while the handlers run
+            return events
+
+        events = await run_in_threadpool(read)
+        for consumer in consumers:
+            pending = [event for event in events if (event.txid, event.id) > consumer.position]
+            if pending and await self._handle(consumer, pending):
+                consumer.position = (pending[-1].txid, pending[-1].id)
+        return len(events)
+
+    async def _deliver_shared(self, outbox_repo, consumer: Consumer) -> int:
+        def claim_and_read() -> List[Event]:
+            position = outbox_repo.claim_checkpoint(consumer.name)
+            events = [] if position is None else self._events(outbox_repo.read_events(position, self.batch_size))
+            if not events:
+                outbox_repo.db.rollback()  # releases the claim for the next consumer of this session
+            return events
+
+        events = await run_in_threadpool(claim_and_read)
+        if not events:
+            return 0  # nothing new, or another worker is delivering to it
+        if not await self._handle(consumer, events):
+            await run_in_threadpool(outbox_repo.db.rollback)
+            return 0
+        await run_in_threadpool(outbox_repo.save_checkpoint, consumer.name, (events[-1].txid, events[-1].id))
+        return len(events)
+
+    @staticmethod
+    def _events(rows) -> List[Event]:
+        # Copied out of the ORM rows, which the rollback that follows expires
+        return [Event(row.id, row.txid, row.topic, row.payload, row.created_at) for row in rows]
+
+    async def _handle(self, consumer: Consumer, events: List[Event]) -> bool:
+        """Run the consumer on the events it wants; False, with a backoff, if it raised"""
+        wanted = [event for event in events if consumer.wants(event.topic)]
+        try:
+            if wanted:
+                await consumer.handler(wanted)
+        except Exception as exc:
+            consumer.failures += 1
+            backoff = min(self.poll_seconds * 2 ** consumer.failures, MAX_BACKOFF_SECONDS)
+            consumer.retry_at = asyncio.get_running_loop().time() + backoff
+            print(f"outbox consumer {consumer.name} failed, retrying in {backoff:.1f}s: {exc}")
+            return False
+        consumer.failures = 0
+        return True
+
+bus = EventBus()
+dispatcher = Dispatcher(bus, settings.outbox_poll_ms / 1000, settings.outbox_batch_size, shared=settings.outbox_shared_consumers)
@@ -0,0 +1,58 @@
+"""Builds the user filters (repositories/database/user_filters.py) when a worker starts, and again every user_filter_rebuild_seconds.
+
+A build reads every email and username in a worker thread, so requests keep being served
+from the old filters, or from the database before the first build. A rebuild sheds the names
+users no longer have and resizes the filters for the users there are now.
+"""
+import asyncio
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .database import SessionLocal
+from .repositories.database.user_filters import UserFilters, user_filters
+from .repositories.repository_factory import RepositoryFactory
+
+# Wait before retrying a build that failed
+RETRY_SECONDS = 30
+
+
+def build(filters: UserFilters) -> None:
+    db = SessionLocal()
+    try:
+        user_repo = RepositoryFactory.create_user_repository(db)
+        filters.rebuild(user_repo.count_users(), user_repo.get_user_logins())
+    finally:
+        db.close()
+
+
+class FilterRefresher:
+    def __init__(self, filters: UserFilters, rebuild_seconds: float):
+        self.filters = filters
+        self.rebuild_seconds = rebuild_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.filters.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await run_in_threadpool(build, self.filters)
+                wait = self.rebuild_seconds
+            except Exception as exc:
+                print(f"user filters: {exc}")
+                wait = RETRY_SECONDS
+            await asyncio.sleep(wait)
+
+
+refresher = FilterRefresher(user_filters, settings.user_filter_rebuild_seconds)
@@ -0,0 +1,52 @@
+"""Routers imported on their first request instead of when the app is built.
+
+A router module pulls in its handlers, their schemas and whatever they use; for a rarely
+used router (the admin endpoints: bulk import and export, metrics) that is start-up time
+every worker pays for requests it may never see. LazyRouter stands in for it: it matches
+every path under the prefix and imports the router the first time one comes in.
+
+The routes are not in app.routes until loaded, so create_app() loads every lazy router
+before it builds the OpenAPI schema.
+"""
+import importlib
+import threading
+from typing import Optional, Tuple
+from fastapi import APIRouter, FastAPI
+from starlette.routing import BaseRoute, Match
+from starlette.types import Receive, Scope, Send
+
+
+class LazyRouter(BaseRoute):
+    def __init__(self, app: FastAPI, prefix: str, module: str):
+        self.app = app
+        self.prefix = prefix
+        # Dotted path of a module with a `router`, relative to the app package
+        self.module = module
+        self._router: Optional[APIRouter] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> APIRouter:
+        """The router, imported on the first call"""
+        if self._router is None:
+            with self._lock:
+                if self._router is None:
+                    module = importlib.import_module(self.module, __package__)
+                    # Included the way app.include_router would, so app.dependency_overrides apply
+                    router = APIRouter(dependency_overrides_provider=self.app)
+                    router.include_router(module.router)
+                    self._router = router
+        return self._router
+
+    def matches(self, scope: Scope) -> Tuple[Match, Scope]:
+        if scope["type"] in ("http", "websocket"):
+            path = scope["path"]
+            if path == self.prefix or path.startswith(self.prefix + "/"):
+                return Match.FULL, {}
+        return Match.NONE, {}
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Its own routes answer 404 and 405 under the prefix as they would when included
+        await self.load()(scope, receive, send)
+
+    def url_path_for(self, name: str, /, **path_params):
+        return self.load().url_path_for(name, **path_params)
@@ -0,0 +1,191 @@
+"""Live vote counts pushed to subscribers as Server-Sent Events.
+
+Vote writes NOTIFY the post id on VOTES_CHANNEL (see VoteRepository), which Postgres
+delivers to every worker once the write commits. Each worker runs one LISTEN connection
+in a thread that marks the post dirty. Every tick, the hub reads the counts of the dirty
+posts somebody subscribed to in one query, and hands each subscriber the posts whose
+counts changed since the last push. Votes on the same post within a tick become one update.
+
+A subscriber is a coroutine waiting on an asyncio.Event, so idle connections cost no
+thread and no database connection. The hub starts with the first subscription.
+"""
+import asyncio
+import json
+import select
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .database import SessionLocal, SQLALCHEMY_DATABASE_URL
+from .repositories.repository_factory import RepositoryFactory
+from .repositories.database.vote_repository import VOTES_CHANNEL
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+# Sent when nothing changed for this long, so proxies keep idle connections open
+HEARTBEAT_SECONDS = 15
+
+Counts = Tuple[int, int, int]  # Votes, Upvotes, Downvotes
+
+
+class Subscription:
+    def __init__(self, post_ids: Iterable[int]):
+        self.post_ids = frozenset(post_ids)
+        # Latest counts not yet sent; a post changed twice before the send is sent once
+        self.pending: Dict[int, Counts] = {}
+        self.wake = asyncio.Event()
+
+    def push(self, post_id: int, counts: Counts) -> None:
+        self.pending[post_id] = counts
+        self.wake.set()
+
+    def take(self) -> Dict[int, Counts]:
+        pending, self.pending = self.pending, {}
+        self.wake.clear()
+        return pending
+
+
+class LiveVoteHub:
+    def __init__(self, tick_seconds: float):
+        self.tick_seconds = tick_seconds
+        self.subscribers: Dict[int, Set[Subscription]] = {}
+        self.counts: Dict[int, Counts] = {}
+        # Initial counts being read; later subscribers to the same posts wait for that read
+        self._loading: Dict[int, asyncio.Future] = {}
+        # Filled by the listener thread, drained by the tick on the event loop
+        self._dirty: Set[int] = set()
+        self._dirty_lock = threading.Lock()
+        self._ticker: Optional[asyncio.Task] = None
+
+    def mark_dirty(self, post_id: int) -> None:
+        with self._dirty_lock:
+            self._dirty.add(post_id)
+
+    async def subscribe(self, post_ids: Iterable[int]) -> Subscription:
+        self._start()
+        subscription = Subscription(post_ids)
+        for post_id in subscription.post_ids:
+            self.subscribers.setdefault(post_id, set()).add(subscription)
+        try:
+            await self._load_counts(subscription.post_ids)
+        except BaseException:
+            self.unsubscribe(subscription)
+            raise
+        for post_id in subscription.post_ids:
+            subscription.pending[post_id] = self.counts.get(post_id, (0, 0, 0))
+        subscription.wake.set()
+        return subscription
+
+    async def _load_counts(self, post_ids) -> None:
+        missing = [post_id for post_id in post_ids if post_id not in self.counts]
+        load = [post_id for post_id in missing if post_id not in self._loading]
+        if load:
+            loaded = asyncio.get_running_loop().create_future()
+            for post_id in load:
+                self._loading[post_id] = loaded
+            try:
+                self.counts.update(await run_in_threadpool(read_counts, load))
+                loaded.set_result(True)
+            except BaseException:
+                loaded.set_result(False)
+                raise
+            finally:
+                for post_id in load:
+                    self._loading.pop(post_id, None)
+        waits = {self._loading[post_id] for post_id in missing if post_id in self._loading}
+        if waits:
+            await asyncio.gather(*waits)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for post_id in subscription.post_ids:
+            subscribers = self.subscribers.get(post_id)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[post_id]
+                self.counts.pop(post_id, None)
+
+    def _start(self) -> None:
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.get_running_loop().create_task(self._tick_forever())
+            threading.Thread(target=listen, args=(self,), name="live-votes-listener", daemon=True).start()
+
+    async def _tick_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                await self.tick()
+            except Exception as exc:
+                print(f"live votes tick failed: {exc}")
+
+    async def tick(self) -> None:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        watched = [post_id for post_id in dirty if post_id in self.subscribers]
+        if not watched:
+            return
+        for post_id, counts in (await run_in_threadpool(read_counts, watched)).items():
+            if self.counts.get(post_id) == counts or post_id not in self.subscribers:
+                continue
+            self.counts[post_id] = counts
+            for subscription in self.subscribers[post_id]:
+                subscription.push(post_id, counts)
+
+
+def read_counts(post_ids) -> Dict[int, Counts]:
+    db = SessionLocal()
+    try:
+        counts = RepositoryFactory.create_vote_repository(db).get_vote_counts_for_posts(post_ids)
+    finally:
+        db.close()
+    return {post_id: counts.get(post_id, (0, 0, 0)) for post_id in post_ids}
+
+
+def listen(hub: LiveVoteHub) -> None:
+    """LISTEN on VOTES_CHANNEL for the life of the process, reconnecting after errors"""
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(SQLALCHEMY_DATABASE_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {VOTES_CHANNEL}")
+            # Votes may have been missed while disconnected
+            for post_id in list(hub.subscribers):
+                hub.mark_dirty(post_id)
+            while True:
+                if select.select([conn], [], [], HEARTBEAT_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    hub.mark_dirty(int(conn.notifies.pop(0).payload))
+        except Exception as exc:
+            print(f"live votes listener: {exc}")
+            if conn is not None:
+                conn.close()
+            time.sleep(1)
+
+
+async def event_stream(hub: LiveVoteHub, post_ids: Iterable[int]) -> AsyncIterator[str]:
+    """One `votes` event with the current counts, then one per tick with the posts that changed"""
+    subscription = await hub.subscribe(post_ids)
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(subscription.wake.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            changes = [
+                {"post_id": post_id, "Votes": votes, "Upvotes": upvotes, "Downvotes": downvotes}
+                for post_id, (votes, upvotes, downvotes) in subscription.take().items()
+            ]
+            yield f"event: votes\ndata: {json.dumps(changes)}\n\n"
+    finally:
+        hub.unsubscribe(subscription)
+
+
+live_votes = LiveVoteHub(settings.live_votes_tick_ms / 1000)
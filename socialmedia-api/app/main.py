@@ -1,36 +1,90 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from . import models
-from .database import engine
+from . import models, event_handlers
+from .admission import AdmissionLimit
+from .compression import Compression
+from .events import dispatcher
+from .filter_refresh import refresher
+from .lazy_router import LazyRouter
 from .routes import post, user, auth, vote, follow
 from .config import settings
 
-# models.Base.metadata.create_all(bind=engine)
-app = FastAPI()
+# Rarely used routers, imported by their first request (see lazy_router.py): prefix -> module
+LAZY_ROUTERS = {
+    "/admin": ".routes.admin",
+}
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-#title: str, content: str, categpry:str, Bool published:bool = True
-app.include_router(post.router)
-app.include_router(user.router) # goes into user file and import all the router types
-app.include_router(auth.router)
-app.include_router(vote.router)
-app.include_router(follow.router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    dispatcher.start()
+    refresher.start()
+    yield
+    await refresher.stop()
+    await dispatcher.stop()
 
-@app.get("/")
-def read_root():
-    return {"message": "Welcome to my URL"}
+
+def create_app() -> FastAPI:
+    """Build the API.
+
+    Servers call it once per worker (gunicorn.conf.py, `uvicorn --factory app.main:create_app`).
+    Nothing here connects to the database: the engine is created by the first query.
+    """
+    # models.Base.metadata.create_all(bind=engine)
+    app = FastAPI(lifespan=lifespan)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Requests wait for a place before anything else runs
+    app.add_middleware(AdmissionLimit, limit=settings.db_pool_size)
+    # Around the admission limit: a request gives back its place as its response starts, before
+    # the body is compressed
+    app.add_middleware(Compression, encodings=settings.compression_encodings,
+                       minimum_size=settings.compression_minimum_size, thread_size=settings.compression_thread_size,
+                       gzip_level=settings.gzip_level, brotli_quality=settings.brotli_quality)
+
+    #title: str, content: str, categpry:str, Bool published:bool = True
+    app.include_router(post.router)
+    app.include_router(user.router) # goes into user file and import all the router types
+    app.include_router(auth.router)
+    app.include_router(vote.router)
+    app.include_router(follow.router)
+    lazy_routers = [LazyRouter(app, prefix, module) for prefix, module in LAZY_ROUTERS.items()]
+    app.router.routes.extend(lazy_routers)
+
+    build_openapi = app.openapi
+
+    def openapi():
+        # The schema lists every route, so the lazy ones are loaded first. Their routes are
+        # appended behind the stand-ins, which keep answering for them
+        if app.openapi_schema is None:
+            for lazy in lazy_routers:
+                app.router.routes.extend(lazy.load().routes)
+        return build_openapi()
+
+    app.openapi = openapi
+
+    @app.get("/")
+    def read_root():
+        return {"message": "Welcome to my URL"}
+
+    return app
+
+
+def __getattr__(name: str):
+    # `app.main:app` (uvicorn app.main:app, TestClient(app)) builds the app on first access
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # @app.get("/sqlalchemy")
 # def test_Posts(db: Session = Depends(get_db)):
 #     posts=db.query(models.Post).all()
 #     return {"data":posts}
-
-
-
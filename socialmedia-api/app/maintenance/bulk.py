@@ -0,0 +1,61 @@
+"""Bulk import and export of posts, votes and follows through COPY.
+
+    python -m app.maintenance.bulk import posts posts.ndjson
+    python -m app.maintenance.bulk import votes votes.csv --format csv
+    python -m app.maintenance.bulk export follows --format csv > follows.csv
+
+Imported rows are validated with the API schemas (app.schemas.BulkPost,
+BulkVote, BulkFollow) and loaded in batches of --batch-size rows, one
+transaction per batch. Rows pointing at users or posts that do not exist and
+rows that are already there are skipped. `-` reads stdin. Export writes to
+stdout (or --output) straight from COPY TO STDOUT.
+"""
+import argparse
+import json
+import sys
+
+from ..repositories.database.bulk_repository import BATCH_SIZE, BULK_TABLES
+
+FORMATS = ("ndjson", "csv")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance.bulk", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("import", help="load an NDJSON or CSV file")
+    load.add_argument("kind", choices=list(BULK_TABLES))
+    load.add_argument("path", help="file to read, - for stdin")
+    load.add_argument("--format", choices=FORMATS, help="defaults to the file extension, ndjson otherwise")
+    load.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    dump = commands.add_parser("export", help="write a whole table as NDJSON or CSV")
+    dump.add_argument("kind", choices=list(BULK_TABLES))
+    dump.add_argument("--format", choices=FORMATS, default="csv")
+    dump.add_argument("--output", help="file to write, stdout by default")
+    args = parser.parse_args(argv)
+
+    from ..database import SessionLocal  # needs the DATABASE_* settings
+    from ..repositories.repository_factory import RepositoryFactory
+
+    db = SessionLocal()
+    try:
+        bulk_repo = RepositoryFactory.create_bulk_repository(db)
+        if args.command == "import":
+            fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+            source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", newline="" if fmt == "csv" else None)
+            with source:
+                result = bulk_repo.import_rows(args.kind, source, fmt, args.batch_size)
+            print(json.dumps(result, indent=2))
+        else:
+            target = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+            try:
+                bulk_repo.export_rows(args.kind, target, args.format)
+            finally:
+                if args.output:
+                    target.close()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
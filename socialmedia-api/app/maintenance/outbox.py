@@ -0,0 +1,58 @@
+"""Run the outbox dispatcher on its own, inspect consumer checkpoints and prune old events.
+
+    python -m app.maintenance.outbox run
+    python -m app.maintenance.outbox status
+    python -m app.maintenance.outbox prune --keep-days 7
+
+`run` delivers to the shared consumers (see app/events.py) until interrupted. The API
+workers do the same unless OUTBOX_SHARED_CONSUMERS=false; both can run at once, each
+consumer is claimed by one dispatcher at a time. `status` shows where every shared
+consumer stands and how many events it has left. `prune` deletes events older than
+--keep-days that every shared consumer has handled; run it from cron.
+"""
+import argparse
+import asyncio
+
+DEFAULT_KEEP_DAYS = 7
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance.outbox", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="deliver events to the shared consumers until interrupted")
+    commands.add_parser("status", help="show the checkpoint and lag of every shared consumer")
+    prune = commands.add_parser("prune", help="delete old events every shared consumer has handled")
+    prune.add_argument("--keep-days", type=int, default=DEFAULT_KEEP_DAYS)
+    args = parser.parse_args(argv)
+
+    from ..config import settings  # needs the DATABASE_* settings
+    from ..database import SessionLocal
+    from ..events import Dispatcher, bus
+    from ..repositories.repository_factory import RepositoryFactory
+    from .. import event_handlers  # registers the consumers
+
+    if args.command == "run":
+        dispatcher = Dispatcher(bus, settings.outbox_poll_ms / 1000, settings.outbox_batch_size, per_process=False)
+        try:
+            asyncio.run(dispatcher.run())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    db = SessionLocal()
+    try:
+        outbox_repo = RepositoryFactory.create_outbox_repository(db)
+        if args.command == "status":
+            txid, event_id = outbox_repo.head()
+            print(f"head: txid {txid} event {event_id}")
+            for consumer, txid, event_id, updated_at, lag in outbox_repo.get_checkpoints():
+                print(f"{consumer:24} txid {txid} event {event_id} lag {lag} updated {updated_at:%Y-%m-%d %H:%M:%S}")
+        else:
+            print(f"deleted {outbox_repo.prune(args.keep_days)} events")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Create and archive the monthly partitions of posts and votes.
+
+posts is range partitioned on created_at and votes on post_created_at (the
+created_at of the voted post), with the same monthly bounds. Run from cron:
+
+    python -m app.maintenance.partitions ensure --months-ahead 3
+    python -m app.maintenance.partitions archive --keep-months 12
+    python -m app.maintenance.partitions list
+
+`ensure` creates the partitions for the coming months before rows need them.
+There is no DEFAULT partition (it would stop Postgres from scanning partitions
+in order), so inserting a row for a month without a partition fails.
+`archive` detaches months older than --keep-months and moves them to the
+`archive` schema, or drops them with --drop.
+"""
+import argparse
+import re
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+DEFAULT_MONTHS_AHEAD = 3
+DEFAULT_KEEP_MONTHS = 12
+ARCHIVE_SCHEMA = "archive"
+# DETACH PARTITION locks the parent table; fail instead of queueing every feed query behind it
+LOCK_TIMEOUT = "5s"
+
+# votes reference posts, so a month's votes partition is created after and detached before its posts partition
+PARTITIONED_TABLES = ("posts", "votes")
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def current_month() -> date:
+    return month_start(datetime.now(timezone.utc))
+
+
+def month_partitions(conn: Connection, table: str) -> Dict[date, str]:
+    """Monthly partitions currently attached to `table`, by month."""
+    rows = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:table AS regclass)
+    """), {"table": table}).scalars()
+    pattern = re.compile(rf"^{table}_p(\d{{4}})_(\d{{2}})$")
+    partitions = {}
+    for name in rows:
+        match = pattern.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def ensure_partitions(conn: Connection, months_ahead: int = DEFAULT_MONTHS_AHEAD,
+                      since: Optional[date] = None) -> List[str]:
+    """Create the missing monthly partitions from `since` (default: this month) to `months_ahead`.
+
+    Returns the names of the partitions created.
+    """
+    first = month_start(since) if since else current_month()
+    last = add_months(current_month(), months_ahead)
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return ensure_month_partitions(conn, months)
+
+
+def ensure_month_partitions(conn: Connection, months: Iterable) -> List[str]:
+    """Create the missing partitions for just the months of the given dates.
+
+    Used for backfills, so a few old rows do not create every month in between.
+    Returns the names of the partitions created.
+    """
+    months = sorted({month_start(value) for value in months})
+    created = []
+    for table in PARTITIONED_TABLES:
+        existing = month_partitions(conn, table)
+        for month in months:
+            if month not in existing:
+                lower, upper = f"{month} 00:00:00+00", f"{add_months(month, 1)} 00:00:00+00"
+                name = partition_name(table, month)
+                conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} "
+                                  f"FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+                created.append(name)
+    return created
+
+
+def archive_partitions(conn: Connection, keep_months: int = DEFAULT_KEEP_MONTHS, drop: bool = False) -> List[str]:
+    """Detach the months before the last `keep_months` and archive (or drop) them.
+
+    Returns the names of the partitions detached.
+    """
+    cutoff = add_months(current_month(), -keep_months)
+    posts = month_partitions(conn, "posts")
+    votes = month_partitions(conn, "votes")
+    detached = []
+    if not drop:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+
+    for month in sorted(m for m in posts if m < cutoff):
+        names = []
+        if month in votes:
+            name = votes[month]
+            conn.execute(text(f"ALTER TABLE votes DETACH PARTITION {name}"))
+            # The detached table keeps its foreign key to posts, which would block detaching
+            # the posts partition its rows point into
+            foreign_keys = conn.execute(text("""
+                SELECT conname FROM pg_constraint
+                WHERE conrelid = CAST(:name AS regclass) AND confrelid = CAST('posts' AS regclass)
+            """), {"name": name}).scalars().all()
+            for constraint in foreign_keys:
+                conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+            names.append(name)
+        conn.execute(text(f"ALTER TABLE posts DETACH PARTITION {posts[month]}"))
+        names.append(posts[month])
+
+        for name in names:
+            if drop:
+                conn.execute(text(f"DROP TABLE {name}"))
+            else:
+                conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        detached.extend(names)
+    return detached
+
+
+def list_partitions(conn: Connection) -> List[tuple]:
+    """(table, partition, bounds, estimated rows) for every partition of posts and votes."""
+    return conn.execute(text("""
+        SELECT p.relname, c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname IN ('posts', 'votes')
+        ORDER BY p.relname, c.relname
+    """)).all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance.partitions", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure = commands.add_parser("ensure", help="create the partitions for the coming months")
+    ensure.add_argument("--months-ahead", type=int, default=DEFAULT_MONTHS_AHEAD)
+    archive = commands.add_parser("archive", help="detach old months and archive or drop them")
+    archive.add_argument("--keep-months", type=int, default=DEFAULT_KEEP_MONTHS,
+                         help="months kept attached, counting back from the current one")
+    archive.add_argument("--drop", action="store_true", help=f"drop instead of moving to the {ARCHIVE_SCHEMA} schema")
+    commands.add_parser("list", help="show the partitions and their estimated row counts")
+    args = parser.parse_args(argv)
+
+    from ..database import engine  # needs the DATABASE_* settings
+
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+        if args.command == "ensure":
+            created = ensure_partitions(conn, args.months_ahead)
+            print("\n".join(f"created {name}" for name in created) or "nothing to create")
+        elif args.command == "archive":
+            detached = archive_partitions(conn, args.keep_months, args.drop)
+            action = "dropped" if args.drop else f"moved to {ARCHIVE_SCHEMA}"
+            print("\n".join(f"{action} {name}" for name in detached) or "nothing to archive")
+        else:
+            for table, name, bounds, rows in list_partitions(conn):
+                print(f"{table:6} {name:16} {bounds:70} ~{max(rows, 0)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,42 @@
 from .database import Base
-from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, Identity, String, Boolean, Float, TIMESTAMP, ForeignKey, ForeignKeyConstraint, and_, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 class Post(Base):
     __tablename__ = 'posts'
 
-    id=Column(Integer, primary_key=True, nullable=False)
+    id=Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     title=Column(String(100), nullable=False)
     content= Column(String(1000),nullable=False)
     published=Column(Boolean, server_default='True',nullable=True) #it wont add default in db, if the table already exists, sqlalchemy it doesn't change anything or modify in an already present table.
     rating= Column(Integer,nullable=False)
-    created_at=Column(TIMESTAMP(timezone=True), server_default='now()',nullable=False)
+    # Partition key: monthly range partitions (see app/maintenance/partitions.py), so it is part of the primary key
+    created_at=Column(TIMESTAMP(timezone=True), primary_key=True, server_default=text('now()'),nullable=False)
     category=Column(String(50), nullable=False)
+    # The category's row in categories, which the category indexes and recommendations use;
+    # set from category by PostRepository on every write that names one
+    category_id=Column(Integer, ForeignKey("categories.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable= False)
+    # Bumped on edits and votes (app/repositories/database/versions.py), for ETag/Last-Modified
+    version=Column(Integer, server_default=text('1'), nullable=False)
+    updated_at=Column(TIMESTAMP(timezone=True), server_default=text('now()'), nullable=False)
+    # Upvotes - downvotes, and the hot rank of feed_type=hot computed from it, moved by every
+    # vote (versions.touch_voted_post). The default is the rank of a post created now without votes
+    net_votes=Column(Integer, server_default=text('0'), nullable=False)
+    hot_score=Column(Float, server_default=text('extract(epoch from now())::float8 / 45000'), nullable=False)
     owner = relationship("User") 
 
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+    # Server defaults and SQL expression updates (version + 1) come back with RETURNING instead of a SELECT
+    __mapper_args__ = {"eager_defaults": True}
+
+class Category(Base):
+    """A distinct posts.category, numbered so posts are indexed and grouped on an int"""
+    __tablename__ = 'categories'
+
+    id=Column(Integer, Identity(), primary_key=True)
+    name=Column(String(50), nullable=False, unique=True)
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -22,8 +45,14 @@ class User(Base):
     full_name = Column(String(100), nullable=True)  
     email=Column(String(100), nullable=False, unique=True)
     password=Column(String(100),nullable=False)
-    created_at=Column(TIMESTAMP(timezone=True), server_default='now()',nullable=False)
+    created_at=Column(TIMESTAMP(timezone=True), server_default=text('now()'),nullable=False)
     phone_number=Column(String(15), nullable=True)
+    # Bumped on profile edits and on anything that changes the profile stats
+    version=Column(Integer, server_default=text('1'), nullable=False)
+    updated_at=Column(TIMESTAMP(timezone=True), server_default=text('now()'), nullable=False)
+    # Maintained follow counts, served once they reach settings.exact_count_limit
+    followers_count=Column(Integer, server_default=text('0'), nullable=False)
+    following_count=Column(Integer, server_default=text('0'), nullable=False)
 
     followers = relationship(
         "Followers", 
@@ -39,13 +68,25 @@ class User(Base):
         back_populates="follower_user",
         cascade="all, delete-orphan"
     )
+
+    __mapper_args__ = {"eager_defaults": True}
     
 
 class Votes(Base):
     __tablename__ = 'votes'
-    post_id=Column(Integer, ForeignKey("posts.id", ondelete="CASCADE") ,primary_key=True, nullable=False)
+    post_id=Column(Integer, primary_key=True, nullable=False)
     user_id=Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
     dir = Column(Integer, nullable=False)
+    # created_at of the voted post: votes are partitioned on it with the same monthly bounds as posts
+    post_created_at=Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False)
+
+    __table_args__ = (
+        ForeignKeyConstraint(["post_id", "post_created_at"], ["posts.id", "posts.created_at"], ondelete="CASCADE"),
+        {"postgresql_partition_by": "RANGE (post_created_at)"},
+    )
+
+# Join votes to their post on both columns so votes partitions are pruned along with posts partitions
+POST_VOTES_JOIN = and_(Votes.post_id == Post.id, Votes.post_created_at == Post.created_at)
 
 class Followers(Base):
     __tablename__ = 'followers'
@@ -53,6 +94,8 @@ class Followers(Base):
     follower_id=Column(Integer, ForeignKey("users.id", ondelete='CASCADE'),primary_key=True,nullable=False)
     following_id=Column(Integer,ForeignKey("users.id", ondelete='CASCADE'), primary_key=True,nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default='now()', nullable=False)
+    # Whether following_id follows follower_id back; kept in step by FollowerRepository
+    mutual = Column(Boolean, server_default=text('false'), nullable=False)
 
 
     # The user who is doing the following
@@ -70,4 +113,24 @@ class Followers(Base):
     )
     __table_args__ = (
         # This will be handled by the database constraint we created in migration
-    )
\ No newline at end of file
+    )
+
+
+class OutboxEvent(Base):
+    """A write, recorded in the transaction that made it, for the consumers in app/events.py"""
+    __tablename__ = 'outbox_events'
+
+    id=Column(BigInteger, Identity(), primary_key=True)
+    txid=Column(BigInteger, server_default=text('pg_current_xact_id()::text::bigint'), nullable=False)
+    topic=Column(String(50), nullable=False)
+    payload=Column(JSONB, nullable=False)
+    created_at=Column(TIMESTAMP(timezone=True), server_default=text('now()'), nullable=False)
+
+class OutboxCheckpoint(Base):
+    """Position of a shared consumer: the (txid, id) of the last event it has handled"""
+    __tablename__ = 'outbox_checkpoints'
+
+    consumer=Column(String(100), primary_key=True)
+    txid=Column(BigInteger, nullable=False)
+    event_id=Column(BigInteger, nullable=False)
+    updated_at=Column(TIMESTAMP(timezone=True), server_default=text('now()'), nullable=False)
@@ -0,0 +1,46 @@
+"""Proactive negotiation (RFC 9110 12.5): which of what the server offers a request prefers.
+
+Accept lists media ranges, Accept-Encoding content codings, each with an optional weight:
+`application/msgpack, application/json;q=0.5` or `br;q=1.0, gzip;q=0.8, *;q=0.1`.
+"""
+from typing import Dict, Optional, Sequence
+
+
+def weights(header: str) -> Dict[str, float]:
+    """The weight of every value of an Accept or Accept-Encoding header, 1 where none is given"""
+    found = {}
+    for item in header.split(","):
+        value, *params = item.split(";")
+        value = value.strip().lower()
+        if not value:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(number)
+                except ValueError:
+                    weight = 0.0
+        found[value] = weight
+    return found
+
+
+def negotiate(header: Optional[str], offered: Sequence[str]) -> Optional[str]:
+    """The offered value header weighs highest, the first of equals; None if it accepts none of them.
+
+    A value is weighed by its most specific match: itself, then its type/* range (media
+    types), then */* or *. Without the header, anything is acceptable.
+    """
+    if header is None:
+        return offered[0] if offered else None
+    accepted = weights(header)
+    best, best_weight = None, 0.0
+    for value in offered:
+        kind = value.split("/")[0]
+        for candidate in (value, f"{kind}/*", "*/*", "*"):
+            if candidate in accepted:
+                if accepted[candidate] > best_weight:
+                    best, best_weight = value, accepted[candidate]
+                break
+    return best
@@ -5,6 +5,8 @@ from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from .config import settings
+from .dependencies import get_user_repository
+from .repositories.database.user_repository import UserRepository
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='login')
 
@@ -41,11 +43,22 @@ def verify_access_token(token: str, credentials_exception):
     print(token_data)
     return token_data
     
-def get_current_user(token:str = Depends(oauth2_scheme),db: Session = Depends(database.get_db)):
+def get_current_user(token:str = Depends(oauth2_scheme),user_repo: UserRepository = Depends(get_user_repository)):
     credentials_exception= HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Could not validate credentials", headers={"WWW-Authenticate":"Bearer"})
 
 
     token = verify_access_token(token, credentials_exception)
-    user=db.query(models.User).filter(models.User.id == token.id).first()
-    return user
+    # Every authenticated request looks up its user: through the cache (app/cache.py), not the database
+    user = user_repo.get_cached_user(int(token.id))
+    return None if user is None else schemas.UserResponse.model_construct(**user)
 
+def get_current_user_id(token:str = Depends(oauth2_scheme)) -> int:
+    """The token's user id without a database lookup. For streaming responses: a get_db session
+    stays checked out until the response ends, which would tie up a pool connection per stream"""
+    credentials_exception= HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Could not validate credentials", headers={"WWW-Authenticate":"Bearer"})
+    return int(verify_access_token(token, credentials_exception).id)
+
+def get_current_admin(current_user: schemas.UserResponse = Depends(get_current_user)):
+    if current_user is None or current_user.id not in settings.admin_user_ids:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
@@ -0,0 +1,163 @@
+"""Newest posts of each author, kept in memory to build following feed pages without SQL.
+
+A ring holds the newest author_ring_size (created_at, id) keys of one author's posts, newest
+first. Either it holds all of them (complete), or every post of the author newer than its
+oldest key. A following feed page is then a heapq merge of the rings of the authors a
+reader follows, and only the page's posts are read from the database
+(FeedRepository.get_following_feed_from_rings).
+
+The merge is exact down to the oldest key of the first incomplete ring it would run past.
+A page that reaches further, a reader following more authors than the rings are kept for,
+and a page naming a post the database no longer has fall back to the SQL feed.
+
+Rings are loaded on first use, one query for all the authors a page misses, and kept for
+at most author_rings_max_authors authors, the least recently used dropped first. Writes in
+this process add (create_user_post) or drop (delete_user_post) right away; the outbox
+consumer in event_handlers.py applies every committed post.created and post.deleted in all
+workers. A ring loaded while its author changed is used for that page but not kept: it may
+have been read before the change committed.
+"""
+import heapq
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from ...config import settings
+
+# (created_at, post id, author id) of one post; ordered by created_at, then id, like the feed
+Key = Tuple[datetime, int, int]
+
+
+class Ring:
+    __slots__ = ("keys", "complete")
+
+    def __init__(self, keys: Tuple[Key, ...], complete: bool):
+        # Newest first; never changed, a write replaces the ring
+        self.keys = keys
+        self.complete = complete
+
+
+class AuthorRings:
+    def __init__(self, ring_size: int, max_authors: int):
+        self.ring_size = ring_size
+        self.max_authors = max_authors
+        self._rings: "OrderedDict[int, Ring]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Authors with loads in flight, and those of them that changed since
+        self._loading: Dict[int, int] = {}
+        self._changed: set = set()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def page(self, authors: Iterable[int], skip: int, limit: int,
+             load: Callable[[List[int]], Dict[int, List[Key]]]) -> Optional[List[Key]]:
+        """Keys of one feed page of authors' posts, newest first; None when the rings cannot tell it.
+
+        load(missing authors) reads their newest ring_size keys each, in one query.
+        """
+        authors = set(authors)
+        if len(authors) > self.max_authors:
+            self.record_fallback()
+            return None
+        rings = self._rings_of(authors, load)
+        # Keys down to the newest of the oldest keys of incomplete rings are all there are
+        bound = max((ring.keys[-1] for ring in rings if not ring.complete and ring.keys), default=None)
+        merged = heapq.merge(*(ring.keys for ring in rings), reverse=True)
+        keys = [key for key in islice(merged, skip + limit) if bound is None or key >= bound]
+        if len(keys) < skip + limit and bound is not None:
+            self.record_fallback()
+            return None
+        return keys[skip:]
+
+    def _rings_of(self, authors: set, load: Callable[[List[int]], Dict[int, List[Key]]]) -> List[Ring]:
+        with self._lock:
+            rings = []
+            for author in authors:
+                ring = self._rings.get(author)
+                if ring is not None:
+                    self._rings.move_to_end(author)
+                    rings.append(ring)
+            missing = [author for author in authors if author not in self._rings]
+            self.hits += len(rings)
+            self.misses += len(missing)
+            for author in missing:
+                self._loading[author] = self._loading.get(author, 0) + 1
+        if not missing:
+            return rings
+        loaded = None
+        try:
+            loaded = load(missing)
+        finally:
+            with self._lock:
+                for author in missing:
+                    if loaded is not None:
+                        keys = tuple(loaded.get(author, ()))
+                        ring = Ring(keys, complete=len(keys) < self.ring_size)
+                        rings.append(ring)
+                        if author not in self._changed:
+                            self._rings[author] = ring
+                            self._rings.move_to_end(author)
+                    self._loading[author] -= 1
+                    if not self._loading[author]:
+                        del self._loading[author]
+                        self._changed.discard(author)
+                while len(self._rings) > self.max_authors:
+                    self._rings.popitem(last=False)
+        return rings
+
+    def _change(self, author: int, change: Callable[[Ring], Optional[Ring]]) -> None:
+        with self._lock:
+            if author in self._loading:
+                self._changed.add(author)
+            ring = self._rings.get(author)
+            if ring is not None:
+                ring = change(ring)
+                if ring is None:
+                    del self._rings[author]
+                else:
+                    self._rings[author] = ring
+
+    def add(self, author: int, created_at: datetime, post_id: int) -> None:
+        """A new post of author"""
+        key = (created_at, post_id, author)
+
+        def add_key(ring: Ring) -> Ring:
+            if key in ring.keys or (not ring.complete and ring.keys and key < ring.keys[-1]):
+                return ring  # Already there, or older than what the ring covers
+            keys = sorted(ring.keys + (key,), reverse=True)
+            return Ring(tuple(keys[:self.ring_size]), ring.complete and len(keys) <= self.ring_size)
+
+        self._change(author, add_key)
+
+    def remove(self, author: int, post_id: int) -> None:
+        """A deleted post of author; the ring still covers everything newer than its oldest key"""
+        def remove_key(ring: Ring) -> Optional[Ring]:
+            keys = tuple(key for key in ring.keys if key[1] != post_id)
+            # An emptied ring that was not complete covers nothing, it is reloaded
+            return Ring(keys, ring.complete) if keys or ring.complete else None
+
+        self._change(author, remove_key)
+
+    def discard(self, author: int) -> None:
+        """Forget author's ring, the next page reloads it"""
+        self._change(author, lambda ring: None)
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def clear(self) -> None:
+        """Forget every ring, for changes that name no post (bulk imports)"""
+        with self._lock:
+            self._rings.clear()
+            self._changed.update(self._loading)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"authors": len(self._rings), "keys": sum(len(ring.keys) for ring in self._rings.values()),
+                    "hits": self.hits, "misses": self.misses, "fallbacks": self.fallbacks}
+
+
+author_rings = AuthorRings(settings.author_ring_size, settings.author_rings_max_authors)
@@ -1,11 +1,20 @@
 from abc import ABC, abstractmethod
 from typing import Generic, TypeVar, List, Optional, Dict, Any
 from sqlalchemy.orm import Session
+from ...database import UNIT_OF_WORK
 
 # TypeVar creates a placeholder for any type, like a  variable that can represent any type
 T = TypeVar('T') # T can be Post, User, Votes, or any other type
 
 
+def save(db: Session) -> None:
+    """End a repository write: flush it, and commit it unless the session is a unit of work (see get_db)"""
+    if db.info.get(UNIT_OF_WORK):
+        db.flush()
+    else:
+        db.commit()
+
+
 # Generic[T] makes a class generic it can work with different types
 class IBaseRepository(Generic[T], ABC):
     @abstractmethod
@@ -37,8 +46,7 @@ class BaseRepository(IBaseRepository[T]):
         """Create a new entity"""
         db_obj = self.model_class(**kwargs)
         self.db.add(db_obj)
-        self.db.commit()
-        self.db.refresh(db_obj)
+        save(self.db)  # server defaults come back with the INSERT (eager_defaults on the models)
         return db_obj
     
     def get_by_id(self, id: int) -> Optional[T]:
@@ -56,8 +64,7 @@ class BaseRepository(IBaseRepository[T]):
             for key, value in kwargs.items():
                 if hasattr(db_obj, key):
                     setattr(db_obj, key, value)
-            self.db.commit()
-            self.db.refresh(db_obj)
+            save(self.db)
         return db_obj
     
     def delete(self, id: int) -> bool:
@@ -65,7 +72,7 @@ class BaseRepository(IBaseRepository[T]):
         db_obj = self.get_by_id(id)
         if db_obj:
             self.db.delete(db_obj)
-            self.db.commit()
+            save(self.db)
             return True
         return False
     
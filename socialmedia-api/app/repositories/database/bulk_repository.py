@@ -0,0 +1,273 @@
+import csv
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from io import StringIO
+from typing import IO, Iterable, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..interfaces.interfaces import IBulkRepository
+from ...maintenance.partitions import ensure_month_partitions
+from .outbox_repository import record_event, POST_IMPORTED, VOTE_IMPORTED, FOLLOW_IMPORTED
+from .versions import HOT_SCORE_SQL
+from ... import schemas
+
+# Rows per COPY + INSERT ... SELECT; each batch is its own transaction
+BATCH_SIZE = 5000
+# Validation errors reported back, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+@dataclass(frozen=True)
+class BulkTable:
+    schema: Type[BaseModel]
+    staging: str
+    # Staging columns in COPY order, with their types
+    columns: Tuple[Tuple[str, str], ...]
+    # Moves the staged batch into the real table, dropping rows that reference missing rows
+    insert: str
+    export: str
+    # Outbox topic of the one event recorded per batch that inserted rows (see outbox_repository.py)
+    event: str
+    # Bumps the version of the posts and users whose counts the batch changed (see versions.py)
+    touch: Tuple[str, ...] = ()
+    # Brings columns that depend on other rows up to date with the inserted batch
+    derive: Tuple[str, ...] = ()
+    # Runs before insert: drops staged duplicates and creates the rows the batch refers to by name
+    prepare: Tuple[str, ...] = ()
+
+
+TOUCH = "UPDATE {table} SET version = version + 1, updated_at = now() WHERE id IN ({ids})"
+
+
+BULK_TABLES = {
+    "posts": BulkTable(
+        schema=schemas.BulkPost,
+        staging="bulk_posts",
+        columns=(("id", "integer"), ("title", "text"), ("content", "text"), ("category", "text"),
+                 ("published", "boolean"), ("rating", "integer"), ("user_id", "integer"),
+                 ("created_at", "timestamptz")),
+        # Rows of the batch with the id of an earlier one, the first in the file is kept: the
+        # NOT EXISTS of insert only sees posts already in the table. Then the categories seen
+        # for the first time; the NOT EXISTS keeps known ones from using up identity values,
+        # ON CONFLICT only catches concurrent inserts
+        prepare=("""
+            DELETE FROM bulk_posts d USING bulk_posts s WHERE d.id = s.id AND d.ctid > s.ctid
+        """, """
+            INSERT INTO categories (name)
+            SELECT DISTINCT s.category FROM bulk_posts s
+            WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.name = s.category)
+            ON CONFLICT DO NOTHING
+        """,),
+        # ids are optional so an export can be loaded back; an explicit id must not exist yet,
+        # (id, created_at) is the primary key so ON CONFLICT alone would not catch it, nor
+        # two rows of one batch (removed by prepare)
+        insert="""
+            INSERT INTO posts (id, title, content, category, category_id, published, rating, user_id, created_at, hot_score)
+            SELECT coalesce(s.id, nextval('posts_id_seq')), s.title, s.content, s.category, c.id,
+                   coalesce(s.published, true), s.rating, s.user_id, coalesce(s.created_at, now()),
+                   """ + HOT_SCORE_SQL.format(net_votes="0", created_at="coalesce(s.created_at, now())") + """
+            FROM bulk_posts s JOIN users u ON u.id = s.user_id JOIN categories c ON c.name = s.category
+            WHERE s.id IS NULL OR NOT EXISTS (SELECT 1 FROM posts p WHERE p.id = s.id)
+            ON CONFLICT DO NOTHING
+        """,
+        export="SELECT id, title, content, category, published, rating, user_id, created_at FROM posts",
+        event=POST_IMPORTED,
+        touch=(TOUCH.format(table="users", ids="SELECT user_id FROM bulk_posts"),),
+    ),
+    "votes": BulkTable(
+        schema=schemas.BulkVote,
+        staging="bulk_votes",
+        columns=(("post_id", "integer"), ("user_id", "integer"), ("dir", "integer")),
+        insert="""
+            INSERT INTO votes (post_id, user_id, dir, post_created_at)
+            SELECT s.post_id, s.user_id, s.dir, p.created_at
+            FROM bulk_votes s JOIN posts p ON p.id = s.post_id JOIN users u ON u.id = s.user_id
+            ON CONFLICT DO NOTHING
+        """,
+        export="SELECT post_id, user_id, dir FROM votes",
+        event=VOTE_IMPORTED,
+        # Net votes and hot score of the voted posts recounted
+        derive=("""
+            UPDATE posts p SET net_votes = c.net_votes, hot_score = """ + HOT_SCORE_SQL.format(net_votes="c.net_votes", created_at="p.created_at") + """
+            FROM (SELECT v.post_id, v.post_created_at, sum(v.dir)::int AS net_votes FROM votes v
+                  WHERE v.post_id IN (SELECT post_id FROM bulk_votes) GROUP BY v.post_id, v.post_created_at) c
+            WHERE p.id = c.post_id AND p.created_at = c.post_created_at
+        """,),
+        touch=(TOUCH.format(table="posts", ids="SELECT post_id FROM bulk_votes"),
+               TOUCH.format(table="users", ids="SELECT p.user_id FROM posts p JOIN bulk_votes s ON s.post_id = p.id")),
+    ),
+    "follows": BulkTable(
+        schema=schemas.BulkFollow,
+        staging="bulk_follows",
+        columns=(("follower_id", "integer"), ("following_id", "integer")),
+        # A follow is mutual when the follow back exists already or comes in the same batch
+        insert="""
+            INSERT INTO followers (follower_id, following_id, mutual)
+            SELECT s.follower_id, s.following_id,
+                   EXISTS (SELECT 1 FROM followers r WHERE r.follower_id = s.following_id AND r.following_id = s.follower_id)
+                   OR EXISTS (SELECT 1 FROM bulk_follows r WHERE r.follower_id = s.following_id AND r.following_id = s.follower_id)
+            FROM bulk_follows s
+            JOIN users a ON a.id = s.follower_id JOIN users b ON b.id = s.following_id
+            WHERE s.follower_id <> s.following_id
+            ON CONFLICT DO NOTHING
+        """,
+        export="SELECT follower_id, following_id, created_at FROM followers",
+        event=FOLLOW_IMPORTED,
+        # Existing follows that the batch follows back, and the follow counts of everyone in the
+        # batch recounted. Unlike the API writes this takes no pair locks, so imports should not
+        # race users following each other
+        derive=("""
+            UPDATE followers f SET mutual = true
+            FROM bulk_follows s
+            WHERE f.follower_id = s.following_id AND f.following_id = s.follower_id AND NOT f.mutual
+        """, """
+            UPDATE users u SET followers_count = (SELECT count(*) FROM followers f WHERE f.following_id = u.id),
+                               following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = u.id)
+            WHERE u.id IN (SELECT follower_id FROM bulk_follows UNION SELECT following_id FROM bulk_follows)
+        """),
+        touch=(TOUCH.format(table="users", ids="SELECT follower_id FROM bulk_follows UNION SELECT following_id FROM bulk_follows"),),
+    ),
+}
+
+
+def read_records(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(line number, record, error) for every row of an NDJSON or CSV (with header) stream.
+
+    A line that cannot be parsed comes back with an error instead of a record and
+    reading carries on with the next one.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                yield reader.line_num, None, str(exc)
+                continue
+            if None in record or None in record.values():
+                yield reader.line_num, None, f"expected {len(reader.fieldnames)} columns"
+                continue
+            # An empty cell means "not given", so schema defaults apply
+            yield reader.line_num, {key: value for key, value in record.items() if value != ""}, None
+    else:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield number, None, str(exc)
+                continue
+            if isinstance(record, dict):
+                yield number, record, None
+            else:
+                yield number, None, "expected a JSON object"
+
+
+def copy_value(value) -> str:
+    """A value in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class BulkRepository(IBulkRepository):
+    def __init__(self, db: Session):
+        self.db = db
+
+    def import_rows(self, kind: str, lines: Iterable[str], fmt: str = "ndjson",
+                    batch_size: int = BATCH_SIZE) -> dict:
+        """Validate rows through the API schemas and COPY them in batches of `batch_size`."""
+        table = BULK_TABLES[kind]
+        result = {"received": 0, "inserted": 0, "skipped": 0, "invalid": 0, "batches": 0, "errors": []}
+        batch: List[BaseModel] = []
+        for line, record, error in read_records(lines, fmt):
+            result["received"] += 1
+            if error:
+                self._reject(result, line, f"unreadable line: {error}")
+                continue
+            try:
+                # CSV cells are all strings, validate them the way JSON would be
+                row = table.schema.model_validate_strings(record) if fmt == "csv" else table.schema.model_validate(record)
+            except ValidationError as exc:
+                self._reject(result, line, "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors()))
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self._load_batch(table, batch, result)
+                batch = []
+        if batch:
+            self._load_batch(table, batch, result)
+        return result
+
+    def export_rows(self, kind: str, out: IO, fmt: str = "csv") -> None:
+        """COPY a whole table to `out` as CSV (with header) or NDJSON, without loading it in memory."""
+        query = BULK_TABLES[kind].export
+        if fmt == "csv":
+            copy = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        else:
+            # One JSON document per row. CSV format with delimiter and quote characters that never
+            # appear in JSON output (control characters are escaped) passes it through unchanged
+            copy = (f"COPY (SELECT row_to_json(t) FROM ({query}) t) TO STDOUT "
+                    f"WITH (FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01')")
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(copy, out)
+        finally:
+            cursor.close()
+
+    def _reject(self, result: dict, line: Optional[int], message: str) -> None:
+        result["invalid"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"line": line, "error": message})
+
+    def _load_batch(self, table: BulkTable, batch: List[BaseModel], result: dict) -> None:
+        names = [name for name, _ in table.columns]
+        buffer = StringIO()
+        for row in batch:
+            values = row.model_dump()
+            buffer.write("\t".join(copy_value(values.get(name)) for name in names) + "\n")
+        buffer.seek(0)
+
+        conn = self.db.connection()
+        # The staging table lives as long as the pooled connection; ON COMMIT DELETE ROWS would
+        # make every later commit on that connection truncate it, so it is emptied here instead
+        conn.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {table.staging} "
+                          f"({', '.join(f'{name} {type_}' for name, type_ in table.columns)})"))
+        conn.execute(text(f"TRUNCATE {table.staging}"))
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {table.staging} ({', '.join(names)}) FROM STDIN", buffer)
+        finally:
+            cursor.close()
+
+        if table.schema is schemas.BulkPost:
+            # Imported history needs partitions for its months, there is no default partition
+            ensure_month_partitions(conn, [row.created_at.astimezone(timezone.utc) for row in batch if row.created_at])
+        for statement in table.prepare:
+            conn.execute(text(statement))
+        inserted = conn.execute(text(table.insert)).rowcount
+        if table.schema is schemas.BulkPost and any(row.id for row in batch):
+            conn.execute(text("SELECT setval('posts_id_seq', greatest((SELECT max(id) FROM posts), "
+                              "(SELECT last_value FROM posts_id_seq)))"))
+        if inserted:
+            for statement in table.derive + table.touch:
+                conn.execute(text(statement))
+            # One event per batch rather than per row, so an import does not flood the outbox
+            record_event(self.db, table.event, inserted=inserted)
+        self.db.commit()
+
+        result["batches"] += 1
+        result["inserted"] += inserted
+        result["skipped"] += len(batch) - inserted
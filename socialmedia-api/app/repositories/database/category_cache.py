@@ -0,0 +1,122 @@
+"""Category ids and the first posts of each category, kept in memory for GET /posts/category/{name}.
+
+CategoryIds maps category names to their categories.id. Categories are never renamed or
+deleted, so an id read from the database stays right for good; the id of a category a
+write inserts is not kept, it could still be rolled back, and is read again next time.
+
+CategoryPages holds, for the categories being read, the (created_at, id) keys of their
+first category_page_size published posts, newest first ("latest") or by hot_score ("hot").
+A page within them reads only its posts (FeedRepository.get_category_feed_rows); a page
+past them reads the category's index. Post writes in this process drop their category's
+lists right away, the outbox consumer in event_handlers.py drops them in every worker, and
+the next read reloads them. A post moved to another category or unpublished is caught when
+its page is read: it is no longer found by key in the category, the lists are dropped and
+the page read with SQL. Votes reorder the hot lists without naming a category, so those
+are also reloaded every category_hot_page_ttl seconds. A list loaded while its category
+changed is used for that page but not kept.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from ...config import settings
+from .single_flight import single_flight
+
+# (created_at, post id) of one post of a category page
+Key = Tuple[datetime, int]
+
+SORTS = ("latest", "hot")
+
+
+class CategoryIds:
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, load: Callable[[str], Optional[int]]) -> Optional[int]:
+        """The id of category name, calling load(name) the first time; None when there is no such category"""
+        category_id = self._ids.get(name)
+        if category_id is None:
+            category_id = load(name)
+            if category_id is not None:
+                with self._lock:
+                    self._ids[name] = category_id
+        return category_id
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self) -> dict:
+        return {"names": len(self._ids)}
+
+
+class CategoryPages:
+    def __init__(self, page_size: int, max_lists: int, hot_ttl: float):
+        self.page_size = page_size
+        self.max_lists = max_lists
+        self.hot_ttl = hot_ttl
+        # (category id, sort) -> (expires at, keys)
+        self._lists: "OrderedDict[Tuple[int, str], Tuple[float, Tuple[Key, ...]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = single_flight("category_pages")
+        # Bumped by every change of a category, and of all of them; a load stores its keys
+        # only if neither moved while it ran
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def keys(self, category_id: int, sort: str, load: Callable[[int], List[Key]]) -> Tuple[Key, ...]:
+        """The first page_size keys of category_id in sort order, calling load(page_size) on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lists.get((category_id, sort))
+            if entry is not None and entry[0] > now:
+                self._lists.move_to_end((category_id, sort))
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(category_id, 0))
+
+        def load_and_store() -> Tuple[Key, ...]:
+            keys = tuple(load(self.page_size))
+            ttl = self.hot_ttl if sort == "hot" else float("inf")
+            with self._lock:
+                if generation == (self._epoch, self._generations.get(category_id, 0)):
+                    self._lists[(category_id, sort)] = (time.monotonic() + ttl, keys)
+                    self._lists.move_to_end((category_id, sort))
+                    while len(self._lists) > self.max_lists:
+                        self._lists.popitem(last=False)
+            return keys
+
+        return self._loads.do((category_id, sort, generation), load_and_store)
+
+    def invalidate(self, category_id: int) -> None:
+        """Drop the lists of category_id once a write to one of its posts is flushed"""
+        with self._lock:
+            self._generations[category_id] = self._generations.get(category_id, 0) + 1
+            for sort in SORTS:
+                self._lists.pop((category_id, sort), None)
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def clear(self) -> None:
+        """Drop every list, for changes that name no category (bulk imports)"""
+        with self._lock:
+            self._epoch += 1
+            self._lists.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"lists": len(self._lists), "keys": sum(len(keys) for _, keys in self._lists.values()),
+                     "hits": self.hits, "misses": self.misses, "fallbacks": self.fallbacks}
+        return {**stats, "coalesced": self._loads.stats()["shared"]}
+
+
+category_ids = CategoryIds()
+category_pages = CategoryPages(settings.category_page_size, settings.category_pages_max_lists, settings.category_hot_page_ttl)
@@ -1,129 +1,233 @@
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case, and_, or_, desc, text
-from datetime import datetime, timedelta
-from .post_repository import PostRepository
+from sqlalchemy import select, union_all, literal
+from datetime import datetime, timedelta, timezone
+from .post_repository import PostRepository, STREAM_BATCH_SIZE
+from .post_rows import PostRow, Fieldset, post_rows, projection
+from . import statements
+from .single_flight import single_flight
+from .author_rings import Key, author_rings
+from .category_cache import category_pages
 from ..interfaces.interfaces import IFeedRepository
-from ...models import Post, Votes, User, Followers
+from ...models import Post, Followers
+from ...config import settings
+
+# Recommendations only consider posts from this window (the longest trending timeframe), which
+# keeps the aggregate to the newest partitions of posts and votes
+RECOMMENDATION_WINDOW = timedelta(days=30)
+
+TRENDING_TIMEFRAME_HOURS = {
+    "1h": 1,
+    "6h": 6,
+    "24h": 24,
+    "7d": 168,
+    "30d": 720
+}
+
+trending_pages = single_flight("trending_pages")
+hot_pages = single_flight("hot_pages")
+
+
+def trending_params(user_id: Optional[int], timeframe: str, skip: int, limit: int) -> dict:
+    """Parameters of statements.trending_feed"""
+    timeframe_hours = TRENDING_TIMEFRAME_HOURS.get(timeframe, 24)
+    cutoff_time = datetime.now(timezone.utc) - timedelta(hours=timeframe_hours)
+    return {"user_id": user_id, "cutoff": cutoff_time, "skip": skip, "limit": limit}
+
 
 class FeedRepository(IFeedRepository):
     def __init__(self, db: Session, post_repo: PostRepository):
         self.db = db
         self.post_repo = post_repo
 
+    def get_following_page_versions(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """(id, version) of the posts get_following_feed would return, without the vote aggregate"""
+        return self.db.execute(statements.following_page_versions(), {"user_id": user_id, "skip": skip, "limit": limit}).all()
+
+    def get_feed_versions(self, user_id: int, feed_type: str, skip: int = 0, limit: int = 20) -> Optional[List[Tuple]]:
+        """(id, version) of a get_feed_by_type page, or None when the page depends on the clock
+        and cannot be validated from versions alone"""
+        if feed_type == "following" and settings.following_feed_engine == "rings":
+            return self.get_following_page_versions_from_rings(user_id, skip, limit)
+        elif feed_type == "following":
+            return self.get_following_page_versions(user_id, skip, limit)
+        elif feed_type == "trending":
+            return None
+        elif feed_type == "hot":
+            return self.get_hot_page_versions(skip, limit)
+        else:
+            return self.post_repo.get_posts_page_versions(skip, limit)
+
     def get_following_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
         """Get posts from users that the current user follows"""
-        following_subquery= self.db.query(Followers.following_id).filter(Followers.following_id ==user_id).subquery()
-        posts = self.db.query(Post, func.count(Votes.post_id).label("Votes"), func.count(case((Votes.dir == 1, 1))).label("Upvotes"),func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
-                case((func.max(case((Votes.user_id == user_id, Votes.dir))).in_([1, -1]), True),else_=False).label("has_liked")
-                ).join(
-                    Votes, Votes.post_id == Post.id, isouter=True
-                ).filter(
-                     or_(
-                        Post.user_id.in_(following_subquery),
-                        Post.user_id == user_id  # Include own posts
-                    )
-                ).group_by(Post.id).order_by(
-                    desc(Post.created_at)
-                ).offset(skip).limit(limit).all()
-        return posts
+        return self.db.execute(statements.following_feed(False), {"user_id": user_id, "skip": skip, "limit": limit}).all()
+
+    def get_following_feed_rows(self, user_id: int, skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_following_feed as PostRows, with only the columns fields needs"""
+        return post_rows(self.db.execute(statements.following_feed(True, projection(fields)),
+                                         {"user_id": user_id, "skip": skip, "limit": limit}))
     
+    def _ring_page(self, user_id: int, skip: int, limit: int) -> Optional[List[Key]]:
+        """Keys of a following feed page merged from the author rings, None to read it with SQL"""
+        authors = self.db.scalars(statements.followed_authors(), {"user_id": user_id}).all()
+        authors.append(user_id)  # Include own posts
+
+        def load(missing: List[int]) -> dict:
+            rings = {}
+            for author, created_at, post_id in self.db.execute(statements.recent_posts(),
+                                                               {"authors": missing, "ring_size": author_rings.ring_size}):
+                rings.setdefault(author, []).append((created_at, post_id, author))
+            return rings
+
+        return author_rings.page(authors, max(skip, 0), limit, load)
+
+    def _by_keys(self, stmt, keys: List[tuple], params: dict) -> list:
+        """stmt's rows for a page of (created_at, id, ...) keys"""
+        return self.db.execute(stmt, {**params, "post_ids": [key[1] for key in keys], "created_ats": [key[0] for key in keys]}).all()
+
+    def _keyed(self, stmt, keys: List[Key], user_id: int) -> Optional[list]:
+        """stmt's rows for a page of keys as seen by user_id, None when a post of the page is gone"""
+        rows = self._by_keys(stmt, keys, {"user_id": user_id})
+        if len(rows) == len(keys):
+            return rows
+        # Deleted by another worker and not delivered here yet; the next page reloads its author
+        found = {row.id for row in rows}
+        for created_at, post_id, author in keys:
+            if post_id not in found:
+                author_rings.discard(author)
+        author_rings.record_fallback()
+        return None
+
+    def get_following_feed_from_rings(self, user_id: int, skip: int = 0, limit: int = 20,
+                                      fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_following_feed_rows, the page merged from the author rings and only its posts read"""
+        keys = self._ring_page(user_id, skip, limit)
+        rows = self._keyed(statements.posts_by_key(projection(fields)), keys, user_id) if keys else keys
+        if rows is None:
+            return self.get_following_feed_rows(user_id, skip, limit, fields)
+        return post_rows(rows)
+
+    def get_following_page_versions_from_rings(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """get_following_page_versions of the page get_following_feed_from_rings returns"""
+        keys = self._ring_page(user_id, skip, limit)
+        versions = self._keyed(statements.post_versions_by_key(), keys, user_id) if keys else keys
+        if versions is None:
+            return self.get_following_page_versions(user_id, skip, limit)
+        return versions
+
+    def stream_following_feed(self, user_id: int, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Tuple]:
+        """The whole following feed, newest first, read through a server-side cursor"""
+        authors = union_all(
+            select(Followers.following_id.label("user_id")).where(Followers.follower_id == user_id),
+            select(literal(user_id).label("user_id"))
+        ).subquery()
+        query = self.post_repo.posts_with_votes_query(user_id).filter(Post.user_id.in_(select(authors.c.user_id)))
+        yield from query.yield_per(batch_size)
+
     def get_trending_feed(self, user_id: int, timeframe: str = "24h", skip: int = 0, limit: int = 20) -> List[Tuple]:
         """Get trending posts based on vote velocity and engagement"""
-        timeframe_hours = {
-            "1h": 1,
-            "6h": 6, 
-            "24h": 24,
-            "7d": 168,
-            "30d": 720
-        }.get(timeframe, 24)
-        cutoff_time = datetime.utcnow() - timedelta(hours=timeframe_hours)
-
-        posts= self.db.query(
-            Post,
-            func.count(Votes.post_id).label("Votes"),
-            func.count(case((Votes.dir == 1, 1))).label("Upvotes"),
-            func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
-            case((func.max(case((Votes.user_id==user_id, Votes.dir))).in_([1,-1]), True), else_=False).label("has_liked"),
-            ((func.count(case((Votes.dir == 1, 1))) - func.count(case((Votes.dir == -1, 1)))) /
-                func.greatest(func.extract('epoch', func.now() - Post.created_at) / 3600.0,1.0  # Prevent division by zero
-                )).label("trend_score"),
-            # Calculate vote velocity: total_votes / hours_since_creation
-            (func.count(Votes.post_id) /func.greatest(func.extract('epoch', func.now() - Post.created_at) / 3600.0,1.0)).label("vote_velocity")
-        ).join(Votes, Votes.post_id == Post.id, isouter=True).filter(Post.created_at >= cutoff_time, Post.published == True).group_by(
-            func.count(Votes.post_id) >= 2
-        ).order_by(
-            desc(text("trend_score"))  # Order by trend score
-        ).offset(skip).limit(limit).all()
-        return posts
-    
+        return self.db.execute(statements.trending_feed(False), trending_params(user_id, timeframe, skip, limit)).all()
+
+    def get_trending_feed_rows(self, user_id: int, timeframe: str = "24h", skip: int = 0, limit: int = 20,
+                               fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_trending_feed as PostRows, with only the columns fields needs"""
+        return post_rows(self.db.execute(statements.trending_feed(True, projection(fields)),
+                                         trending_params(user_id, timeframe, skip, limit)))
+
+    def get_trending_feed_coalesced(self, user_id: int, timeframe: str = "24h", skip: int = 0, limit: int = 20,
+                                    fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_trending_feed_rows, sharing one query between identical concurrent requests"""
+        timeframe = timeframe if timeframe in TRENDING_TIMEFRAME_HOURS else "24h"
+        key = (timeframe, max(skip, 0), limit)
+        posts = trending_pages.do(key + projection(fields), lambda: self.get_trending_feed_rows(None, *key, fields))  # has_liked is overlaid per caller
+        return self.post_repo.overlay_has_liked(posts, user_id)
+
+    def get_hot_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """Get published posts by their stored hot_score, the highest first"""
+        return self.db.execute(statements.hot_feed(False), {"user_id": user_id, "skip": skip, "limit": limit}).all()
+
+    def get_hot_feed_rows(self, user_id: int, skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_hot_feed as PostRows, with only the columns fields needs"""
+        return post_rows(self.db.execute(statements.hot_feed(True, projection(fields)),
+                                         {"user_id": user_id, "skip": skip, "limit": limit}))
+
+    def get_hot_feed_coalesced(self, user_id: int, skip: int = 0, limit: int = 20,
+                               fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_hot_feed_rows, sharing one query between identical concurrent requests"""
+        key = (max(skip, 0), limit)
+        posts = hot_pages.do(key + projection(fields), lambda: self.get_hot_feed_rows(None, *key, fields))  # has_liked is overlaid per caller
+        return self.post_repo.overlay_has_liked(posts, user_id)
+
+    def get_hot_page_versions(self, skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """(id, version) of a get_hot_feed page; a vote that moves a post bumps its version"""
+        return self.db.execute(statements.hot_page_versions(), {"skip": skip, "limit": limit}).all()
+
+    def _category_keys(self, category_id: int, sort: str, skip: int, limit: int) -> Optional[List[Tuple]]:
+        """Keys of a category page from the cached first posts of the category, None to read it with SQL"""
+        if skip < 0 or limit < 0 or skip + limit > category_pages.page_size:
+            return None
+
+        def load(size: int) -> List[Tuple]:
+            return [tuple(key) for key in self.db.execute(statements.category_page_keys(sort),
+                                                          {"category_id": category_id, "skip": 0, "limit": size})]
+
+        return list(category_pages.keys(category_id, sort, load)[skip:skip + limit])
+
+    def _category_keyed(self, stmt, keys: List[Tuple], category_id: int, user_id: Optional[int]) -> Optional[list]:
+        """stmt's rows for a page of category keys, in their order; None when a post of the page left the category"""
+        rows = self._by_keys(stmt, keys, {"user_id": user_id, "category_id": category_id})
+        if len(rows) < len(keys):
+            # Deleted, unpublished or moved by another worker and not delivered here yet
+            category_pages.invalidate(category_id)
+            category_pages.record_fallback()
+            return None
+        position = {post_id: index for index, (created_at, post_id) in enumerate(keys)}
+        return sorted(rows, key=lambda row: position[row.id])
+
+    def get_category_feed_rows(self, user_id: int, category_id: int, sort: str = "latest", skip: int = 0, limit: int = 20,
+                               fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Published posts of a category, newest or highest hot_score first; pages within the
+        cached first posts of the category read only their posts"""
+        keys = self._category_keys(category_id, sort, skip, limit)
+        rows = self._category_keyed(statements.posts_by_key(projection(fields), True), keys, category_id, user_id) if keys else keys
+        if rows is None:
+            rows = self.db.execute(statements.category_feed(sort, projection(fields)),
+                                   {"user_id": user_id, "category_id": category_id, "skip": skip, "limit": limit})
+        return post_rows(rows)
+
+    def get_category_page_versions(self, category_id: int, sort: str = "latest", skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """(id, version) of the posts get_category_feed_rows would return, without the vote aggregate"""
+        keys = self._category_keys(category_id, sort, skip, limit)
+        versions = self._category_keyed(statements.post_versions_by_key(True), keys, category_id, None) if keys else keys
+        if versions is None:
+            return self.db.execute(statements.category_page_versions(sort),
+                                   {"category_id": category_id, "skip": skip, "limit": limit}).all()
+        return versions
+
+    def _recommended_feed(self, user_id: int, skip: int, limit: int, rows: bool, fields: Optional[Fieldset] = None):
+        """Result of statements.recommended_feed for user_id"""
+        params = {"user_id": user_id, "cutoff": datetime.now(timezone.utc) - RECOMMENDATION_WINDOW, "skip": skip, "limit": limit}
+        has_voting_history = self.db.execute(statements.voting_history(), {"user_id": user_id}).first() is not None
+        return self.db.execute(statements.recommended_feed(rows, has_voting_history, projection(fields)), params)
+
     def get_recommended_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
         """Get recommended posts based on user behavior and preferences"""
-        
-        user_preferred_categories = self.db.query(
-            Post.category,
-            func.count(Votes.post_id).label("interaction_count")
-        ).join(
-            Votes, Votes.post_id == Post.id
-        ).filter(
-            Votes.user_id == user_id
-        ).group_by(Post.category).order_by(
-            desc("interaction_count")
-        ).limit(3).subquery()
-        
-        has_voting_history = self.db.query(Votes).filter(Votes.user_id == user_id).first()
-        
-        if not has_voting_history:
-            recommended_posts = self.db.query(
-                Post,
-                func.count(Votes.post_id).label("Votes"),
-                func.count(case((Votes.dir == 1, 1))).label("Upvotes"),
-                func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
-                case(
-                    (func.max(case((Votes.user_id == user_id, Votes.dir))).in_([1, -1]), True),
-                    else_=False
-                ).label("has_liked")
-            ).join(
-                Votes, Votes.post_id == Post.id, isouter=True
-            ).filter(
-                Post.user_id != user_id,
-                Post.published == True
-            ).group_by(Post.id).order_by(
-                desc(func.count(case((Votes.dir == 1, 1))))
-            ).offset(skip).limit(limit).all()
-        else:
-            recommended_posts = self.db.query(
-                Post,
-                func.count(Votes.post_id).label("Votes"),
-                func.count(case((Votes.dir == 1, 1))).label("Upvotes"),
-                func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
-                case(
-                    (func.max(case((Votes.user_id == user_id, Votes.dir))).in_([1, -1]), True),
-                    else_=False
-                ).label("has_liked")
-            ).join(
-                Votes, Votes.post_id == Post.id, isouter=True
-            ).filter(
-                Post.category.in_(
-                    self.db.query(user_preferred_categories.c.category)
-                ),
-                Post.user_id != user_id, 
-                ~Post.id.in_(
-                    self.db.query(Votes.post_id).filter(Votes.user_id == user_id)
-                ),
-                Post.published == True
-            ).group_by(Post.id).order_by(
-                desc(func.count(case((Votes.dir == 1, 1))))  
-            ).offset(skip).limit(limit).all()
-        
-        return recommended_posts
+        return self._recommended_feed(user_id, skip, limit, rows=False).all()
+
+    def get_recommended_feed_rows(self, user_id: int, skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_recommended_feed as PostRows, with only the columns fields needs"""
+        return post_rows(self._recommended_feed(user_id, skip, limit, rows=True, fields=fields))
 
     def get_feed_by_type(self, user_id: int, feed_type: str, timeframe: str = "24h", 
-                        skip: int = 0, limit: int = 20) -> List[Tuple]:
-        """Get feed based on specified type"""
-        if feed_type == "following":
-            return self.get_following_feed(user_id, skip, limit)
+                        skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get feed based on specified type; trending, hot and chronological pages are coalesced"""
+        if feed_type == "following" and settings.following_feed_engine == "rings":
+            return self.get_following_feed_from_rings(user_id, skip, limit, fields)
+        elif feed_type == "following":
+            return self.get_following_feed_rows(user_id, skip, limit, fields)
         elif feed_type == "trending":
-            return self.get_trending_feed(user_id, timeframe, skip, limit)
+            return self.get_trending_feed_coalesced(user_id, timeframe, skip, limit, fields)
+        elif feed_type == "hot":
+            return self.get_hot_feed_coalesced(user_id, skip, limit, fields)
         else: 
-            return self.post_repo.get_posts_with_votes(user_id, skip, limit)
+            return self.post_repo.get_posts_with_votes_coalesced(user_id, skip, limit, fields=fields)
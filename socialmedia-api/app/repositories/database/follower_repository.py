@@ -1,9 +1,24 @@
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
-from .base_repository import BaseRepository
+from sqlalchemy import func, case, delete, exists, literal, select, tuple_, update
+from sqlalchemy.dialects.postgresql import array, insert
+from .base_repository import BaseRepository, save
 from ..interfaces.interfaces import IFollowerRepository
 from ...models import Post, Votes, User, Followers
+from .versions import touch_follows
+from ...config import settings
+from .outbox_repository import record_event, record_events, FOLLOW_CREATED, FOLLOW_DELETED
+
+def follow_count(counter, column, user_id: int):
+    """Followers (column following_id) or followed users (column follower_id) of user_id.
+
+    counter is the matching count maintained on users (see versions.touch_follows). Below
+    settings.exact_count_limit the rows are counted; from it on the counter is returned
+    and Postgres never runs the count.
+    """
+    exact = select(func.count()).select_from(Followers).where(column == user_id).scalar_subquery()
+    return case((counter >= settings.exact_count_limit, counter), else_=exact)
+
 
 class FollowerRepository(BaseRepository[Followers], IFollowerRepository):
     def __init__(self, db: Session):
@@ -17,31 +32,94 @@ class FollowerRepository(BaseRepository[Followers], IFollowerRepository):
         return follow_exists is not None
     
     def follow_user(self, follower_id: int, following_id: int) -> Followers:
-        # Check if relationship already exists
-        existing_follow = self.is_following(follower_id,following_id)
-        if existing_follow:
-            raise ValueError("User is already following this user")
-        
         if follower_id == following_id:
             raise ValueError("Users cannot follow themselves")
-        new_follow = Followers(follower_id=follower_id, following_id=following_id)
-        self.db.add(new_follow)
-        self.db.commit()
-        self.db.refresh(new_follow)
+        # The primary key tells an existing follow apart, no lookup before the insert
+        new_follow = self.db.scalars(self._insert_follows(follower_id, [following_id]).returning(Followers)).first()
+        if new_follow is None:
+            raise ValueError("User is already following this user")
+        # Both profiles' counts and follow status change
+        touch_follows(self.db, follower_id, [following_id], 1)
+        record_event(self.db, FOLLOW_CREATED, follower_id=follower_id, following_id=following_id)
+        save(self.db)
         return new_follow
     
     def unfollow_user(self, follower_id: int, following_id: int) -> bool:
-        follow_to_delete = self.db.query(Followers).filter(
-            Followers.follower_id == follower_id,
-            Followers.following_id == following_id
-        ).first()
-        
-        if follow_to_delete:
-            self.db.delete(follow_to_delete)
-            self.db.commit()
+        deleted = self.db.execute(self._delete_follows(follower_id, [following_id])).rowcount
+        if deleted:
+            touch_follows(self.db, follower_id, [following_id], -1)
+            record_event(self.db, FOLLOW_DELETED, follower_id=follower_id, following_id=following_id)
+            save(self.db)
             return True
         return False
 
+    def follow_users(self, follower_id: int, following_ids: Iterable[int]) -> Set[int]:
+        """Follow every user in following_ids with one INSERT; the ids that were not followed before.
+
+        The ids must exist; already followed ids and follower_id itself are skipped.
+        """
+        targets = sorted(set(following_ids) - {follower_id})
+        if not targets:
+            return set()
+        followed = set(self.db.scalars(self._insert_follows(follower_id, targets).returning(Followers.following_id)))
+        self._touch_follows(FOLLOW_CREATED, follower_id, followed, 1)
+        return followed
+
+    def unfollow_users(self, follower_id: int, following_ids: Iterable[int]) -> Set[int]:
+        """Unfollow every user in following_ids with one DELETE; the ids that were followed"""
+        targets = sorted(set(following_ids))
+        if not targets:
+            return set()
+        unfollowed = set(self.db.scalars(self._delete_follows(follower_id, targets).returning(Followers.following_id)))
+        self._touch_follows(FOLLOW_DELETED, follower_id, unfollowed, -1)
+        return unfollowed
+
+    def _lock_pairs(self, follower_id: int, following_ids: List[int]) -> None:
+        """Serialize follow writes on each (follower_id, following_id) pair until the commit.
+
+        Without it, two users following each other at the same time would each miss the
+        other's uncommitted row and both rows would stay mutual = false. It has to be its own
+        statement: the next one must take its snapshot after the lock is granted.
+        """
+        other = func.unnest(array(following_ids)).column_valued("other_id")
+        self.db.execute(select(func.pg_advisory_xact_lock(func.least(follower_id, other), func.greatest(follower_id, other))))
+
+    def _insert_follows(self, follower_id: int, following_ids: List[int]):
+        """INSERT of the follows with their mutual flag, flagging the follows back in the same statement"""
+        self._lock_pairs(follower_id, following_ids)
+        flag_back = (
+            update(Followers)
+            .where(Followers.following_id == follower_id, Followers.follower_id.in_(following_ids), Followers.mutual.is_(False))
+            .values(mutual=True).cte("flag_back")
+        )
+        target = func.unnest(array(following_ids)).column_valued("target_id")
+        follows_back = exists().where(Followers.follower_id == target, Followers.following_id == follower_id)
+        return (
+            insert(Followers)
+            .from_select(["follower_id", "following_id", "mutual"], select(literal(follower_id), target, follows_back))
+            .on_conflict_do_nothing().add_cte(flag_back)
+        )
+
+    def _delete_follows(self, follower_id: int, following_ids: List[int]):
+        """DELETE of the follows, clearing the mutual flag of the follows back in the same statement"""
+        self._lock_pairs(follower_id, following_ids)
+        unflag_back = (
+            update(Followers)
+            .where(Followers.following_id == follower_id, Followers.follower_id.in_(following_ids), Followers.mutual.is_(True))
+            .values(mutual=False).cte("unflag_back")
+        )
+        return (
+            delete(Followers)
+            .where(Followers.follower_id == follower_id, Followers.following_id.in_(following_ids))
+            .add_cte(unflag_back)
+        )
+
+    def _touch_follows(self, topic: str, follower_id: int, following_ids: Set[int], delta: int) -> None:
+        if following_ids:
+            touch_follows(self.db, follower_id, sorted(following_ids), delta)
+            record_events(self.db, topic, [{"follower_id": follower_id, "following_id": following_id} for following_id in sorted(following_ids)])
+            save(self.db)
+
     #Get followers
     def get_followers(self, user_id: int, skip: int = 0, limit: int = 100) -> List[User]:
         followers = self.db.query(User).join(
@@ -63,17 +141,18 @@ class FollowerRepository(BaseRepository[Followers], IFollowerRepository):
         return following
     #Get total no of followers
     def get_follower_count(self, user_id: int) -> int:
-        count = self.db.query(Followers).filter(
-            Followers.following_id == user_id
-        ).count()
-        return count
+        return self._count(User.followers_count, Followers.following_id, user_id)[0]
     
     #Get total no of following
     def get_following_count(self, user_id: int) -> int:
-        count = self.db.query(Followers).filter(
-            Followers.follower_id == user_id
-        ).count()
-        return count
+        return self._count(User.following_count, Followers.follower_id, user_id)[0]
+
+    def _count(self, counter, column, user_id: int) -> Tuple[int, bool]:
+        """(count, approximate) in one statement: the exact count below settings.exact_count_limit, the counter on users from it on"""
+        maintained = select(counter).where(User.id == user_id).scalar_subquery()
+        approximate = func.coalesce(maintained >= settings.exact_count_limit, False)
+        count, approximate = self.db.execute(select(follow_count(maintained, column, user_id), approximate)).one()
+        return count, approximate
     
     #Get follower and following counts for a user
     def get_user_stats(self, user_id: int) -> Optional[Tuple]:
@@ -81,66 +160,68 @@ class FollowerRepository(BaseRepository[Followers], IFollowerRepository):
         
         result = (self.db.query(User,
                 # Follower count
-                func.coalesce(self.db.query(func.count(Followers.follower_id)).filter(Followers.following_id == user_id).scalar_subquery(),0).label('followers_count'),
+                follow_count(User.followers_count, Followers.following_id, user_id).label('followers_count'),
                 
                 # Following count
-                func.coalesce(self.db.query(func.count(Followers.following_id)).filter(Followers.follower_id == user_id).scalar_subquery(), 0).label('following_count')).filter(User.id == user_id).first()
+                follow_count(User.following_count, Followers.follower_id, user_id).label('following_count')).filter(User.id == user_id).first()
         )
         return result
     
     #Get users who follow each other mutually
-    def get_mutual_follows(self, user_id: int) -> List[User]:
-        # Find users where:
-        # 1. user_id follows them AND
-        # 2. they follow user_id back
-        
+    def get_mutual_follows(self, user_id: int, skip: int = 0, limit: int = 100) -> List[User]:
+        # followers.mutual marks the follows that are followed back, so this is a range
+        # scan of idx_followers_mutual instead of intersecting both follow lists
         mutual_users = self.db.query(User).join(
             Followers, User.id == Followers.following_id
         ).filter(
-            Followers.follower_id == user_id
-        ).intersect(
-            self.db.query(User).join(
-                Followers, User.id == Followers.follower_id
-            ).filter(
-                Followers.following_id == user_id
-            )
-        ).all()
+            Followers.follower_id == user_id,
+            Followers.mutual.is_(True)
+        ).order_by(Followers.following_id).offset(skip).limit(limit).all()
         
         return mutual_users
     
     #Get followers with pagination information
     def get_followers_with_pagination_info(self, user_id: int, skip: int = 0, limit: int = 100) -> Dict:
-        total_followers = self.get_follower_count(user_id)
-        followers = self.get_followers(user_id, skip, limit)
+        total_followers, approximate = self._count(User.followers_count, Followers.following_id, user_id)
+        # One row past the page tells whether there is another, whatever the total says
+        followers = self.get_followers(user_id, skip, limit + 1)
         
         return {
-            "followers": followers,
+            "followers": followers[:limit],
             "total": total_followers,
+            "approximate": approximate,
             "skip": skip,
             "limit": limit,
-            "has_more": (skip + limit) < total_followers
+            "has_more": len(followers) > limit
         }
     
     #Get following with pagination information
     def get_following_with_pagination_info(self, user_id: int, skip: int = 0, limit: int = 100) -> Dict:
-        total_following = self.get_following_count(user_id)
-        following = self.get_following(user_id, skip, limit)
+        total_following, approximate = self._count(User.following_count, Followers.follower_id, user_id)
+        following = self.get_following(user_id, skip, limit + 1)
         
         return {
-            "following": following,
+            "following": following[:limit],
             "total": total_following,
+            "approximate": approximate,
             "skip": skip,
             "limit": limit,
-            "has_more": (skip + limit) < total_following
+            "has_more": len(following) > limit
         }
     
     #Get comprehensive follow status between two users
     def get_user_follow_status(self, current_user_id: int, target_user_id: int) -> Dict:
-        is_following_target = self.is_following(current_user_id, target_user_id)
-        is_followed_by_target = self.is_following(target_user_id, current_user_id)
+        # Both directions in one primary key lookup; the mutual flag comes with the row
+        rows = self.db.query(Followers.follower_id, Followers.mutual).filter(
+            tuple_(Followers.follower_id, Followers.following_id).in_(
+                [(current_user_id, target_user_id), (target_user_id, current_user_id)]
+            )
+        ).all()
+        is_following_target = any(row.follower_id == current_user_id for row in rows)
+        is_followed_by_target = any(row.follower_id == target_user_id for row in rows)
         
         return {
             "is_following": is_following_target,
             "is_followed_by": is_followed_by_target,
-            "is_mutual": is_following_target and is_followed_by_target
-        }
\ No newline at end of file
+            "is_mutual": any(row.follower_id == current_user_id and row.mutual for row in rows)
+        }
@@ -0,0 +1,132 @@
+"""Transactional outbox: post, vote, follow and user events written in the same transaction as the change.
+
+Repositories call record_event() before they commit, so an event exists exactly when its
+change does. app/events.py reads the events back in order and hands them to consumers.
+
+Events are ordered by (txid, id), the writing transaction's id and the row id. Both are
+taken before commit, so rows do not become visible in that order; read_events() only returns
+events of transactions older than the oldest one still running, which are all committed or
+gone. A position (txid, id) therefore never has an event appear behind it later. The price
+is that a long running transaction holds back delivery until it ends.
+"""
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import func, insert, literal_column, tuple_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from ..interfaces.interfaces import IOutboxRepository
+from ...models import OutboxEvent, OutboxCheckpoint
+
+POST_CREATED = "post.created"
+POST_UPDATED = "post.updated"
+POST_DELETED = "post.deleted"
+POST_IMPORTED = "post.imported"
+VOTE_CREATED = "vote.created"
+VOTE_UPDATED = "vote.updated"
+VOTE_DELETED = "vote.deleted"
+VOTE_IMPORTED = "vote.imported"
+FOLLOW_CREATED = "follow.created"
+FOLLOW_DELETED = "follow.deleted"
+FOLLOW_IMPORTED = "follow.imported"
+USER_CREATED = "user.created"
+USER_UPDATED = "user.updated"
+
+# (txid, event id) of the last event a consumer has handled
+Position = Tuple[int, int]
+
+# Transactions below this id have all ended
+SNAPSHOT_XMIN = literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+
+
+def record_event(db: Session, topic: str, **payload) -> None:
+    """Add an event to the current transaction; it is only delivered if the transaction commits"""
+    payload = {key: value.isoformat() if isinstance(value, (date, datetime)) else value for key, value in payload.items()}
+    db.execute(insert(OutboxEvent).values(topic=topic, payload=payload))
+
+
+def record_events(db: Session, topic: str, payloads: List[dict]) -> None:
+    """record_event for many events of one topic, in a single INSERT"""
+    if payloads:
+        db.execute(insert(OutboxEvent), [{"topic": topic, "payload": payload} for payload in payloads])
+
+
+class OutboxRepository(IOutboxRepository):
+    def __init__(self, db: Session):
+        self.db = db
+
+    def head(self) -> Position:
+        """Position after the last deliverable event; consumers without a checkpoint start here"""
+        last = (
+            self.db.query(OutboxEvent.txid, OutboxEvent.id)
+            .filter(OutboxEvent.txid < SNAPSHOT_XMIN)
+            .order_by(OutboxEvent.txid.desc(), OutboxEvent.id.desc())
+            .first()
+        )
+        return (last.txid, last.id) if last else (0, 0)
+
+    def read_events(self, after: Position, limit: int) -> List[OutboxEvent]:
+        """Up to limit events after the position, in order, from ended transactions only"""
+        return (
+            self.db.query(OutboxEvent)
+            .filter(tuple_(OutboxEvent.txid, OutboxEvent.id) > tuple_(*after), OutboxEvent.txid < SNAPSHOT_XMIN)
+            .order_by(OutboxEvent.txid, OutboxEvent.id)
+            .limit(limit)
+            .all()
+        )
+
+    def claim_checkpoint(self, consumer: str) -> Optional[Position]:
+        """The consumer's checkpoint, locked until this transaction ends; None if another worker holds it.
+
+        A consumer seen for the first time starts at head().
+        """
+        if self.db.get(OutboxCheckpoint, consumer) is None:
+            txid, event_id = self.head()
+            self.db.execute(
+                pg_insert(OutboxCheckpoint).values(consumer=consumer, txid=txid, event_id=event_id)
+                .on_conflict_do_nothing()
+            )
+            self.db.commit()  # kept even if nothing is delivered in this claim
+        # A transaction level advisory lock, so claiming takes no row lock and no transaction id
+        claimed = self.db.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext('outbox:' || :consumer))"), {"consumer": consumer}
+        ).scalar()
+        if not claimed:
+            return None
+        # Read after the lock: the holder before us may just have moved it
+        checkpoint = self.db.query(OutboxCheckpoint.txid, OutboxCheckpoint.event_id).filter(OutboxCheckpoint.consumer == consumer).one()
+        return checkpoint.txid, checkpoint.event_id
+
+    def save_checkpoint(self, consumer: str, position: Position) -> None:
+        """Move a claimed checkpoint to position and commit, releasing the claim"""
+        self.db.query(OutboxCheckpoint).filter(OutboxCheckpoint.consumer == consumer).update(
+            {"txid": position[0], "event_id": position[1], "updated_at": func.now()}, synchronize_session=False
+        )
+        self.db.commit()
+
+    def get_checkpoints(self) -> List[Tuple]:
+        """(consumer, txid, event_id, updated_at, lag) of every shared consumer, lag in events not yet handled"""
+        lag = (
+            self.db.query(func.count(OutboxEvent.id))
+            .filter(tuple_(OutboxEvent.txid, OutboxEvent.id) > tuple_(OutboxCheckpoint.txid, OutboxCheckpoint.event_id))
+            .scalar_subquery()
+        )
+        return (
+            self.db.query(OutboxCheckpoint.consumer, OutboxCheckpoint.txid, OutboxCheckpoint.event_id,
+                          OutboxCheckpoint.updated_at, lag.label("lag"))
+            .order_by(OutboxCheckpoint.consumer)
+            .all()
+        )
+
+    def prune(self, keep_days: int) -> int:
+        """Delete events older than keep_days that every shared consumer has handled"""
+        query = self.db.query(OutboxEvent).filter(OutboxEvent.created_at < func.now() - timedelta(days=keep_days))
+        oldest = (
+            self.db.query(OutboxCheckpoint.txid, OutboxCheckpoint.event_id)
+            .order_by(OutboxCheckpoint.txid, OutboxCheckpoint.event_id)
+            .first()
+        )
+        if oldest is not None:
+            query = query.filter(tuple_(OutboxEvent.txid, OutboxEvent.id) <= tuple_(*oldest))
+        deleted = query.delete(synchronize_session=False)
+        self.db.commit()
+        return deleted
@@ -0,0 +1,80 @@
+"""Read-through cache of the payload behind GET /posts/{id}.
+
+Entries are keyed by post id and hold the post, its owner and its vote counts as a
+PostRow (see post_rows.py), with has_liked left False: that field is filled in per caller.
+An entry is only served for the version it was loaded at (posts.version, see versions.py),
+so a write made by another worker process is never served stale. That includes a change to
+the owner's email, username or full name, which bumps all the owner's posts. Writes in this
+process also drop the entry right away, and the outbox consumers in event_handlers.py in every
+worker. Concurrent misses for the same post share one query.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from ...config import settings
+from .post_rows import PostRow
+from .single_flight import single_flight
+
+
+class HotPostCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        # Bounds how long an entry is served without being read again, whatever its version
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[int, float, PostRow]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = single_flight("hot_posts")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, post_id: int, version: int, load: Callable[[], Optional[PostRow]]) -> Optional[PostRow]:
+        """The cached payload of post_id at version, calling load() once on a miss"""
+        with self._lock:
+            entry = self._entries.get(post_id)
+            if entry and entry[0] == version and entry[1] > time.monotonic():
+                self._entries.move_to_end(post_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        def load_and_store():
+            # A load that races a write is stored under the version read before the write,
+            # which no later reader asks for
+            post = load()
+            if post is not None:
+                with self._lock:
+                    self._entries[post_id] = (version, time.monotonic() + self.ttl, post)
+                    self._entries.move_to_end(post_id)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return post
+
+        return self._loads.do((post_id, version), load_and_store)
+
+    def invalidate(self, post_id: int) -> None:
+        """Drop post_id once the write that changed it is flushed.
+
+        A read that reloads it before the commit stores it under the old version, which no
+        reader asks for after the commit.
+        """
+        with self._lock:
+            self._entries.pop(post_id, None)
+
+    def invalidate_owner(self, user_id: int) -> None:
+        """Drop the posts of user_id, whose profile changed; a scan, profile edits are rare"""
+        with self._lock:
+            for post_id in [post_id for post_id, entry in self._entries.items() if entry[2].user_id == user_id]:
+                del self._entries[post_id]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+        return {**stats, "coalesced": self._loads.stats()["shared"]}
+
+
+hot_posts = HotPostCache(settings.hot_post_cache_size, settings.hot_post_cache_ttl)
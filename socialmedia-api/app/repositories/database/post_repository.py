@@ -1,59 +1,210 @@
-from typing import List, Optional, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, func, case
-from .base_repository import BaseRepository
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy.orm import Session, Query, selectinload
+from sqlalchemy import desc, func, and_, tuple_, select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .base_repository import BaseRepository, save
 from ..interfaces.interfaces import IPostRepository
-from ...models import Post, Votes, User
+from ...models import Post, Votes, User, Category, POST_VOTES_JOIN
+from .versions import touch_users
+from .post_cache import hot_posts
+from .author_rings import author_rings
+from .category_cache import category_ids, category_pages
+from .single_flight import single_flight
+from .outbox_repository import record_event, POST_CREATED, POST_UPDATED, POST_DELETED
+from .post_rows import PostRow, Fieldset, post_rows, projection
+from . import statements
+from .statements import vote_counts
+
+# Rows fetched per round trip by the stream_* methods; memory stays at one batch however many rows match
+STREAM_BATCH_SIZE = 500
+
+post_pages = single_flight("post_pages")
+
+
+def page_params(skip: int, limit: int, search: str = "") -> dict:
+    """SKIP, LIMIT and, when there is a search, SEARCH of a statements.published_page"""
+    params = {"skip": skip, "limit": limit}
+    if search:
+        params["search"] = search
+    return params
+
 
 class PostRepository(BaseRepository[Post], IPostRepository):
     def __init__(self, db: Session):
         super().__init__(db, Post)
-        
+
+    def create(self, **kwargs) -> Post:
+        return super().create(**self._with_category_id(kwargs))
+
+    def update(self, id: int, **kwargs) -> Optional[Post]:
+        return super().update(id, **self._with_category_id(kwargs))
+
+    def get_category_id(self, name: str) -> Optional[int]:
+        """categories.id of the category name, None when no post was ever written with it"""
+        return category_ids.get(name, lambda name: self.db.scalar(select(Category.id).where(Category.name == name)))
+
+    def ensure_category_id(self, name: str) -> int:
+        """categories.id of the category name, inserted if it is new"""
+        category_id = self.get_category_id(name)
+        if category_id is None:
+            # An insert of the same name by a transaction still running makes this one wait
+            # for it; once committed there, nothing is inserted here and the name is read again
+            category_id = self.db.scalar(
+                pg_insert(Category).values(name=name).on_conflict_do_nothing().returning(Category.id)
+            )
+            if category_id is None:
+                category_id = self.get_category_id(name)
+        return category_id
+
+    def _with_category_id(self, values: dict) -> dict:
+        """values of a post write, with the category_id of the category they name"""
+        if values.get("category") is not None:
+            return {**values, "category_id": self.ensure_category_id(values["category"])}
+        return values
+
     def get_posts_with_votes(self, current_user_id:int,skip: int = 0, limit: int = 10, search: str = "") -> List[Tuple]: #get_all_posts
-        post = self.db.query(
-                Post, 
-                func.count(Votes.post_id).label("Votes"),
-                func.count(case((Votes.dir == 1, 1))).label("Upvotes"),
-                func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
-                case((func.max(case((Votes.user_id == current_user_id, Votes.dir))).in_([1, -1]), True), else_=False).label("has_liked")                                                                                                                                                                                                                                                                                                                                                    
-            ).join(Votes, Votes.post_id == Post.id, isouter=True).group_by(Post.id).order_by(desc(Post.created_at)).filter(Post.title.contains(search)).limit(limit).offset(skip).all()
-        return post
+        return self.db.execute(statements.posts_page(False, bool(search)),
+                               {"user_id": current_user_id, **page_params(skip, limit, search)}).all()
+
+    def get_post_rows(self, current_user_id: Optional[int], skip: int = 0, limit: int = 10, search: str = "",
+                      fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_posts_with_votes as PostRows, with only the columns fields needs"""
+        return post_rows(self.db.execute(statements.posts_page(True, bool(search), projection(fields)),
+                                         {"user_id": current_user_id, **page_params(skip, limit, search)}))
+
+    def get_posts_with_votes_coalesced(self, current_user_id: int, skip: int = 0, limit: int = 10, search: str = "",
+                                       fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_post_rows, sharing one query between identical concurrent requests"""
+        key = (max(skip, 0), limit, search or "")
+        # Requests whose fields need the same columns share the rows
+        posts = post_pages.do(key + projection(fields), lambda: self.get_post_rows(None, *key, fields))  # has_liked is overlaid per caller
+        return self.overlay_has_liked(posts, current_user_id)
+
+    def overlay_has_liked(self, posts: List[PostRow], user_id: int) -> List[PostRow]:
+        """Copies of shared posts with has_liked for user_id, from one query on the user's votes"""
+        if not posts:
+            return posts
+        keys = [(post.id, post.created_at) for post in posts]
+        liked = {post_id for (post_id,) in self.db.query(Votes.post_id).filter(
+            Votes.user_id == user_id,
+            tuple_(Votes.post_id, Votes.post_created_at).in_(keys),
+            Votes.post_created_at.in_({created_at for _, created_at in keys}),  # lets the planner prune partitions
+            Votes.dir.in_([1, -1]),
+        )}
+        return [post.with_has_liked(post.id in liked) for post in posts]
+
+    def get_posts_page_versions(self, skip: int = 0, limit: int = 10, search: str = "") -> List[Tuple]:
+        """(id, version) of the posts get_posts_with_votes would return, without the vote aggregate"""
+        return self.db.execute(statements.posts_page_versions(bool(search)), page_params(skip, limit, search)).all()
+
+    def get_post_version(self, post_id: int) -> Optional[Tuple]:
+        """(version, updated_at) of a post, enough to answer a conditional GET"""
+        return self.db.query(Post.version, Post.updated_at).filter(Post.id == post_id).first()
+
     def get_user_posts_with_votes(self, user_id, skip = 0, limit = 10): #get_own_posts
+        page = self.db.query(Post.id, Post.created_at).filter(Post.user_id == user_id).order_by(desc(Post.created_at), desc(Post.id)).offset(skip).limit(limit).subquery()
         post=self.db.query(
-                Post,
-                func.count(Votes.post_id).label("Votes"),
-                func.count(case((Votes.dir == 1, 1))).label("Upvotes"),
-                func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
-                case((func.max(case((Votes.user_id == user_id, Votes.dir))).in_([1, -1]), True), else_=False).label("has_liked")
-            ).join(Votes, Votes.post_id == Post.id, isouter=True).group_by(Post.id).filter(Post.user_id == user_id).limit(limit).offset(skip).all()
+                Post, *vote_counts(user_id)
+            ).join(page, and_(page.c.id == Post.id, page.c.created_at == Post.created_at)).join(Votes, POST_VOTES_JOIN, isouter=True).group_by(Post.id, Post.created_at).order_by(desc(Post.created_at), desc(Post.id)).all()
         return post
+    def get_user_post_rows(self, user_id: int, skip: int = 0, limit: int = 10, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """get_user_posts_with_votes as PostRows, with only the columns fields needs"""
+        return post_rows(self.db.execute(statements.user_posts(projection(fields)), {"user_id": user_id, "skip": skip, "limit": limit}))
+
     def get_post_with_votes_by_id(self, post_id: int,current_user_id: int)-> Optional[Tuple]: #get_post()
-        print(post_id)
-        post=self.db.query(
-            Post, 
-            func.count(Votes.post_id).label("Votes"),
-            func.count(case((Votes.dir == 1, 1))).label("Upvotes"),
-            func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
-            case((func.max(case((Votes.user_id == current_user_id, Votes.dir))).in_([1, -1]), True), else_=False).label("has_liked")
-            ).outerjoin(Votes,Votes.post_id==Post.id).filter(Post.id==post_id).group_by(Post.id).first()
-        return post
+        return self.db.execute(statements.post_with_votes(False), {"post_id": post_id, "user_id": current_user_id}).first()
+
+    def get_post_row_by_id(self, post_id: int, current_user_id: Optional[int]) -> Optional[PostRow]:
+        """get_post_with_votes_by_id as a PostRow"""
+        rows = post_rows(self.db.execute(statements.post_with_votes(True), {"post_id": post_id, "user_id": current_user_id}))
+        return rows[0] if rows else None
+
+    def get_hot_post_with_votes(self, post_id: int, current_user_id: int, version: int) -> Optional[PostRow]:
+        """get_post_row_by_id through the hot post cache; version is the post's current posts.version"""
+        post = hot_posts.get(post_id, version, lambda: self.load_post_payload(post_id))
+        if post is None:
+            return None
+        return self.overlay_has_liked([post], current_user_id)[0]
+
+    def load_post_payload(self, post_id: int) -> Optional[PostRow]:
+        """The caller independent part of get_post_row_by_id"""
+        return self.get_post_row_by_id(post_id, None)  # has_liked is filled in per caller
+
     def get_posts_by_user_id(self, user_id: int) -> List[Post]:
         return self.db.query(Post).filter(Post.user_id == user_id).all()
+
+    def stream_posts_by_user_id(self, user_id: int, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Post]:
+        """Like get_posts_by_user_id, but read through a server-side cursor instead of loaded at once"""
+        query = self.db.query(Post).filter(Post.user_id == user_id).order_by(desc(Post.created_at), desc(Post.id))
+        yield from query.yield_per(batch_size)
+
+    def stream_posts_with_votes(self, current_user_id: int, search: str = "", batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Tuple]:
+        """Every published post with vote counts, newest first, without skip/limit"""
+        query = self.posts_with_votes_query(current_user_id).filter(Post.published == True)
+        if search:
+            query = query.filter(Post.title.contains(search))
+        yield from query.yield_per(batch_size)
+
+    def stream_user_posts_with_votes(self, user_id: int, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Tuple]:
+        """All of a user's posts with vote counts, newest first, without skip/limit"""
+        yield from self.posts_with_votes_query(user_id).filter(Post.user_id == user_id).yield_per(batch_size)
+
+    def posts_with_votes_query(self, current_user_id: int) -> Query:
+        """(Post, Votes, Upvotes, Downvotes, has_liked) rows, newest first, for the stream_* methods.
+
+        Owners are loaded with one IN query per batch rather than one query per post.
+        """
+        return self.db.query(
+                Post, *vote_counts(current_user_id)
+            ).outerjoin(Votes, POST_VOTES_JOIN).group_by(Post.id, Post.created_at).order_by(
+                desc(Post.created_at), desc(Post.id)
+            ).options(selectinload(Post.owner))
     
     def create_user_post(self, user_id: int, **post_data) -> Post: #create_posts()
-        post_data['user_id'] = user_id
-        return self.create(**post_data)
+        post = Post(user_id=user_id, **self._with_category_id(post_data))
+        self.db.add(post)
+        self.db.flush()  # assigns the id and created_at the event refers to
+        # The author's posts_count changes
+        touch_users(self.db, User.id == user_id)
+        record_event(self.db, POST_CREATED, post_id=post.id, user_id=user_id, created_at=post.created_at,
+                     category_id=post.category_id)
+        save(self.db)
+        category_pages.invalidate(post.category_id)
+        # Added before the commit; a page naming it after a rollback falls back to SQL
+        author_rings.add(user_id, post.created_at, post.id)
+        return post
     
     def update_user_post(self, post_id: int, user_id: int, **update_data) -> Optional[Post]:
-        post = self.get_by_id(post_id)
-        if post and post.user_id == user_id:
-            return self.update(post_id, **update_data)
+        # Ownership is part of the WHERE clause, so the update needs no lookup first
+        post = self.db.scalars(
+            update(Post).where(Post.id == post_id, Post.user_id == user_id)
+            .values(version=Post.version + 1, updated_at=func.now(), **self._with_category_id(update_data))
+            .returning(Post)
+        ).first()
+        if post:
+            record_event(self.db, POST_UPDATED, post_id=post_id, user_id=user_id, created_at=post.created_at,
+                         category_id=post.category_id)
+            save(self.db)
+            hot_posts.invalidate(post_id)
+            # A category the post left finds it missing on its next page (see category_cache.py)
+            category_pages.invalidate(post.category_id)
+            return post
         return None
     
     def delete_user_post(self, post_id: int, user_id: int) -> bool:
-        post = self.get_by_id(post_id)
-        if post and post.user_id == user_id:
-            return self.delete(post_id)
+        post = self.db.execute(
+            delete(Post).where(Post.id == post_id, Post.user_id == user_id).returning(Post.created_at, Post.category_id)
+        ).first()
+        if post:
+            touch_users(self.db, User.id == user_id)
+            record_event(self.db, POST_DELETED, post_id=post_id, user_id=user_id, created_at=post.created_at,
+                         category_id=post.category_id)
+            save(self.db)
+            hot_posts.invalidate(post_id)
+            category_pages.invalidate(post.category_id)
+            # Reloaded rather than removed: a rolled back delete must not leave the post out
+            author_rings.discard(user_id)
+            return True
         return False
     
     def search_posts(self, search_term: str, skip: int = 0, limit: int = 10) -> List[Post]:
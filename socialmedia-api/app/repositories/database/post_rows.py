@@ -0,0 +1,183 @@
+"""Read path of the hottest endpoints (GET /posts/ and GET /posts/{id}) without ORM instances.
+
+The *_rows methods of PostRepository and FeedRepository select exactly the columns of a
+schemas.PostwithVote and map each row into a PostRow: no Post or User instance, no identity
+map, no lazy load of the owner and no Pydantic validation. The database already enforces
+what validation would check. as_dict() gives the PostwithVote shape, which
+app/responses.py encodes straight to JSON.
+
+The posts are aggregated and cut to the page exactly as by the ORM methods, and the owners
+joined to the page afterwards (statements.with_owners): joined before the aggregate,
+users would be matched to every vote in the window instead of to the page.
+
+A Fieldset (fields= or view= of GET /posts/) keeps a page to some of the fields. Only the
+wide columns are left out of the SQL: content, which is then cut to a preview by the
+database or not read at all, and the owner, whose email is never sent in a fieldset.
+"""
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import func, null
+from ...models import Post, User
+
+# A PostRow is these columns, then OWNER_COLUMNS, then the vote counts (see vote_counts in statements.py)
+POST_COLUMNS = (Post.title, Post.content, Post.category, Post.published, Post.rating, Post.id, Post.created_at, Post.user_id)
+OWNER_COLUMNS = (User.email.label("owner_email"), User.username.label("owner_username"),
+                 User.full_name.label("owner_full_name"), User.created_at.label("owner_created_at"))
+VOTE_COLUMNS = ("Votes", "Upvotes", "Downvotes", "has_liked")
+
+# Characters of content in a preview
+PREVIEW_CHARS = 200
+# Fields a client can ask for, in response order: the post's, then the vote counts beside it
+POST_FIELDS = ("title", "content", "preview", "category", "published", "rating", "id", "created_at", "user_id", "owner")
+VOTE_FIELDS = ("Votes", "Upvotes", "Downvotes", "has_liked")
+VOTE_ATTRIBUTES = {"Votes": "votes", "Upvotes": "upvotes", "Downvotes": "downvotes", "has_liked": "has_liked"}
+# The fields of a view other than full
+VIEWS = {
+    "compact": ("id", "title", "preview", "category", "created_at", "user_id", "owner", "Upvotes", "Downvotes", "has_liked"),
+}
+# What a PostRow selects of content ("content", "preview" or None) and of its owner ("full",
+# "card" without email and created_at, or None), see post_columns and statements.with_owners
+FULL_PROJECTION = ("content", "full")
+
+
+def post_columns(content: Optional[str] = "content") -> tuple:
+    """POST_COLUMNS with content whole, cut for a preview, or NULL"""
+    if content == "preview":
+        # One character more than the preview tells a cut preview from a short post
+        column = func.left(Post.content, PREVIEW_CHARS + 1).label("content")
+    elif content is None:
+        column = null().label("content")
+    else:
+        return POST_COLUMNS
+    return tuple(column if c.key == "content" else c for c in POST_COLUMNS)
+
+
+def owner_columns(owner: Optional[str] = "full") -> tuple:
+    """OWNER_COLUMNS, NULL where the owner projection leaves them out"""
+    if owner == "full":
+        return OWNER_COLUMNS
+    kept = ("owner_username", "owner_full_name") if owner == "card" else ()
+    return tuple(c if c.key in kept else null().label(c.key) for c in OWNER_COLUMNS)
+
+
+def preview(content: Optional[str]) -> Optional[str]:
+    """content cut to PREVIEW_CHARS characters, with an ellipsis if it was longer"""
+    if content is None or len(content) <= PREVIEW_CHARS:
+        return content
+    return content[:PREVIEW_CHARS].rstrip() + "\u2026"
+
+
+class Fieldset:
+    """The fields of every post in a response; id is always one of them"""
+    __slots__ = ("post_fields", "vote_fields", "projection")
+
+    def __init__(self, names: Iterable[str]):
+        names = set(names) | {"id"}
+        unknown = names.difference(POST_FIELDS, VOTE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields {', '.join(sorted(unknown))}, expected some of {', '.join(POST_FIELDS + VOTE_FIELDS)}")
+        self.post_fields = tuple(name for name in POST_FIELDS if name in names)
+        self.vote_fields = tuple(name for name in VOTE_FIELDS if name in names)
+        content = "content" if "content" in names else "preview" if "preview" in names else None
+        self.projection: Tuple[Optional[str], Optional[str]] = (content, "card" if "owner" in names else None)
+
+    @property
+    def key(self) -> str:
+        return ",".join(self.post_fields + self.vote_fields)
+
+
+def projection(fields: Optional[Fieldset]) -> Tuple[Optional[str], Optional[str]]:
+    """The projection rows for fields are selected with, FULL_PROJECTION for every field"""
+    return FULL_PROJECTION if fields is None else fields.projection
+
+
+def fieldset(view: str = "full", fields: Optional[str] = None) -> Optional[Fieldset]:
+    """The Fieldset of a request's fields= (a comma separated list), else of its view; None for full"""
+    if fields:
+        return Fieldset(name.strip() for name in fields.split(",") if name.strip())
+    if view == "full":
+        return None
+    if view not in VIEWS:
+        raise ValueError(f"Unknown view {view}, expected full or {', '.join(VIEWS)}")
+    return Fieldset(VIEWS[view])
+
+
+class PostRow:
+    __slots__ = ("title", "content", "category", "published", "rating", "id", "created_at", "user_id",
+                 "owner_email", "owner_username", "owner_full_name", "owner_created_at",
+                 "votes", "upvotes", "downvotes", "has_liked")
+
+    def __init__(self, title, content, category, published, rating, id, created_at, user_id,
+                 owner_email, owner_username, owner_full_name, owner_created_at,
+                 votes, upvotes, downvotes, has_liked=False):
+        self.title = title
+        self.content = content
+        self.category = category
+        self.published = published
+        self.rating = rating
+        self.id = id
+        self.created_at = created_at
+        self.user_id = user_id
+        self.owner_email = owner_email
+        self.owner_username = owner_username
+        self.owner_full_name = owner_full_name
+        self.owner_created_at = owner_created_at
+        self.votes = votes
+        self.upvotes = upvotes
+        self.downvotes = downvotes
+        self.has_liked = bool(has_liked)
+
+    def with_has_liked(self, has_liked: bool) -> "PostRow":
+        """A copy for one viewer; cached rows are shared and never changed"""
+        copy = PostRow.__new__(PostRow)
+        for name in PostRow.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.has_liked = has_liked
+        return copy
+
+    def as_dict(self, fields: Optional[Fieldset] = None) -> dict:
+        """The row as a schemas.PostwithVote, keys in the same order, or as a
+        schemas.PostCardwithVote of the given fields"""
+        if fields is not None:
+            return self.card(fields)
+        return {
+            "Post": {
+                "title": self.title,
+                "content": self.content,
+                "category": self.category,
+                "published": self.published,
+                "rating": self.rating,
+                "id": self.id,
+                "created_at": self.created_at,
+                "user_id": self.user_id,
+                "owner": {
+                    "id": self.user_id,
+                    "email": self.owner_email,
+                    "username": self.owner_username,
+                    "full_name": self.owner_full_name,
+                    "created_at": self.owner_created_at,
+                },
+            },
+            "Votes": self.votes,
+            "Upvotes": self.upvotes,
+            "Downvotes": self.downvotes,
+            "has_liked": self.has_liked,
+        }
+
+    def card(self, fields: Fieldset) -> dict:
+        post = {}
+        for name in fields.post_fields:
+            if name == "owner":
+                post[name] = {"id": self.user_id, "username": self.owner_username, "full_name": self.owner_full_name}
+            elif name == "preview":
+                post[name] = preview(self.content)
+            else:
+                post[name] = getattr(self, name)
+        card = {"Post": post}
+        for name in fields.vote_fields:
+            card[name] = getattr(self, VOTE_ATTRIBUTES[name])
+        return card
+
+
+def post_rows(rows: Iterable) -> List[PostRow]:
+    """PostRows of (*POST_COLUMNS, *OWNER_COLUMNS, *VOTE_COLUMNS) result rows"""
+    return [PostRow(*row) for row in rows]
@@ -0,0 +1,310 @@
+"""Statements of the post and feed reads, built once per process.
+
+Every value that changes between calls is a bound parameter (USER_ID, SKIP, LIMIT, ...), so
+each statement is a constant: it is built on its first use, its cache key is computed once,
+and the engine compiles its SQL once (hits and misses: database.compiled_cache_stats). A call
+only binds its parameters, see PostRepository and FeedRepository. Whatever changes the shape
+of the SQL (PostRows or ORM entities, the projection of a Fieldset, a search filter, a
+reader's voting history) makes a statement of its own, one per combination of the arguments
+of the functions below.
+"""
+from functools import lru_cache
+from sqlalchemy import ARRAY, Integer, String, DateTime, any_, bindparam, select, union_all, func, case, and_, desc, true
+from sqlalchemy.sql import Select
+from ...models import Post, Votes, User, Followers, POST_VOTES_JOIN
+from .post_rows import POST_COLUMNS, VOTE_COLUMNS, FULL_PROJECTION, post_columns, owner_columns
+
+USER_ID = bindparam("user_id", type_=Integer)
+POST_ID = bindparam("post_id", type_=Integer)
+SKIP = bindparam("skip", type_=Integer)
+LIMIT = bindparam("limit", type_=Integer)
+SEARCH = bindparam("search", type_=String)
+# Oldest created_at of a time window; pruning the partitions outside it still happens at plan
+# time, psycopg2 sends the value inline
+CUTOFF = bindparam("cutoff", type_=DateTime(timezone=True))
+# Author rings (author_rings.py): the authors to load and how many posts each, and the
+# (id, created_at) keys of a page, as two arrays so created_at still prunes partitions
+AUTHORS = bindparam("authors", type_=ARRAY(Integer))
+RING_SIZE = bindparam("ring_size", type_=Integer)
+POST_IDS = bindparam("post_ids", type_=ARRAY(Integer))
+CREATED_ATS = bindparam("created_ats", type_=ARRAY(DateTime(timezone=True)))
+CATEGORY_ID = bindparam("category_id", type_=Integer)
+
+# Orders of a category page (FeedRepository.get_category_feed_rows), all columns descending
+CATEGORY_ORDERS = {"latest": (Post.created_at, Post.id), "hot": (Post.hot_score, Post.id)}
+
+
+def vote_counts(user_id=USER_ID) -> tuple:
+    """Votes, Upvotes, Downvotes and has_liked columns of a query grouped per post.
+
+    has_liked is for user_id, a value or the USER_ID parameter; None leaves it False.
+    """
+    return (
+        func.count(Votes.post_id).label("Votes"),
+        func.count(case((Votes.dir == 1, 1))).label("Upvotes"),
+        func.count(case((Votes.dir == -1, 1))).label("Downvotes"),
+        case((func.max(case((Votes.user_id == user_id, Votes.dir))).in_([1, -1]), True), else_=False).label("has_liked"),
+    )
+
+
+def with_votes(rows: bool, page=None, votes_join=POST_VOTES_JOIN, content="content") -> Select:
+    """Posts with their vote counts, grouped per post.
+
+    (Post, Votes, Upvotes, Downvotes, has_liked) rows, or the post columns of a PostRow
+    with content as in post_columns when rows is set, for with_owners. page narrows it to a
+    subquery of (id, created_at).
+    """
+    stmt = select(*(post_columns(content) if rows else (Post,)), *vote_counts())
+    if page is not None:
+        stmt = stmt.join(page, and_(page.c.id == Post.id, page.c.created_at == Post.created_at))
+    return stmt.join(Votes, votes_join, isouter=True).group_by(Post.id, Post.created_at)
+
+
+def with_owners(stmt: Select, *order_desc: str, owner="full") -> Select:
+    """The PostRow columns of a with_votes(rows=True) statement, owners joined after its limit.
+
+    order_desc names the columns of stmt its rows are ordered by, descending; the join does
+    not keep the order of the subquery. owner is as in owner_columns, without one no user is
+    joined.
+    """
+    page = stmt.subquery()
+    rows = select(
+        *(page.c[column.key] for column in POST_COLUMNS), *owner_columns(owner), *(page.c[name] for name in VOTE_COLUMNS)
+    )
+    if owner is not None:
+        rows = rows.join(User, User.id == page.c.user_id)
+    return rows.order_by(*(desc(page.c[name]) for name in order_desc))
+
+
+def published_page(search: bool, *columns) -> Select:
+    """columns of one page (SKIP, LIMIT) of published posts, newest first, titles containing SEARCH if search"""
+    page = select(*columns).where(Post.published == True)
+    if search:
+        page = page.where(Post.title.contains(SEARCH))
+    return page.order_by(desc(Post.created_at), desc(Post.id)).offset(SKIP).limit(LIMIT)
+
+
+@lru_cache(maxsize=None)
+def posts_page(rows: bool, search: bool, projection=FULL_PROJECTION) -> Select:
+    """PostRepository.get_posts_with_votes, or get_post_rows of (content, owner) projection when rows is set"""
+    content, owner = projection
+    # Pick the page first so idx_posts_published_created can stop after skip+limit rows,
+    # then aggregate votes for just those posts instead of for every post in the table
+    page = published_page(search, Post.id, Post.created_at).subquery()
+    stmt = with_votes(rows, page, content=content).order_by(desc(Post.created_at), desc(Post.id))
+    return with_owners(stmt, "created_at", "id", owner=owner) if rows else stmt
+
+
+@lru_cache(maxsize=None)
+def posts_page_versions(search: bool) -> Select:
+    """PostRepository.get_posts_page_versions"""
+    return published_page(search, Post.id, Post.version)
+
+
+@lru_cache(maxsize=None)
+def post_with_votes(rows: bool) -> Select:
+    """PostRepository.get_post_with_votes_by_id (POST_ID), or get_post_row_by_id when rows is set"""
+    stmt = with_votes(rows).where(Post.id == POST_ID).limit(1)
+    return with_owners(stmt) if rows else stmt
+
+
+def following_page() -> Select:
+    """(id, created_at) of one page of USER_ID's following feed, newest first"""
+    authors = union_all(
+        select(Followers.following_id.label("user_id")).where(Followers.follower_id == USER_ID),
+        select(USER_ID.label("user_id"))  # Include own posts
+    ).subquery()
+    # Newest skip+limit posts of each author (index only scan on idx_posts_user_created_id),
+    # merged and cut to the page, so the cost follows the number of authors, not their post counts
+    recent = select(Post.id, Post.created_at).where(Post.user_id == authors.c.user_id).order_by(
+                desc(Post.created_at), desc(Post.id)
+            ).limit(SKIP + LIMIT).lateral()
+    return select(recent.c.id, recent.c.created_at).select_from(authors).join(recent, true()).order_by(
+                desc(recent.c.created_at), desc(recent.c.id)
+            ).offset(SKIP).limit(LIMIT)
+
+
+@lru_cache(maxsize=None)
+def user_posts(projection=FULL_PROJECTION) -> Select:
+    """PostRepository.get_user_post_rows: one page of USER_ID's own posts, newest first"""
+    content, owner = projection
+    page = select(Post.id, Post.created_at).where(Post.user_id == USER_ID).order_by(
+                desc(Post.created_at), desc(Post.id)
+            ).offset(SKIP).limit(LIMIT).subquery()
+    stmt = with_votes(True, page, content=content).order_by(desc(Post.created_at), desc(Post.id))
+    return with_owners(stmt, "created_at", "id", owner=owner)
+
+
+@lru_cache(maxsize=None)
+def following_feed(rows: bool, projection=FULL_PROJECTION) -> Select:
+    """FeedRepository.get_following_feed, or get_following_feed_rows when rows is set"""
+    content, owner = projection
+    stmt = with_votes(rows, following_page().subquery(), content=content).order_by(desc(Post.created_at), desc(Post.id))
+    return with_owners(stmt, "created_at", "id", owner=owner) if rows else stmt
+
+
+@lru_cache(maxsize=None)
+def following_page_versions() -> Select:
+    """FeedRepository.get_following_page_versions"""
+    page = following_page().subquery()
+    return select(Post.id, Post.version).join(
+                page, and_(page.c.id == Post.id, page.c.created_at == Post.created_at)
+            ).order_by(desc(Post.created_at), desc(Post.id))
+
+
+@lru_cache(maxsize=None)
+def followed_authors() -> Select:
+    """Everyone USER_ID follows"""
+    return select(Followers.following_id).where(Followers.follower_id == USER_ID)
+
+
+@lru_cache(maxsize=None)
+def recent_posts() -> Select:
+    """(user_id, created_at, id) of the newest RING_SIZE posts of each of AUTHORS, newest first"""
+    authors = func.unnest(AUTHORS).table_valued("user_id").render_derived(name="authors")
+    recent = select(Post.created_at, Post.id).where(Post.user_id == authors.c.user_id).order_by(
+                desc(Post.created_at), desc(Post.id)
+            ).limit(RING_SIZE).lateral()
+    return select(authors.c.user_id, recent.c.created_at, recent.c.id).select_from(authors).join(recent, true()).order_by(
+                authors.c.user_id, desc(recent.c.created_at), desc(recent.c.id)
+            )
+
+
+def keyed_posts(category: bool):
+    """The condition of posts whose keys are in POST_IDS and CREATED_ATS, published in CATEGORY_ID if category"""
+    keyed = and_(Post.id == any_(POST_IDS), Post.created_at == any_(CREATED_ATS))
+    return and_(keyed, Post.category_id == CATEGORY_ID, Post.published == True) if category else keyed
+
+
+@lru_cache(maxsize=None)
+def posts_by_key(projection=FULL_PROJECTION, category: bool = False) -> Select:
+    """FeedRepository.get_following_feed_from_rings and get_category_feed_rows: the posts of a page of keys, newest first"""
+    content, owner = projection
+    stmt = with_votes(True, content=content).where(keyed_posts(category))
+    return with_owners(stmt, "created_at", "id", owner=owner)
+
+
+@lru_cache(maxsize=None)
+def post_versions_by_key(category: bool = False) -> Select:
+    """FeedRepository.get_following_page_versions_from_rings and get_category_page_versions"""
+    return select(Post.id, Post.version).where(keyed_posts(category)).order_by(desc(Post.created_at), desc(Post.id))
+
+
+@lru_cache(maxsize=None)
+def trending_feed(rows: bool, projection=FULL_PROJECTION) -> Select:
+    """FeedRepository.get_trending_feed for the window since CUTOFF, or get_trending_feed_rows when rows is set"""
+    content, owner = projection
+    hours_old = func.greatest(func.extract('epoch', func.now() - Post.created_at) / 3600.0,1.0)  # Prevent division by zero
+    trend_score = ((func.count(case((Votes.dir == 1, 1))) - func.count(case((Votes.dir == -1, 1)))) / hours_old).label("trend_score")
+
+    posts = with_votes(
+        # The cutoff on both sides prunes posts and votes partitions outside the window at plan time
+        rows, votes_join=and_(POST_VOTES_JOIN, Votes.post_created_at >= CUTOFF), content=content
+    ).add_columns(trend_score)
+    if not rows:
+        # Calculate vote velocity: total_votes / hours_since_creation
+        posts = posts.add_columns((func.count(Votes.post_id) / hours_old).label("vote_velocity"))
+    posts = posts.where(Post.created_at >= CUTOFF, Post.published == True).having(
+        func.count(Votes.post_id) >= 2
+    ).order_by(
+        desc(trend_score)  # Order by trend score
+    ).offset(SKIP).limit(LIMIT)
+    return with_owners(posts, "trend_score", owner=owner) if rows else posts
+
+
+def hot_page(*columns) -> Select:
+    """columns of one page (SKIP, LIMIT) of published posts, highest hot_score first"""
+    return select(*columns).where(Post.published == True).order_by(
+                desc(Post.hot_score), desc(Post.id)
+            ).offset(SKIP).limit(LIMIT)
+
+
+@lru_cache(maxsize=None)
+def hot_feed(rows: bool, projection=FULL_PROJECTION) -> Select:
+    """FeedRepository.get_hot_feed, or get_hot_feed_rows when rows is set"""
+    content, owner = projection
+    # The page comes off idx_posts_published_hot, votes are counted for its posts only
+    page = hot_page(Post.id, Post.created_at).subquery()
+    stmt = with_votes(rows, page, content=content).order_by(desc(Post.hot_score), desc(Post.id))
+    return with_owners(stmt.add_columns(Post.hot_score), "hot_score", "id", owner=owner) if rows else stmt
+
+
+@lru_cache(maxsize=None)
+def hot_page_versions() -> Select:
+    """FeedRepository.get_hot_page_versions"""
+    return hot_page(Post.id, Post.version)
+
+
+def category_page(sort: str, *columns) -> Select:
+    """columns of one page (SKIP, LIMIT) of the published posts of CATEGORY_ID in sort order"""
+    return select(*columns).where(Post.category_id == CATEGORY_ID, Post.published == True).order_by(
+                *(desc(column) for column in CATEGORY_ORDERS[sort])
+            ).offset(SKIP).limit(LIMIT)
+
+
+@lru_cache(maxsize=None)
+def category_feed(sort: str, projection=FULL_PROJECTION) -> Select:
+    """FeedRepository.get_category_feed_rows read with SQL"""
+    content, owner = projection
+    order = CATEGORY_ORDERS[sort]
+    # The page comes off idx_posts_category_published_created or _hot, votes are counted for its posts only
+    page = category_page(sort, Post.id, Post.created_at).subquery()
+    stmt = with_votes(True, page, content=content).order_by(*(desc(column) for column in order))
+    if sort == "hot":
+        stmt = stmt.add_columns(Post.hot_score)
+    return with_owners(stmt, *(column.key for column in order), owner=owner)
+
+
+@lru_cache(maxsize=None)
+def category_page_keys(sort: str) -> Select:
+    """(created_at, id) of a category page, what category_cache.CategoryPages keeps"""
+    return category_page(sort, Post.created_at, Post.id)
+
+
+@lru_cache(maxsize=None)
+def category_page_versions(sort: str) -> Select:
+    """FeedRepository.get_category_page_versions read with SQL"""
+    return category_page(sort, Post.id, Post.version)
+
+
+@lru_cache(maxsize=None)
+def voting_history() -> Select:
+    """Any one vote of USER_ID"""
+    return select(Votes.post_id).where(Votes.user_id == USER_ID).limit(1)
+
+
+@lru_cache(maxsize=None)
+def recommended_feed(rows: bool, history: bool, projection=FULL_PROJECTION) -> Select:
+    """FeedRepository.get_recommended_feed for posts since CUTOFF, or get_recommended_feed_rows when rows is set.
+
+    With history, only posts USER_ID has not voted on, from the categories they vote on most.
+    """
+    content, owner = projection
+    # Grouped and matched on category_id, not on the category name
+    user_preferred_categories = select(
+        Post.category_id,
+        func.count(Votes.post_id).label("interaction_count")
+    ).join(
+        Votes, POST_VOTES_JOIN
+    ).where(
+        Votes.user_id == USER_ID
+    ).group_by(Post.category_id).order_by(
+        desc("interaction_count")
+    ).limit(3).subquery()
+
+    recommended_posts = with_votes(
+        rows, votes_join=and_(POST_VOTES_JOIN, Votes.post_created_at >= CUTOFF), content=content
+    ).where(
+        Post.created_at >= CUTOFF,
+        Post.user_id != USER_ID,
+        Post.published == True
+    )
+    if history:
+        recommended_posts = recommended_posts.where(
+            Post.category_id.in_(select(user_preferred_categories.c.category_id)),
+            ~Post.id.in_(select(Votes.post_id).where(Votes.user_id == USER_ID)),
+        )
+    recommended_posts = recommended_posts.order_by(
+        desc(func.count(case((Votes.dir == 1, 1))))
+    ).offset(SKIP).limit(LIMIT)
+    return with_owners(recommended_posts, "Upvotes", owner=owner) if rows else recommended_posts
@@ -0,0 +1,130 @@
+"""Bloom filters of every email and username, to answer "no such user" without a query.
+
+POST /register and contact imports look names up that mostly do not exist. A Bloom filter
+never misses a name it was given, so a name it does not contain belongs to no user and
+UserRepository answers without the database; a name it may contain (all real ones, and
+user_filter_false_positive_rate of the others) is looked up.
+
+Each worker builds the filters when it starts and again every user_filter_rebuild_seconds
+(app/filter_refresh.py), sized for twice the users it counted. Until the first build they
+are not ready and every name is looked up. Between builds, UserRepository adds the names it
+writes, and the outbox consumer in event_handlers.py those written by other workers, with
+the delay of one outbox poll. Names that change are added, never removed: the old ones stay
+possible until the next build.
+
+Only checks that tolerate that delay use the filters: a registration of a name another worker
+just wrote still meets the unique constraints (ON CONFLICT DO NOTHING), and a contact import
+can be sent again. Logins and renames always query: a stale miss there would refuse a real
+user, or send the rename to the unique constraint as an error.
+"""
+import hashlib
+import math
+import threading
+from typing import Iterable, Optional, Tuple
+from ...config import settings
+
+
+class BloomFilter:
+    """Set of strings with no false negatives, sized for capacity at false_positive_rate"""
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value: str) -> None:
+        """Not thread safe: a bit set by one thread can be lost to another's update of the same byte"""
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class UserFilters:
+    def __init__(self, false_positive_rate: float, enabled: bool = True):
+        self.false_positive_rate = false_positive_rate
+        self.enabled = enabled
+        self.emails: Optional[BloomFilter] = None
+        self.usernames: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+        # Names added while a build runs, added to the new filters before they replace the old
+        self._pending: Optional[list] = None
+        self.definite_misses = 0
+        self.lookups = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and self.emails is not None
+
+    def might_have_email(self, email: str) -> bool:
+        return self._might_have(email, self.emails)
+
+    def might_have_username(self, username: str) -> bool:
+        return self._might_have(username, self.usernames)
+
+    def _might_have(self, value: str, bloom: Optional[BloomFilter]) -> bool:
+        if not self.ready:
+            return True
+        found = value in bloom
+        self._count(found)
+        return found
+
+    def _count(self, found: bool) -> None:
+        with self._lock:
+            if found:
+                self.lookups += 1
+            else:
+                self.definite_misses += 1
+
+    def add(self, email: Optional[str], username: Optional[str]) -> None:
+        """A user's email and username, new or changed"""
+        with self._lock:
+            if self.emails is not None:
+                self._add(self.emails, self.usernames, email, username)
+            if self._pending is not None:
+                self._pending.append((email, username))
+
+    @staticmethod
+    def _add(emails: BloomFilter, usernames: BloomFilter, email: Optional[str], username: Optional[str]) -> None:
+        if email:
+            emails.add(email)
+        if username:
+            usernames.add(username)
+
+    def rebuild(self, count: int, users: Iterable[Tuple[str, Optional[str]]]) -> None:
+        """Replace the filters with ones of the (email, username) of users, count of them"""
+        with self._lock:
+            self._pending = []
+        try:
+            emails = BloomFilter(2 * count, self.false_positive_rate)
+            usernames = BloomFilter(2 * count, self.false_positive_rate)
+            for email, username in users:
+                self._add(emails, usernames, email, username)
+            with self._lock:
+                for email, username in self._pending:
+                    self._add(emails, usernames, email, username)
+                self.emails, self.usernames = emails, usernames
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"ready": self.ready, "definite_misses": self.definite_misses, "lookups": self.lookups}
+            if self.emails is not None:
+                stats.update(emails_added=self.emails.count, usernames_added=self.usernames.count,
+                             bytes=len(self.emails.bits) + len(self.usernames.bits), hashes=self.emails.hashes)
+        return stats
+
+
+user_filters = UserFilters(settings.user_filter_false_positive_rate, settings.user_filters_enabled)
@@ -1,14 +1,80 @@
-from typing import List, Optional
-from sqlalchemy import Boolean, Tuple, case, func
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+from sqlalchemy import Boolean, Tuple, case, func, or_, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
-from .base_repository import BaseRepository
+from .base_repository import BaseRepository, save
 from ..interfaces.interfaces import IUserRepository
-from ...models import User, Post, Votes, Followers
+from ...cache import cache
+from ...config import settings
+from ...models import User, Post, Votes, Followers, POST_VOTES_JOIN
+from .follower_repository import follow_count
+from .outbox_repository import record_event, USER_CREATED, USER_UPDATED
+from .user_filters import user_filters
+from .post_cache import hot_posts
+from .versions import touch_posts
+
+# Values per IN list when matching imported contacts against users
+LOOKUP_BATCH_SIZE = 1000
+# Rows per fetch when reading every user's names for the user filters
+LOGIN_BATCH_SIZE = 10000
+# Columns of a user embedded in each of their posts (the owner of PostwithVote)
+OWNER_FIELDS = ("email", "username", "full_name")
+
+# What oauth2.get_current_user needs of a user, cached under the user's tag
+user_records = cache.namespace("users", ttl=settings.user_cache_ttl, max_entries=settings.user_cache_size,
+                               local_ttl=settings.user_cache_local_ttl)
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
 
 class UserRepository(BaseRepository[User], IUserRepository): 
     def __init__(self, db: Session):
         super().__init__(db, User)
     
+    def update(self, id: int, **kwargs) -> Optional[User]:
+        """Update entity by ID, bumping the version behind the profile's ETag"""
+        # One UPDATE ... RETURNING: no lookup first, and the new version comes back with it
+        user = self.db.scalars(
+            update(User).where(User.id == id)
+            .values(version=User.version + 1, updated_at=func.now(),
+                    **{key: value for key, value in kwargs.items() if hasattr(User, key)})
+            .returning(User)
+        ).first()
+        if user:
+            if any(key in kwargs for key in OWNER_FIELDS):
+                # The ETags of the posts and feed pages cover posts.version only
+                touch_posts(self.db, Post.user_id == user.id)
+                hot_posts.invalidate_owner(user.id)
+            # New names reach the filters of other workers through the outbox, every change their caches
+            email = user.email if "email" in kwargs else None
+            username = user.username if "username" in kwargs else None
+            record_event(self.db, USER_UPDATED, user_id=user.id, email=email, username=username)
+            user_filters.add(email, username)
+            save(self.db)
+            cache.invalidate(user_tag(user.id))
+        return user
+
+    def delete(self, id: int) -> bool:
+        deleted = super().delete(id)
+        if deleted:
+            cache.invalidate(user_tag(id))
+        return deleted
+
+    def get_cached_user(self, user_id: int) -> Optional[dict]:
+        """id, email, username, full_name and created_at of a user, through the "users" cache; None when there is no such user"""
+        def load() -> Optional[dict]:
+            row = (self.db.query(User.id, User.email, User.username, User.full_name, User.created_at)
+                   .filter(User.id == user_id).first())
+            return None if row is None else row._asdict()
+
+        return user_records.get(user_id, load, tags=(user_tag(user_id),))
+
+    def get_user_version(self, user_id: int) -> Optional[Tuple]:
+        """(version, updated_at) of a profile, enough to answer a conditional GET"""
+        return self.db.query(User.version, User.updated_at).filter(User.id == user_id).first()
+
     def get_by_email(self, email: str) -> Optional[User]:
         #Query from routes/auth.py and routes/user.py
         return self.db.query(User).filter(User.email == email).first()
@@ -16,27 +82,90 @@ class UserRepository(BaseRepository[User], IUserRepository):
     def get_by_username(self, username: str) -> Optional[User]: 
         """Get user by username"""
         return self.db.query(User).filter(User.username == username).first()
+
+    def get_by_login(self, login: str) -> Optional[User]:
+        """The user whose email or username is login, the email first.
+
+        Always a query, never answered by the user filters: a user who registers on one worker
+        and logs in on another before the filters there hear of the name would be refused.
+        """
+        return (
+            self.db.query(User)
+            .filter(or_(User.email == login, User.username == login))
+            # One user's email can be another's username
+            .order_by((User.email == login).desc())
+            .first()
+        )
+
+    def count_users(self) -> int:
+        return self.db.query(func.count(User.id)).scalar()
+
+    def get_user_logins(self, batch_size: int = LOGIN_BATCH_SIZE) -> Iterator[Tuple]:
+        """(email, username) of every user, read through a server-side cursor, to build the user filters"""
+        yield from self.db.query(User.email, User.username).yield_per(batch_size)
     
+    def get_existing_user_ids(self, user_ids: Iterable[int]) -> Set[int]:
+        """The ids among user_ids that belong to a user, in one IN query"""
+        user_ids = set(user_ids)
+        if not user_ids:
+            return set()
+        return {user_id for (user_id,) in self.db.query(User.id).filter(User.id.in_(user_ids))}
+
+    def get_user_ids_by_emails(self, emails: Iterable[str], batch_size: int = LOOKUP_BATCH_SIZE) -> Dict[str, int]:
+        """{email: user id} of the emails that belong to a user, one IN query per batch_size emails"""
+        return self._user_ids_by(User.email, emails, batch_size, user_filters.might_have_email)
+
+    def get_user_ids_by_usernames(self, usernames: Iterable[str], batch_size: int = LOOKUP_BATCH_SIZE) -> Dict[str, int]:
+        """{username: user id} of the usernames that belong to a user, one IN query per batch_size usernames"""
+        return self._user_ids_by(User.username, usernames, batch_size, user_filters.might_have_username)
+
+    def _user_ids_by(self, column, values: Iterable[str], batch_size: int,
+                     might_have: Callable[[str], bool]) -> Dict[str, int]:
+        # Values the user filters rule out are not looked up
+        values = [value for value in set(values) if might_have(value)]
+        found = {}
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            found.update(self.db.query(column, User.id).filter(column.in_(batch)).all())
+        return found
+
     def email_exists(self, email: str) -> bool:
+        if not user_filters.might_have_email(email):
+            return False
         return self.db.query(User).filter(User.email == email).first() is not None
     
     def username_exists(self, username: str) -> bool: 
         """Check if username already exists"""
+        if not user_filters.might_have_username(username):
+            return False
         return self.db.query(User).filter(User.username == username).first() is not None
     
-    def create_with_hashed_password(self, email: str, hashed_password: str, username: str = None, full_name: str = None,phone_number: str = None) -> User: #create_user()
-        return self.create(
-            email=email,
-            username=username,
-            full_name=full_name,
-            password=hashed_password,
-            phone_number=phone_number
-        )
+    def create_with_hashed_password(self, email: str, hashed_password: str, username: str = None, full_name: str = None,phone_number: str = None) -> Optional[User]: #create_user()
+        """Insert the user, or return None when the email or username is taken.
+
+        The unique constraints decide, with ON CONFLICT DO NOTHING: two registrations of the
+        same name racing each other get one user and one None, not an IntegrityError.
+        """
+        user = self.db.scalars(
+            insert(User)
+            .values(email=email, username=username, full_name=full_name, password=hashed_password, phone_number=phone_number)
+            .on_conflict_do_nothing()
+            .returning(User)
+        ).first()
+        if user:
+            record_event(self.db, USER_CREATED, user_id=user.id, email=user.email, username=user.username)
+            user_filters.add(user.email, user.username)
+            save(self.db)
+            cache.invalidate(user_tag(user.id))  # The id may have been cached as missing
+        return user
     
     def update_username(self, user_id: int, new_username: str) -> Optional[User]:
-        """Update user's username"""
-        # Check if username already exists
-        if self.username_exists(new_username):
+        """Update user's username; None when it is taken.
+
+        Looked up, not through the user filters: a name another worker just wrote can still
+        be missing from them, and the UPDATE would then fail on the unique constraint.
+        """
+        if self.get_by_username(new_username) is not None:
             return None
         return self.update(user_id, username=new_username)
     
@@ -74,15 +203,14 @@ class UserRepository(BaseRepository[User], IUserRepository):
     
     def get_user_vote_statistics(self, user_id: int) -> dict:
         """Get total vote statistics for all user's posts"""
-        user_post_ids = self.db.query(Post.id).filter(Post.user_id == user_id).subquery()
-        
         vote_stats = (
             self.db.query(
                 func.count(Votes.post_id).label("total_votes"),
                 func.count(case((Votes.dir == 1, 1))).label("total_upvotes"),
                 func.count(case((Votes.dir == -1, 1))).label("total_downvotes")
             )
-            .filter(Votes.post_id.in_(user_post_ids))
+            .join(Post, POST_VOTES_JOIN)  # a join on both keys runs partition by partition
+            .filter(Post.user_id == user_id)
             .first()
         )
         
@@ -104,9 +232,9 @@ class UserRepository(BaseRepository[User], IUserRepository):
                 Post,
                 func.count(Votes.post_id).label("vote_count")
             )
-            .outerjoin(Votes, Votes.post_id == Post.id)
+            .outerjoin(Votes, POST_VOTES_JOIN)
             .filter(Post.user_id == user_id)
-            .group_by(Post.id)
+            .group_by(Post.id, Post.created_at)
             .order_by(func.count(Votes.post_id).desc())
             .first()
         )
@@ -140,37 +268,27 @@ class UserRepository(BaseRepository[User], IUserRepository):
         is_mutual = None
         
         if current_user_id is not None and current_user_id != user_id:
-            # Check if current user follows target user
-            following_check = self.db.query(Followers).filter(
-                Followers.follower_id == current_user_id,
-                Followers.following_id == user_id
-            ).first()
-            is_following = following_check is not None
-            
-            # Check if target user follows current user
-            followed_by_check = self.db.query(Followers).filter(
-                Followers.follower_id == user_id,
-                Followers.following_id == current_user_id
-            ).first()
-            is_followed_by = followed_by_check is not None
-            
-            # Mutual is true if both conditions are true
-            is_mutual = is_following and is_followed_by
+            # Primary key lookups folded into the stats query: the follow in each direction,
+            # and the mutual flag kept on the current user's follow
+            follow = self.db.query(Followers).filter(Followers.follower_id == current_user_id, Followers.following_id == user_id)
+            is_following = follow.exists()
+            is_followed_by = self.db.query(Followers).filter(Followers.follower_id == user_id, Followers.following_id == current_user_id).exists()
+            is_mutual = func.coalesce(follow.with_entities(Followers.mutual).scalar_subquery(), False)
         result = (
             self.db.query(
                 User,
                 # Follower count
-                func.coalesce(self.db.query(func.count(Followers.follower_id)).filter(Followers.following_id == user_id).scalar_subquery(),0).label('followers_count'),
+                follow_count(User.followers_count, Followers.following_id, user_id).label('followers_count'),
                 # Following count  
-                func.coalesce(self.db.query(func.count(Followers.following_id)).filter(Followers.follower_id == user_id).scalar_subquery(),0).label('following_count'),
+                follow_count(User.following_count, Followers.follower_id, user_id).label('following_count'),
                 # Posts count
                 func.coalesce(self.db.query(func.count(Post.id)).filter(Post.user_id == user_id).scalar_subquery(),0).label('posts_count'),
                 # Total votes received
-                func.coalesce(self.db.query(func.count(Votes.post_id)).join(Post, Post.id == Votes.post_id).filter(Post.user_id == user_id).scalar_subquery(),0).label('total_votes_received'),
+                func.coalesce(self.db.query(func.count(Votes.post_id)).join(Post, POST_VOTES_JOIN).filter(Post.user_id == user_id).scalar_subquery(),0).label('total_votes_received'),
                 # Total upvotes received
-                func.coalesce(self.db.query(func.count(case((Votes.dir == 1, 1)))).join(Post, Post.id == Votes.post_id).filter(Post.user_id == user_id).scalar_subquery(),0).label('total_upvotes_received'),
+                func.coalesce(self.db.query(func.count(case((Votes.dir == 1, 1)))).join(Post, POST_VOTES_JOIN).filter(Post.user_id == user_id).scalar_subquery(),0).label('total_upvotes_received'),
                 # Total downvotes received
-                func.coalesce(self.db.query(func.count(case((Votes.dir == -1, 1)))).join(Post, Post.id == Votes.post_id).filter(Post.user_id == user_id).scalar_subquery(),0).label('total_downvotes_received'),
+                func.coalesce(self.db.query(func.count(case((Votes.dir == -1, 1)))).join(Post, POST_VOTES_JOIN).filter(Post.user_id == user_id).scalar_subquery(),0).label('total_downvotes_received'),
                 # Is following (only if current_user_id provided and different)
                 func.cast(is_following, Boolean).label('is_following') ,
                 func.cast(is_followed_by, Boolean).label('is_followed_by') ,
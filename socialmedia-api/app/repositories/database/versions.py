@@ -0,0 +1,72 @@
+"""Version bumps behind the ETag / Last-Modified headers of GET /posts/{id}, GET /users/{id} and the feeds.
+
+posts.version covers a post and its vote counts; users.version covers a profile and its
+stats (followers, following, posts, votes received). Every repository write that changes
+one of those calls a touch_* function in the same transaction as the write.
+
+A vote also moves its post's net_votes and hot_score (the order of feed_type=hot), in the
+same statement as the version bump.
+"""
+from typing import Iterable
+from sqlalchemy import Float, case, cast, func, select, update
+from sqlalchemy.orm import Session
+from ...models import Post, User
+
+# Seconds of age that weigh as much as a tenfold net vote score in hot_score
+HOT_SCORE_SECONDS = 45000
+# hot_score in raw SQL (bulk imports, the seed), of the net votes and created_at expressions
+HOT_SCORE_SQL = "log(greatest(abs({net_votes}), 1)) * sign({net_votes}) + extract(epoch from {created_at})::float8 / " + str(HOT_SCORE_SECONDS)
+
+
+def hot_score(net_votes, created_at):
+    """Reddit's hot rank of a post: log10 of its net votes, signed, plus its age in HOT_SCORE_SECONDS.
+
+    Only votes change it, and a newer post gains on every older one at the same rate, so
+    the stored score of a post never needs a refresh for the ranking to stay right.
+    """
+    return (func.log(func.greatest(func.abs(net_votes), 1)) * func.sign(net_votes)
+            + cast(func.extract("epoch", created_at), Float) / HOT_SCORE_SECONDS)
+
+
+def touch_posts(db: Session, *where) -> None:
+    db.execute(
+        update(Post).where(*where).values(version=Post.version + 1, updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def touch_users(db: Session, *where) -> None:
+    db.execute(
+        update(User).where(*where).values(version=User.version + 1, updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def touch_follows(db: Session, follower_id: int, following_ids: Iterable[int], delta: int) -> None:
+    """follower_id followed (delta 1) or unfollowed (delta -1) following_ids; moves the
+    maintained follow counts of everyone involved in the same statement as the version bump"""
+    following_ids = list(following_ids)
+    db.execute(
+        update(User).where(User.id.in_(following_ids + [follower_id]))
+        .values(version=User.version + 1, updated_at=func.now(),
+                followers_count=User.followers_count + case((User.id == follower_id, 0), else_=delta),
+                following_count=User.following_count + case((User.id == follower_id, delta * len(following_ids)), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def touch_voted_post(db: Session, post_id: int, post_created_at, delta: int) -> None:
+    """A vote changes its post's counts and the author's votes received; one statement for both.
+
+    delta is the change of the post's net votes (upvotes - downvotes). Added to the row as
+    locked, so concurrent votes on a post each count once.
+    """
+    # created_at prunes the update to the post's partition
+    post = (
+        update(Post).where(Post.id == post_id, Post.created_at == post_created_at)
+        .values(version=Post.version + 1, updated_at=func.now(), net_votes=Post.net_votes + delta,
+                hot_score=hot_score(Post.net_votes + delta, Post.created_at))
+        .returning(Post.user_id)
+        .cte("touched_post")
+    )
+    touch_users(db, User.id == select(post.c.user_id).scalar_subquery())
@@ -1,8 +1,20 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
+from sqlalchemy import func, case, text, update, delete
 from ..interfaces.interfaces import IVoteRepository
 from ...models import Votes, Post
+from .base_repository import save
+from .versions import touch_voted_post
+from .post_cache import hot_posts
+from .outbox_repository import record_event, VOTE_CREATED, VOTE_UPDATED, VOTE_DELETED
+
+# Postgres channel carrying the id of every post whose votes changed, see app/live_votes.py
+VOTES_CHANNEL = "post_votes"
+
+
+def notify_vote_change(db: Session, post_id: int) -> None:
+    # Delivered on commit, once per post and transaction
+    db.execute(text("SELECT pg_notify(:channel, :post_id)"), {"channel": VOTES_CHANNEL, "post_id": str(post_id)})
 
 class VoteRepository(IVoteRepository):
     def __init__(self, db: Session):
@@ -12,31 +24,47 @@ class VoteRepository(IVoteRepository):
         vote= self.db.query(Votes).filter(Votes.post_id == post_id, Votes.user_id == user_id).first()
         return vote
     
-    def create_vote(self, post_id: int, user_id: int, direction: int) -> Votes: #create vote in vote()
-        new_vote = Votes(post_id=post_id, user_id=user_id, dir=direction)
+    def create_vote(self, post_id: int, user_id: int, direction: int, post_created_at=None) -> Votes: #create vote in vote()
+        # Votes are partitioned on their post's created_at, which routes the row to its partition;
+        # callers that already loaded the post pass it and save the lookup
+        if post_created_at is None:
+            post_created_at = self.db.query(Post.created_at).filter(Post.id == post_id).scalar()
+        new_vote = Votes(post_id=post_id, user_id=user_id, dir=direction, post_created_at=post_created_at)
         self.db.add(new_vote)
-        self.db.commit()
-        self.db.refresh(new_vote)
+        touch_voted_post(self.db, post_id, post_created_at, direction)
+        notify_vote_change(self.db, post_id)
+        record_event(self.db, VOTE_CREATED, post_id=post_id, user_id=user_id, dir=direction, post_created_at=post_created_at)
+        save(self.db)
+        hot_posts.invalidate(post_id)
         return new_vote
     
     def update_vote_direction(self, post_id: int, user_id: int, direction: int) -> Optional[Votes]: #update vote in vote()
-        vote = self.get_user_vote_for_post(post_id, user_id)
-        if vote:
-            vote.dir = direction
-            self.db.commit()
-            self.db.refresh(vote)
-            return vote
-        return None
+        # Only a vote that flips moves the post's net votes, by twice the new direction
+        vote = self.db.scalars(
+            update(Votes).where(Votes.post_id == post_id, Votes.user_id == user_id, Votes.dir != direction)
+            .values(dir=direction).returning(Votes)
+        ).first()
+        if vote is None:
+            # Already in that direction, or no vote at all
+            return self.get_user_vote_for_post(post_id, user_id)
+        touch_voted_post(self.db, post_id, vote.post_created_at, 2 * direction)
+        notify_vote_change(self.db, post_id)
+        record_event(self.db, VOTE_UPDATED, post_id=post_id, user_id=user_id, dir=direction, post_created_at=vote.post_created_at)
+        save(self.db)
+        hot_posts.invalidate(post_id)
+        return vote
     
     def delete_user_vote(self, post_id: int, user_id: int) -> bool: #delete vote in vote()
-        vote_query = self.db.query(Votes).filter(
-            Votes.post_id == post_id, 
-            Votes.user_id == user_id
-        )
-        vote = vote_query.first()
+        vote = self.db.execute(
+            delete(Votes).where(Votes.post_id == post_id, Votes.user_id == user_id)
+            .returning(Votes.dir, Votes.post_created_at)
+        ).first()
         if vote:
-            vote_query.delete(synchronize_session=False)
-            self.db.commit()
+            touch_voted_post(self.db, post_id, vote.post_created_at, -vote.dir)
+            notify_vote_change(self.db, post_id)
+            record_event(self.db, VOTE_DELETED, post_id=post_id, user_id=user_id, dir=vote.dir, post_created_at=vote.post_created_at)
+            save(self.db)
+            hot_posts.invalidate(post_id)
             return True
         return False
     
@@ -58,6 +86,21 @@ class VoteRepository(IVoteRepository):
             "score": (result.upvotes or 0) - (result.downvotes or 0)
         }
     
+    def get_vote_counts_for_posts(self, post_ids: List[int]) -> Dict[int, Tuple[int, int, int]]:
+        """(votes, upvotes, downvotes) of each post with votes, in one query"""
+        rows = (
+            self.db.query(
+                Votes.post_id,
+                func.count(Votes.post_id),
+                func.count(case((Votes.dir == 1, 1))),
+                func.count(case((Votes.dir == -1, 1)))
+            )
+            .filter(Votes.post_id.in_(post_ids))
+            .group_by(Votes.post_id)
+            .all()
+        )
+        return {post_id: (votes, upvotes, downvotes) for post_id, votes, upvotes, downvotes in rows}
+
     def get_user_votes_for_posts(self, user_id: int, post_ids: list) -> dict:
         """Get user's votes for multiple posts"""
         votes = (
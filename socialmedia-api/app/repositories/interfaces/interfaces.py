@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Tuple
-from ...models import Post, User, Votes, Followers
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from ...models import Post, User, Votes, Followers, OutboxEvent
+from ..database.post_rows import PostRow, Fieldset
 
 class IPostRepository(ABC):
     @abstractmethod
@@ -23,6 +24,68 @@ class IPostRepository(ABC):
         """Get all posts by specific user"""
         pass
 
+    @abstractmethod
+    def stream_posts_by_user_id(self, user_id: int, batch_size: int = 500) -> Iterator[Post]:
+        """Stream all posts by specific user through a server-side cursor"""
+        pass
+
+    @abstractmethod
+    def stream_posts_with_votes(self, current_user_id: int, search: str = "", batch_size: int = 500) -> Iterator[Tuple]:
+        """Stream all published posts with vote counts, newest first"""
+        pass
+
+    @abstractmethod
+    def stream_user_posts_with_votes(self, user_id: int, batch_size: int = 500) -> Iterator[Tuple]:
+        """Stream all of a user's posts with vote counts, newest first"""
+        pass
+
+    @abstractmethod
+    def get_post_rows(self, current_user_id: int, skip: int = 0, limit: int = 10, search: str = "",
+                      fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get a page of posts with vote counts as PostRows, without ORM instances"""
+        pass
+
+    @abstractmethod
+    def get_user_post_rows(self, user_id: int, skip: int = 0, limit: int = 10, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get a page of the user's posts with vote counts as PostRows"""
+        pass
+
+    @abstractmethod
+    def get_post_row_by_id(self, post_id: int, current_user_id: int) -> Optional[PostRow]:
+        """Get single post with vote counts as a PostRow"""
+        pass
+
+    @abstractmethod
+    def get_posts_with_votes_coalesced(self, current_user_id: int, skip: int = 0, limit: int = 10, search: str = "",
+                                       fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get a page of posts with vote counts, sharing the query with identical concurrent requests"""
+        pass
+
+    @abstractmethod
+    def get_hot_post_with_votes(self, post_id: int, current_user_id: int, version: int) -> Optional[PostRow]:
+        """Get a post with vote counts through the in-process hot post cache"""
+        pass
+
+    @abstractmethod
+    def get_post_version(self, post_id: int) -> Optional[Tuple]:
+        """Get a post's (version, updated_at) for conditional requests"""
+        pass
+
+    @abstractmethod
+    def get_posts_page_versions(self, skip: int = 0, limit: int = 10, search: str = "") -> List[Tuple]:
+        """Get (id, version) of the posts on a page of get_posts_with_votes"""
+        pass
+
+    @abstractmethod
+    def get_category_id(self, name: str) -> Optional[int]:
+        """Get the id of a category by name, None if there is no such category"""
+        pass
+
+    @abstractmethod
+    def ensure_category_id(self, name: str) -> int:
+        """Get the id of a category by name, creating the category if it is new"""
+        pass
+
 class IUserRepository(ABC):
     @abstractmethod
     def get_by_email(self, email: str) -> Optional[User]:
@@ -31,7 +94,37 @@ class IUserRepository(ABC):
     @abstractmethod
     def get_by_username(self, username: str) -> Optional[User]:  # NEW
         pass
+
+    @abstractmethod
+    def get_by_login(self, login: str) -> Optional[User]:
+        """Get user by email or username, in one query"""
+        pass
+
+    @abstractmethod
+    def count_users(self) -> int:
+        """Number of users"""
+        pass
+
+    @abstractmethod
+    def get_user_logins(self, batch_size: int = 10000) -> Iterator[Tuple]:
+        """Stream (email, username) of every user"""
+        pass
     
+    @abstractmethod
+    def get_existing_user_ids(self, user_ids: Iterable[int]) -> Set[int]:
+        """The given ids that belong to a user"""
+        pass
+
+    @abstractmethod
+    def get_user_ids_by_emails(self, emails: Iterable[str], batch_size: int = 1000) -> Dict[str, int]:
+        """User ids of the given emails, matched in batches"""
+        pass
+
+    @abstractmethod
+    def get_user_ids_by_usernames(self, usernames: Iterable[str], batch_size: int = 1000) -> Dict[str, int]:
+        """User ids of the given usernames, matched in batches"""
+        pass
+
     @abstractmethod
     def email_exists(self, email: str) -> bool:
         """Check if email already exists"""
@@ -43,8 +136,8 @@ class IUserRepository(ABC):
 
     
     @abstractmethod
-    def create_with_hashed_password(self, email: str, hashed_password: str, phone_number: str = None) -> User:
-        """Create a new user with hashed password"""
+    def create_with_hashed_password(self, email: str, hashed_password: str, phone_number: str = None) -> Optional[User]:
+        """Create a new user with hashed password, None if the email or username is taken"""
         pass
 
     @abstractmethod
@@ -57,6 +150,16 @@ class IUserRepository(ABC):
         """Get user with comprehensive stats using tuple approach"""
         pass
 
+    @abstractmethod
+    def get_user_version(self, user_id: int) -> Optional[Tuple]:
+        """Get a user's (version, updated_at) for conditional requests"""
+        pass
+
+    @abstractmethod
+    def get_cached_user(self, user_id: int) -> Optional[dict]:
+        """A user's id, email, username, full_name and created_at, read through the cache"""
+        pass
+
     @abstractmethod
     def update_user_email(self, user_id: int, new_email: str) -> Optional[User]:
         """Update user's email address"""
@@ -101,7 +204,7 @@ class IVoteRepository(ABC):
         pass
     
     @abstractmethod
-    def create_vote(self, post_id: int, user_id: int, direction: int) -> Votes:
+    def create_vote(self, post_id: int, user_id: int, direction: int, post_created_at=None) -> Votes:
         """Create new vote"""
         pass
     
@@ -115,6 +218,11 @@ class IVoteRepository(ABC):
         """Delete user's vote for post"""
         pass
     
+    @abstractmethod
+    def get_vote_counts_for_posts(self, post_ids: List[int]) -> Dict[int, Tuple[int, int, int]]:
+        """Get (votes, upvotes, downvotes) for several posts at once"""
+        pass
+
     @abstractmethod
     def get_post_vote_counts(self, post_id: int) -> dict:
         """Get vote counts for a post"""
@@ -129,6 +237,16 @@ class IFollowerRepository(ABC):
     def unfollow_user(self, follower_id: int, following_id: int) -> bool:
         """Remove a follow relationship"""
         pass
+
+    @abstractmethod
+    def follow_users(self, follower_id: int, following_ids: Iterable[int]) -> Set[int]:
+        """Follow many users at once, returning the ids newly followed"""
+        pass
+
+    @abstractmethod
+    def unfollow_users(self, follower_id: int, following_ids: Iterable[int]) -> Set[int]:
+        """Unfollow many users at once, returning the ids that were followed"""
+        pass
     
     @abstractmethod
     def is_following(self, follower_id: int, following_id: int) -> bool:
@@ -161,7 +279,7 @@ class IFollowerRepository(ABC):
         pass
     
     @abstractmethod
-    def get_mutual_follows(self, user_id: int) -> List[User]:
+    def get_mutual_follows(self, user_id: int, skip: int = 0, limit: int = 100) -> List[User]:
         """Get users who follow each other mutually"""
         pass
     
@@ -176,11 +294,86 @@ class IFeedRepository(ABC):
         """Get posts from users that the current user follows"""
         pass
     
+    @abstractmethod
+    def stream_following_feed(self, user_id: int, batch_size: int = 500) -> Iterator[Tuple]:
+        """Stream the whole following feed, newest first"""
+        pass
+
+    @abstractmethod
+    def get_following_feed_rows(self, user_id: int, skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get the following feed as PostRows, without ORM instances"""
+        pass
+
+    @abstractmethod
+    def get_following_feed_from_rings(self, user_id: int, skip: int = 0, limit: int = 20,
+                                      fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get the following feed merged from the in-memory author rings, falling back to SQL"""
+        pass
+
+    @abstractmethod
+    def get_following_page_versions_from_rings(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """Get (id, version) of the posts get_following_feed_from_rings returns"""
+        pass
+
+    @abstractmethod
+    def get_trending_feed_rows(self, user_id: int, timeframe: str = "24h", skip: int = 0, limit: int = 20,
+                               fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get trending posts as PostRows, without ORM instances"""
+        pass
+
+    @abstractmethod
+    def get_recommended_feed_rows(self, user_id: int, skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get recommended posts as PostRows, without ORM instances"""
+        pass
+
+    @abstractmethod
+    def get_trending_feed_coalesced(self, user_id: int, timeframe: str = "24h", skip: int = 0, limit: int = 20,
+                                    fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get trending posts, sharing the query with identical concurrent requests"""
+        pass
+
+    @abstractmethod
+    def get_feed_versions(self, user_id: int, feed_type: str, skip: int = 0, limit: int = 20) -> Optional[List[Tuple]]:
+        """Get (id, version) of the posts on a feed page, None if the feed cannot be validated"""
+        pass
+
     @abstractmethod
     def get_trending_feed(self, user_id: int, timeframe: str = "24h", skip: int = 0, limit: int = 20) -> List[Tuple]:
         """Get trending posts based on vote velocity and engagement"""
         pass
 
+    @abstractmethod
+    def get_hot_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """Get published posts by their stored hot score"""
+        pass
+
+    @abstractmethod
+    def get_hot_feed_rows(self, user_id: int, skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get hot posts as PostRows, without ORM instances"""
+        pass
+
+    @abstractmethod
+    def get_hot_feed_coalesced(self, user_id: int, skip: int = 0, limit: int = 20,
+                               fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get hot posts, sharing the query with identical concurrent requests"""
+        pass
+
+    @abstractmethod
+    def get_hot_page_versions(self, skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """Get (id, version) of the posts on a page of get_hot_feed"""
+        pass
+
+    @abstractmethod
+    def get_category_feed_rows(self, user_id: int, category_id: int, sort: str = "latest", skip: int = 0, limit: int = 20,
+                               fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get the published posts of a category, newest or hottest first"""
+        pass
+
+    @abstractmethod
+    def get_category_page_versions(self, category_id: int, sort: str = "latest", skip: int = 0, limit: int = 20) -> List[Tuple]:
+        """Get (id, version) of the posts on a page of get_category_feed_rows"""
+        pass
+
     @abstractmethod
     def get_recommended_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[Tuple]:
         """Get recommended posts based on user behavior and preferences"""
@@ -188,6 +381,49 @@ class IFeedRepository(ABC):
     
     @abstractmethod
     def get_feed_by_type(self, user_id: int, feed_type: str, timeframe: str = "24h", 
-                        skip: int = 0, limit: int = 20, search: str = "") -> List[Tuple]:
-        """Get feed based on specified type"""
-        pass
\ No newline at end of file
+                        skip: int = 0, limit: int = 20, fields: Optional[Fieldset] = None) -> List[PostRow]:
+        """Get feed based on specified type, with only the given fields if any"""
+        pass
+
+class IBulkRepository(ABC):
+    @abstractmethod
+    def import_rows(self, kind: str, lines: Iterable[str], fmt: str = "ndjson", batch_size: int = 5000) -> dict:
+        """Validate and COPY posts, votes or follows in batches, returning counts and errors"""
+        pass
+
+    @abstractmethod
+    def export_rows(self, kind: str, out: IO, fmt: str = "csv") -> None:
+        """Stream a whole table to out with COPY TO STDOUT"""
+        pass
+
+
+class IOutboxRepository(ABC):
+    @abstractmethod
+    def head(self) -> Tuple[int, int]:
+        """Position after the last deliverable event"""
+        pass
+
+    @abstractmethod
+    def read_events(self, after: Tuple[int, int], limit: int) -> List[OutboxEvent]:
+        """Events after a (txid, id) position, in order, from ended transactions only"""
+        pass
+
+    @abstractmethod
+    def claim_checkpoint(self, consumer: str) -> Optional[Tuple[int, int]]:
+        """Lock and return a shared consumer's checkpoint, None if another worker holds it"""
+        pass
+
+    @abstractmethod
+    def save_checkpoint(self, consumer: str, position: Tuple[int, int]) -> None:
+        """Move a claimed checkpoint and commit"""
+        pass
+
+    @abstractmethod
+    def get_checkpoints(self) -> List[Tuple]:
+        """Checkpoint and lag of every shared consumer"""
+        pass
+
+    @abstractmethod
+    def prune(self, keep_days: int) -> int:
+        """Delete old events every shared consumer has handled"""
+        pass
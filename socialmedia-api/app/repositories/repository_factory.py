@@ -4,6 +4,8 @@ from .database.user_repository import UserRepository
 from .database.vote_repository import VoteRepository
 from .database.follower_repository import FollowerRepository
 from .database.feed_repository import FeedRepository
+from .database.bulk_repository import BulkRepository
+from .database.outbox_repository import OutboxRepository
 
 class RepositoryFactory:
     @staticmethod
@@ -26,3 +28,11 @@ class RepositoryFactory:
     def create_feed_repository(db: Session) -> FeedRepository:
         post_repo = PostRepository(db)
         return FeedRepository(db, post_repo)
+
+    @staticmethod
+    def create_bulk_repository(db: Session) -> BulkRepository:
+        return BulkRepository(db)
+
+    @staticmethod
+    def create_outbox_repository(db: Session) -> OutboxRepository:
+        return OutboxRepository(db)
@@ -0,0 +1,53 @@
+"""JSON or MessagePack responses encoded straight from repository rows.
+
+A route that returns its data lets FastAPI validate it against the response_model and then
+serialize it, a second pass over every field of every post. The rows of the read fast path
+(repositories/database/post_rows.py) are already in the response shape, so they are encoded
+once with pydantic_core, which writes the same JSON FastAPI would: compact separators, UTF-8,
+datetimes in ISO 8601. The route keeps its response_model for the OpenAPI schema.
+
+Clients that prefer application/msgpack in their Accept header (the mobile apps) get the
+same objects as MessagePack, datetimes as its timestamp extension type. Everything else,
+errors included, stays JSON.
+"""
+from typing import Iterable, Optional, Union
+import msgpack
+from fastapi import Request, Response
+from pydantic_core import to_json
+from .negotiation import negotiate
+from .repositories.database.post_rows import Fieldset
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# JSON first: it answers */* and requests without Accept
+MEDIA_TYPES = (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE)
+# responses= of the routes answering with rows_response, for the OpenAPI schema
+MSGPACK_RESPONSES = {200: {"content": {MSGPACK_MEDIA_TYPE: {}}}}
+
+
+def media_type(request: Request) -> str:
+    """The media type to encode rows as for request, JSON unless its Accept prefers MessagePack"""
+    return negotiate(request.headers.get("accept"), MEDIA_TYPES) or JSON_MEDIA_TYPE
+
+
+def representation(media_type: str, fields: Optional[Fieldset] = None) -> tuple:
+    """ETag parts of a response other than the full JSON one, which has none"""
+    return (() if fields is None else (fields.key,)) + (() if media_type == JSON_MEDIA_TYPE else (media_type,))
+
+
+def rows_response(rows: Union[Iterable, object], response: Response, fields: Optional[Fieldset] = None,
+                  media_type: str = JSON_MEDIA_TYPE) -> Response:
+    """rows (objects with as_dict(), or one of them) as a JSON or MessagePack response, with only fields if given.
+
+    response is the one FastAPI injects into the route; the headers set on it (validators,
+    cookies) are carried over, FastAPI drops them when a route returns its own response.
+    """
+    content = rows.as_dict(fields) if hasattr(rows, "as_dict") else [row.as_dict(fields) for row in rows]
+    if media_type == MSGPACK_MEDIA_TYPE:
+        body = msgpack.packb(content, datetime=True)
+    else:
+        body = to_json(content)
+    encoded = Response(body, media_type=media_type)
+    encoded.raw_headers.extend(response.raw_headers)
+    encoded.headers.add_vary_header("Accept")
+    return encoded
@@ -0,0 +1,128 @@
+import io
+import queue
+import threading
+from fastapi import HTTPException, status, Depends, APIRouter, UploadFile, File, Query
+from .. import schemas, oauth2
+from ..cache import cache
+from ..database import SessionLocal, compiled_cache_stats
+from ..repositories.repository_factory import RepositoryFactory
+from ..repositories.database.bulk_repository import BulkRepository, BULK_TABLES
+from ..repositories.database.post_cache import hot_posts
+from ..repositories.database.author_rings import author_rings
+from ..repositories.database.user_filters import user_filters
+from ..repositories.database.category_cache import category_ids, category_pages
+from ..repositories.database import single_flight
+from ..dependencies import get_bulk_repository
+from ..streaming import LimitedStreamingResponse, stream_limit
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"]
+)
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# COPY writes one row at a time; rows are grouped into chunks of about this size
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Chunks buffered between the COPY and a slow client before the COPY waits
+EXPORT_QUEUE_CHUNKS = 16
+
+
+def check_kind(kind: str, format: str):
+    if kind not in BULK_TABLES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown kind {kind}, expected one of {', '.join(BULK_TABLES)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown format {format}, expected one of {', '.join(FORMATS)}")
+
+
+@router.post("/bulk/{kind}", response_model=schemas.BulkImportResult)
+def bulk_import(kind: str, file: UploadFile = File(...), format: str = Query("ndjson"), bulk_repo: BulkRepository = Depends(get_bulk_repository), current_admin: int = Depends(oauth2.get_current_admin)):
+    check_kind(kind, format)
+    # The upload is spooled to disk by Starlette and read line by line, never as a whole
+    lines = io.TextIOWrapper(file.file, encoding="utf-8", newline="" if format == "csv" else None)
+    try:
+        return bulk_repo.import_rows(kind, lines, format)
+    except UnicodeDecodeError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"File is not UTF-8: {exc}")
+    finally:
+        lines.detach()
+
+
+class QueueWriter:
+    """File-like target for COPY TO STDOUT that hands every chunk to the response."""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data.encode() if isinstance(data, str) else data
+        if len(self.buffer) >= EXPORT_CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        while True:
+            if self.cancelled.is_set():
+                raise IOError("export cancelled by the client")  # aborts the COPY
+            try:
+                self.chunks.put(bytes(self.buffer), timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.buffer.clear()
+
+
+def stream_export(kind: str, format: str):
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    done = object()
+
+    def produce():
+        # The request's session is closed once the endpoint returns, before the body is sent
+        db = SessionLocal()
+        writer = QueueWriter(chunks, cancelled)
+        try:
+            RepositoryFactory.create_bulk_repository(db).export_rows(kind, writer, format)
+            writer.flush()
+        except Exception as exc:
+            if not cancelled.is_set():
+                chunks.put(exc)
+        finally:
+            db.close()
+            if not cancelled.is_set():
+                chunks.put(done)
+
+    threading.Thread(target=produce, name=f"export-{kind}", daemon=True).start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
+
+
+@router.get("/export/{kind}")
+def bulk_export(kind: str, format: str = Query("csv"), current_admin: int = Depends(oauth2.get_current_admin)):
+    check_kind(kind, format)
+    return LimitedStreamingResponse(
+        stream_export(kind, format), stream_limit.enter(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'},
+    )
+
+
+@router.get("/metrics")
+def read_metrics(current_admin: int = Depends(oauth2.get_current_admin)):
+    """In-process counters of this worker: hot post cache, author rings, user filters, category caches, cache namespaces, database streams, coalesced queries and compiled statements"""
+    return {"hot_posts": hot_posts.stats(), "author_rings": author_rings.stats(), "user_filters": user_filters.stats(),
+            "category_ids": category_ids.stats(), "category_pages": category_pages.stats(), "cache": cache.stats(),
+            "streams": stream_limit.stats(),
+            "single_flight": single_flight.stats(),
+            "compiled_cache": compiled_cache_stats()}
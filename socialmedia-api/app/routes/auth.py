@@ -11,9 +11,8 @@ router= APIRouter(tags=['Authentication'])
 def login(user_credentials: OAuth2PasswordRequestForm=Depends(), user_repo: UserRepository = Depends(get_user_repository)):
 
     #the OAuthPasswordReuestForm returns username and password and not email and password
-    user=user_repo.get_by_email(user_credentials.username)
-    if not user:
-        user = user_repo.get_by_username(user_credentials.username)
+    # The username field takes an email or a username, matched in one query
+    user=user_repo.get_by_login(user_credentials.username)
     # user=db.query(models.User).filter(models.User.email==user_credentials.username).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Invalid Credentials")
@@ -28,6 +27,8 @@ def login(user_credentials: OAuth2PasswordRequestForm=Depends(), user_repo: User
 @router.post("/register", status_code=status.HTTP_201_CREATED, response_model=schemas.UserResponse)
 def create_user(user: schemas.CreateUser,user_repo: UserRepository = Depends(get_user_repository)):
     #hash a password - user.password
+    # Checked before hashing so a taken name costs no bcrypt; a new name costs no query (the user
+    # filters rule it out). The unique constraints still decide, see create_with_hashed_password
     if user_repo.email_exists(user.email):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -47,6 +48,12 @@ def create_user(user: schemas.CreateUser,user_repo: UserRepository = Depends(get
         hashed_password=hash_password,
         phone_number=user.phone_number
     )
+    if new_user is None:
+        # Taken by a registration that raced this one
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="User with this email or username already exists"
+        )
     # new_user=models.User(**user.dict()) #unpacking the post dict to match the Post model
     # db.add(new_user)
     # db.commit()
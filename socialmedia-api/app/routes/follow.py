@@ -44,6 +44,46 @@ def follow_user(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
+
+@router.post("/bulk", response_model=schemas.BulkFollowResponse)
+def bulk_follow(
+    bulk_request: schemas.BulkFollowRequest,
+    follower_repo: FollowerRepository = Depends(get_follower_repository),
+    user_repo: UserRepository = Depends(get_user_repository),
+    current_user: int = Depends(oauth2.get_current_user)
+):
+    """Follow or unfollow many users in one transaction, by id or by imported emails / usernames"""
+    # (target as given, user id or None) in request order; each kind of target is resolved with batched IN queries
+    existing = user_repo.get_existing_user_ids(bulk_request.following_ids)
+    by_email = user_repo.get_user_ids_by_emails(bulk_request.emails)
+    by_username = user_repo.get_user_ids_by_usernames(bulk_request.usernames)
+    targets = (
+        [(str(user_id), user_id if user_id in existing else None) for user_id in bulk_request.following_ids]
+        + [(email, by_email.get(email)) for email in bulk_request.emails]
+        + [(username, by_username.get(username)) for username in bulk_request.usernames]
+    )
+    user_ids = {user_id for _, user_id in targets if user_id is not None}
+    if bulk_request.action == schemas.BulkFollowAction.FOLLOW:
+        changed = follower_repo.follow_users(current_user.id, user_ids)
+        done, unchanged = "followed", "already_following"
+    else:
+        changed = follower_repo.unfollow_users(current_user.id, user_ids)
+        done, unchanged = "unfollowed", "not_following"
+
+    results = []
+    for target, user_id in targets:
+        if user_id is None:
+            outcome = "not_found"
+        elif user_id == current_user.id:
+            outcome = "self"
+        else:
+            outcome = done if user_id in changed else unchanged
+        results.append({"target": target, "user_id": user_id, "status": outcome})
+    return {
+        "results": results,
+        "changed": len(changed),
+        "user_stats": follower_repo.get_user_stats(current_user.id)
+    }
     
 @router.delete("/{user_id}", response_model=schemas.FollowActionResponse)
 def unfollow_user(
@@ -58,11 +98,7 @@ def unfollow_user(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User with id {user_id} not found"
         )
-    if not follower_repo.is_following(current_user.id, user_id):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="You are not following this user"
-        )
+    # The delete itself tells whether there was a follow to remove
     success = follower_repo.unfollow_user(current_user.id, user_id)
 
     if success:
@@ -75,8 +111,8 @@ def unfollow_user(
         }
     else:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to unfollow user"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="You are not following this user"
         )
 
 @router.get("/followers", response_model=schemas.FollowersList)
@@ -105,10 +141,12 @@ def get_my_following(
 
 @router.get("/mutual", response_model=List[schemas.UserResponse])
 def get_mutual_follows(
+    skip: int = 0,
+    limit: int = 20,
     follower_repo: FollowerRepository = Depends(get_follower_repository),
     current_user: int = Depends(oauth2.get_current_user)
 ):
-    mutual_users = follower_repo.get_mutual_follows(current_user.id)
+    mutual_users = follower_repo.get_mutual_follows(current_user.id, skip, limit)
     return mutual_users
 
 #Get follow status between current user and target user
@@ -1,36 +1,67 @@
 from .. import models, schemas, oauth2
-from fastapi import FastAPI, HTTPException, Response, status, Depends, APIRouter
+from fastapi import FastAPI, HTTPException, Request, Response, status, Depends, APIRouter, Query
 from sqlalchemy.orm import Session 
 from ..database import get_db
 from sqlalchemy import func, case
-from typing import List, Optional
+from typing import List, Optional, Union
 from ..repositories.database.post_repository import PostRepository
 from ..repositories.database.feed_repository import FeedRepository
+from ..repositories.repository_factory import RepositoryFactory
 from ..dependencies import get_post_repository, get_feed_repository
+from ..streaming import stream_ndjson
+from ..conditional import make_etag, not_modified, not_modified_response, set_validators
+from ..responses import MSGPACK_RESPONSES, media_type, representation, rows_response
+from ..repositories.database.post_rows import Fieldset, fieldset
+from ..live_votes import live_votes, event_stream, EVENT_STREAM_MEDIA_TYPE
+from ..config import settings
+from fastapi.responses import StreamingResponse
 
 router = APIRouter(
     prefix="/posts",
     tags=["Posts"]
 )
 
-@router.get("/", response_model=List[schemas.PostwithVote])
-def get_all_posts(post_repo: PostRepository = Depends(get_post_repository),feed_repo: FeedRepository = Depends(get_feed_repository),get_current_user:int = Depends(oauth2.get_current_user), limit: int = 10, skip: int=0, search: Optional[str]= "", feed_type: str = "recommended"):
+# List endpoints answer with PostwithVote, or with PostCardwithVote for view=compact or fields=
+POST_LIST_MODEL = Union[List[schemas.PostwithVote], List[schemas.PostCardwithVote]]
+
+
+def get_fields(view: schemas.PostView = schemas.PostView.FULL,
+               fields: Optional[str] = Query(None, description="Comma separated fields of each post, overrides view")) -> Optional[Fieldset]:
+    try:
+        return fieldset(view.value, fields)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+
+@router.get("/", response_model=POST_LIST_MODEL, responses=MSGPACK_RESPONSES)
+def get_all_posts(request: Request, response: Response, post_repo: PostRepository = Depends(get_post_repository),feed_repo: FeedRepository = Depends(get_feed_repository),get_current_user:int = Depends(oauth2.get_current_user), limit: int = 10, skip: int=0, search: Optional[str]= "", feed_type: str = "recommended", fields: Optional[Fieldset] = Depends(get_fields)):
+    encoding = media_type(request)
+    # The page's (id, version) pairs change with any edit, vote, new or deleted post on it
     if search:
-        posts= post_repo.get_posts_with_votes(get_current_user.id,skip, limit, search)
+        versions = post_repo.get_posts_page_versions(skip, limit, search)
     else:
-        posts = feed_repo.get_feed_by_type(get_current_user.id, feed_type, skip=skip, limit=limit)
+        versions = feed_repo.get_feed_versions(get_current_user.id, feed_type, skip, limit)
+    if versions is not None:
+        etag = make_etag("posts", get_current_user.id, feed_type, search, skip, limit, *representation(encoding, fields), *(f"{id}:{version}" for id, version in versions))
+        if not_modified(request, etag):
+            return not_modified_response(etag)
+        set_validators(response, etag)
+    if search:
+        posts= post_repo.get_posts_with_votes_coalesced(get_current_user.id,skip, limit, search, fields)
+    else:
+        posts = feed_repo.get_feed_by_type(get_current_user.id, feed_type, skip=skip, limit=limit, fields=fields)
     # print("route")
     # print(posts)
-    return posts
+    return rows_response(posts, response, fields, encoding)
     # posts=db.query(models.Post).filter(models.Post.title.contains(search)).limit(limit).offset(skip).all()
     # posts = db.query(models.Post, func.count(models.Votes.post_id).label("Votes"),func.count(case((models.Votes.dir == 1, 1))).label("Upvotes"),
     #     func.count(case((models.Votes.dir == -1, 1))).label("Downvotes")).join(models.Votes, models.Votes.post_id == models.Post.id, isouter=True).group_by(models.Post.id).filter(models.Post.title.contains(search)).limit(limit).offset(skip).all()
     # cursor.execute("""SELECT * FROM posts""")
     # posts=cursor.fetchall()
-@router.get("/profileposts", response_model=List[schemas.PostwithVote])
-def get_own_posts(post_repo: PostRepository = Depends(get_post_repository),get_current_user:int = Depends(oauth2.get_current_user), limit: int = 10, skip: int=0, search: Optional[str]= ""):
-    posts= post_repo.get_user_posts_with_votes(get_current_user.id,skip,limit)
-    return posts
+@router.get("/profileposts", response_model=POST_LIST_MODEL, responses=MSGPACK_RESPONSES)
+def get_own_posts(request: Request, response: Response, post_repo: PostRepository = Depends(get_post_repository),get_current_user:int = Depends(oauth2.get_current_user), limit: int = 10, skip: int=0, search: Optional[str]= "", fields: Optional[Fieldset] = Depends(get_fields)):
+    posts= post_repo.get_user_post_rows(get_current_user.id,skip,limit,fields)
+    return rows_response(posts, response, fields, media_type(request))
     # posts=db.query(models.Post,  func.count(models.Votes.post_id).label("Votes"),func.count(case((models.Votes.dir == 1, 1))).label("Upvotes"),
     #     func.count(case((models.Votes.dir == -1, 1))).label("Downvotes")).join(models.Votes, models.Votes.post_id == models.Post.id, isouter=True).group_by(models.Post.id).filter(models.Post.user_id== get_current_user.id).limit(limit).offset(skip).all()
     # print(limit)
@@ -38,21 +69,75 @@ def get_own_posts(post_repo: PostRepository = Depends(get_post_repository),get_c
     # cursor.execute("""SELECT * FROM posts""")
     # posts=cursor.fetchall()
 
-@router.get("/{id}", response_model=schemas.PostwithVote)
-def get_post(id:int, post_repo: PostRepository = Depends(get_post_repository), get_current_user:int = Depends(oauth2.get_current_user)):
+@router.get("/category/{name}", response_model=POST_LIST_MODEL, responses=MSGPACK_RESPONSES)
+def get_category_posts(name: str, request: Request, response: Response, post_repo: PostRepository = Depends(get_post_repository), feed_repo: FeedRepository = Depends(get_feed_repository), get_current_user:int = Depends(oauth2.get_current_user), limit: int = 10, skip: int = 0, sort: schemas.CategorySort = schemas.CategorySort.LATEST, fields: Optional[Fieldset] = Depends(get_fields)):
+    """Published posts of one category, newest first or by hot score"""
+    category_id = post_repo.get_category_id(name)
+    if category_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"category {name} not found")
+    encoding = media_type(request)
+    versions = feed_repo.get_category_page_versions(category_id, sort.value, skip, limit)
+    etag = make_etag("category", category_id, sort.value, get_current_user.id, skip, limit, *representation(encoding, fields), *(f"{id}:{version}" for id, version in versions))
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    set_validators(response, etag)
+    posts = feed_repo.get_category_feed_rows(get_current_user.id, category_id, sort.value, skip, limit, fields)
+    return rows_response(posts, response, fields, encoding)
+
+# Declared before /{id} so "stream" is not read as a post id
+@router.get("/stream")
+def stream_all_posts(user_id: int = Depends(oauth2.get_current_user_id), search: Optional[str]= "", feed_type: str = "chronological"):
+    """Every post of a feed as NDJSON (one PostwithVote per line) instead of one page"""
+    if feed_type == "following":
+        produce = lambda db: RepositoryFactory.create_feed_repository(db).stream_following_feed(user_id)
+    elif feed_type == "chronological":
+        produce = lambda db: RepositoryFactory.create_post_repository(db).stream_posts_with_votes(user_id, search)
+    else:
+        # trending and recommended are ranked over a time window, page through them instead
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"feed_type {feed_type} cannot be streamed, use following or chronological")
+    return stream_ndjson(produce, schemas.PostwithVote)
+
+@router.get("/profileposts/stream")
+def stream_own_posts(user_id: int = Depends(oauth2.get_current_user_id)):
+    return stream_ndjson(lambda db: RepositoryFactory.create_post_repository(db).stream_user_posts_with_votes(user_id), schemas.PostwithVote)
+
+@router.get("/live")
+def watch_votes(ids: str = Query(..., description="Comma separated post ids"), current_user_id: int = Depends(oauth2.get_current_user_id)):
+    """Vote counts of the given posts as Server-Sent Events, pushed when they change"""
+    try:
+        post_ids = {int(post_id) for post_id in ids.split(",") if post_id.strip()}
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma separated post ids")
+    if not post_ids or len(post_ids) > settings.live_votes_max_posts:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Watch between 1 and {settings.live_votes_max_posts} posts")
+    return StreamingResponse(
+        event_stream(live_votes, post_ids),
+        media_type=EVENT_STREAM_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/{id}", response_model=schemas.PostwithVote, responses=MSGPACK_RESPONSES)
+def get_post(id:int, request: Request, response: Response, post_repo: PostRepository = Depends(get_post_repository), get_current_user:int = Depends(oauth2.get_current_user)):
+    current = post_repo.get_post_version(id)
+    if not current:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with id {id} not found")
+    encoding = media_type(request)
+    # has_liked depends on the viewer
+    etag = make_etag("post", id, current.version, get_current_user.id, *representation(encoding))
+    if not_modified(request, etag, current.updated_at):
+        return not_modified_response(etag, current.updated_at)
+    set_validators(response, etag, current.updated_at)
     try:
-        print(f"PostId:{id}")
-        post = post_repo.get_post_with_votes_by_id(id,get_current_user.id)
+        post = post_repo.get_hot_post_with_votes(id, get_current_user.id, current.version)
         # post=db.query(models.Post,  func.count(models.Votes.post_id).label("Votes"),func.count(case((models.Votes.dir == 1, 1))).label("Upvotes"),
         # func.count(case((models.Votes.dir == -1, 1))).label("Downvotes")).outerjoin(models.Votes, models.Votes.post_id == models.Post.id).filter(models.Post.id==id).group_by(models.Post.id).first()
     except:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with id {id} not found")
-    print(post)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with id {id} not found")
     # if post.user_id!=get_current_user.id:
     #     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
-    return post
+    return rows_response(post, response, media_type=encoding)
     # cursor.execute("""SELECT * FROM posts WHERE id = %s""", (id,))
     # post = cursor.fetchone()
     # print(post)
@@ -76,13 +161,11 @@ def create_posts(post: schemas.CreatePost,post_repo: PostRepository = Depends(ge
 
 @router.delete("/{id}")
 def delete_post(id:int, post_repo: PostRepository = Depends(get_post_repository),  get_current_user:int = Depends(oauth2.get_current_user)):
-    post= post_repo.get_post_with_votes_by_id(id)
-    if post == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with id {id} not found")
+    # One DELETE that also checks ownership; nothing deleted means missing or not the author's
     success = post_repo.delete_user_post(id, get_current_user.id)
     # post_query=db.query(models.Post).filter(models.Post.id == id)
     # post = post_query.first()
-    if success == None:
+    if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} not found or not authorized")
     # if post.user_id != get_current_user.id:
     #     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform this action")
@@ -96,10 +179,9 @@ def delete_post(id:int, post_repo: PostRepository = Depends(get_post_repository)
 
 @router.put("/{id}", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.PostResponse)
 def update_post(id: int, updated_post: schemas.UpdatePost, post_repo: PostRepository = Depends(get_post_repository), get_current_user:int = Depends(oauth2.get_current_user)):
-    post= post_repo.get_post_with_votes_by_id(id)
-    if post == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with id {id} not found")
     post=post_repo.update_user_post(id,get_current_user.id,**updated_post.dict())
+    if post is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} not found or not authorized")
     # post_query=db.query(models.Post).filter(models.Post.id == id)
     # post= post_query.first()
     # if post.user_id != get_current_user.id:
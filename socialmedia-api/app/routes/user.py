@@ -1,11 +1,12 @@
 from typing import List
 from .. import models, schemas, utils
-from fastapi import FastAPI, HTTPException, Response, status, Depends, APIRouter
+from fastapi import FastAPI, HTTPException, Request, Response, status, Depends, APIRouter
 from sqlalchemy .orm import Session 
 from ..database import get_db
 from .. import models, schemas, oauth2
 from ..repositories.database.user_repository import UserRepository
 from ..dependencies import get_user_repository
+from ..conditional import make_etag, not_modified, not_modified_response, set_validators
 
 router = APIRouter(
     prefix="/users",
@@ -93,10 +94,18 @@ def search_users(
 
 @router.get("/", response_model=schemas.UserStats)
 def get_current_user_profile(
+    request: Request,
+    response: Response,
     user_repo: UserRepository = Depends(get_user_repository), 
     current_user: int = Depends(oauth2.get_current_user)
 ):
     """Get comprehensive profile for the current authenticated user"""
+    current = user_repo.get_user_version(current_user.id)
+    if current:
+        etag = make_etag("user", current_user.id, current.version)
+        if not_modified(request, etag, current.updated_at):
+            return not_modified_response(etag, current.updated_at)
+        set_validators(response, etag, current.updated_at)
     profile = user_repo.get_user_with_stats(current_user.id)
     if not profile:
         raise HTTPException(
@@ -108,10 +117,23 @@ def get_current_user_profile(
 @router.get("/{id}", response_model=schemas.UserWithStats)
 def get_user(
     id: int,
+    request: Request,
+    response: Response,
     user_repo: UserRepository = Depends(get_user_repository), 
     current_user: int = Depends(oauth2.get_current_user)
 ):
     """Get profile for any user (with relationship status if viewing another user)"""
+    current = user_repo.get_user_version(id)
+    if not current:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"User with id {id} not found"
+        )
+    # Following one another bumps both users, so the viewer's relationship flags are covered
+    etag = make_etag("user", id, current.version, current_user.id)
+    if not_modified(request, etag, current.updated_at):
+        return not_modified_response(etag, current.updated_at)
+    set_validators(response, etag, current.updated_at)
     user_with_stats = user_repo.get_user_with_stats(id, current_user.id)
     if not user_with_stats:
         raise HTTPException(
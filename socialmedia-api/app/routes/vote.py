@@ -30,14 +30,14 @@ def vote(vote: schemas.Vote, vote_repo: VoteRepository = Depends(get_vote_reposi
             # db.commit()
             return {"message": "Successfully updated your vote"}
         else:
-            vote_repo.create_vote(vote.post_id, get_current_user.id, vote.dir)
+            vote_repo.create_vote(vote.post_id, get_current_user.id, vote.dir, post.created_at)
         # new_vote = models.Votes(post_id=vote.post_id, user_id=get_current_user.id, dir=vote.dir)
         # db.add(new_vote)
         # db.commit()
         return {"message": "Successfully added your vote"}
     elif vote.dir ==0 :
         if not existing_vote:
-            raise HTTPException(statuscode=status.HTTP_404_NOT_FOUND)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {get_current_user.id} has not voted on post with {vote.post_id}")
         vote_repo.delete_user_vote(vote.post_id, get_current_user.id)
         # vote_query.delete(synchronize_session=False)
         # db.commit()
@@ -7,7 +7,7 @@ from datetime import datetime
 class PostBase(BaseModel):
     title: str
     content: str
-    category: str
+    category: str = Field(max_length=50)  # posts.category and categories.name
     published: bool = True
     rating: Optional[int] = None
     
@@ -49,6 +49,35 @@ class PostwithVote(BaseModel):
     class Config:
         orm_mode = True
 
+class PostView(str, Enum):
+    FULL = "full"
+    COMPACT = "compact"
+
+class OwnerCard(BaseModel):
+    id: int
+    username: Optional[str] = None
+    full_name: Optional[str] = None
+
+class PostCard(BaseModel):
+    """The fields of a post asked for with fields= or view=compact; preview is content cut short"""
+    id: int
+    title: Optional[str] = None
+    content: Optional[str] = None
+    preview: Optional[str] = None
+    category: Optional[str] = None
+    published: Optional[bool] = None
+    rating: Optional[int] = None
+    created_at: Optional[datetime] = None
+    user_id: Optional[int] = None
+    owner: Optional[OwnerCard] = None
+
+class PostCardwithVote(BaseModel):
+    Post: PostCard
+    Votes: Optional[int] = None
+    Upvotes: Optional[int] = None
+    Downvotes: Optional[int] = None
+    has_liked: Optional[bool] = None
+
 class UserBase(BaseModel):
     email: EmailStr
     password: str
@@ -113,6 +142,46 @@ class Vote(BaseModel):
 class FollowRequest(BaseModel):
     following_id: int
 
+class BulkPost(CreatePost):
+    """One row of a bulk post import; id and created_at are kept when reloading an export"""
+    id: Optional[int] = None
+    user_id: int
+    rating: int
+    created_at: Optional[datetime] = None
+
+    @validator('created_at')
+    def validate_created_at(cls, v):
+        if v is not None:
+            if v.tzinfo is None:
+                raise ValueError('created_at must include a timezone')
+            if v > datetime.now(v.tzinfo):
+                raise ValueError('created_at cannot be in the future')
+        return v
+
+class BulkVote(Vote):
+    user_id: int
+
+    @validator('dir')
+    def validate_dir(cls, v):
+        if v not in (1, -1):
+            raise ValueError('dir must be 1 or -1')
+        return v
+
+class BulkFollow(FollowRequest):
+    follower_id: int
+
+class BulkImportError(BaseModel):
+    line: Optional[int] = None
+    error: str
+
+class BulkImportResult(BaseModel):
+    received: int
+    inserted: int
+    skipped: int  # valid rows that already exist or point at missing users/posts
+    invalid: int
+    batches: int
+    errors: List[BulkImportError]
+
 class FollowerResponse(BaseModel):
     id: int
     email: EmailStr
@@ -146,6 +215,8 @@ class FollowStatus(BaseModel):
 class FollowersList(BaseModel):
     followers: List[UserResponse]
     total: int
+    # total is the maintained counter rather than an exact count
+    approximate: bool = False
     skip: int
     limit: int
     has_more: bool
@@ -153,6 +224,8 @@ class FollowersList(BaseModel):
 class FollowingList(BaseModel):
     following: List[UserResponse]
     total: int
+    # total is the maintained counter rather than an exact count
+    approximate: bool = False
     skip: int
     limit: int
     has_more: bool
@@ -189,13 +262,41 @@ class FollowActionResponse(BaseModel):
     message: str
     user_stats: Optional[UserWithFollowStats] = None
 
+class BulkFollowAction(str, Enum):
+    FOLLOW = "follow"
+    UNFOLLOW = "unfollow"
+
+class BulkFollowRequest(BaseModel):
+    """Targets by id, or by email / username for a contact import; any mix of the three"""
+    action: BulkFollowAction = BulkFollowAction.FOLLOW
+    following_ids: List[int] = Field(default=[], max_length=500)
+    emails: List[str] = Field(default=[], max_length=5000)
+    usernames: List[str] = Field(default=[], max_length=5000)
+
+class BulkFollowResult(BaseModel):
+    target: str  # as given in the request
+    user_id: Optional[int] = None
+    # followed, already_following, unfollowed, not_following, not_found or self
+    status: str
+
+class BulkFollowResponse(BaseModel):
+    results: List[BulkFollowResult]
+    changed: int
+    user_stats: Optional[UserWithFollowStats] = None
+
 
 class FeedType(str, Enum):
     CHRONOLOGICAL = "chronological"
     FOLLOWING = "following"
     TRENDING = "trending"
+    HOT = "hot"
     RECOMMENDED = "recommended"
 
+class CategorySort(str, Enum):
+    """Order of GET /posts/category/{name}"""
+    LATEST = "latest"
+    HOT = "hot"
+
 class FeedRequest(BaseModel):
     feed_type: FeedType = FeedType.FOLLOWING
     limit: int = Field(default=20, le=100)
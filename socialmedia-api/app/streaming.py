@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Type
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from .config import settings
+from .database import SessionLocal
+from .repositories.database.post_repository import STREAM_BATCH_SIZE
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class StreamLimit:
+    """Bounds the streamed responses that read the database (NDJSON feeds, exports) of a worker.
+
+    Each holds a pool connection for its whole download, after it left the admission limit
+    (app/admission.py). Kept below db_max_overflow, they leave overflow connections to the
+    outbox dispatcher, live vote reads and background tasks; a stream past the limit is a 503.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def enter(self) -> "StreamSlot":
+        """A place for one stream, or HTTPException 503 when all are taken"""
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many streams in progress, retry later", headers={"Retry-After": "1"})
+            self.active += 1
+        return StreamSlot(self)
+
+    def _leave(self) -> None:
+        with self._lock:
+            self.active -= 1
+
+    def stats(self) -> dict:
+        return {"active": self.active, "limit": self.limit, "rejected": self.rejected}
+
+
+class StreamSlot:
+    """Given back once: when its stream ends, or when a response that never started is dropped"""
+
+    def __init__(self, limit: StreamLimit):
+        self._limit: Optional[StreamLimit] = limit
+
+    def close(self) -> None:
+        limit, self._limit = self._limit, None
+        if limit is not None:
+            limit._leave()
+
+    __del__ = close
+
+
+class LimitedStreamingResponse(StreamingResponse):
+    """A streamed body that holds a StreamLimit place, closed and given back when the response ends.
+
+    Starlette drops a sync body that a disconnect interrupted without closing it, and leaves it
+    to the garbage collector along with the session it holds. The close is not awaited: a
+    cancelled response cannot wait, and it runs the body's own cleanup, a rollback, off the event loop.
+    """
+
+    def __init__(self, content: Iterator[bytes], slot: StreamSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.chunks = content
+        self.slot = slot
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            asyncio.get_running_loop().run_in_executor(None, close_stream, self.chunks, self.slot)
+
+
+def close_stream(chunks: Iterator[bytes], slot: StreamSlot) -> None:
+    try:
+        chunks.close()
+    finally:
+        slot.close()
+
+
+stream_limit = StreamLimit(settings.db_max_streams)
+
+
+def ndjson_chunks(rows: Iterable, schema: Type[BaseModel], batch_size: int = STREAM_BATCH_SIZE) -> Iterator[bytes]:
+    """One JSON document per row, sent batch_size lines at a time"""
+    lines = []
+    for row in rows:
+        lines.append(schema.model_validate(row, from_attributes=True).model_dump_json())
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def stream_ndjson(produce: Callable[[Session], Iterable], schema: Type[BaseModel]) -> StreamingResponse:
+    """Stream produce(db) as NDJSON.
+
+    produce gets a session of its own: the request's get_db session is closed as soon as
+    the endpoint returns, before the body is sent. Raises 503 past stream_limit.
+    """
+    slot = stream_limit.enter()
+
+    def body():
+        db = SessionLocal()
+        try:
+            yield from ndjson_chunks(produce(db), schema)
+        finally:
+            db.close()
+
+    return LimitedStreamingResponse(body(), slot, media_type=NDJSON_MEDIA_TYPE)
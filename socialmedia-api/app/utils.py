@@ -1,12 +1,17 @@
-from passlib.context import CryptContext
+from functools import lru_cache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto") #Telling passlib the hashiong algorithm which is bcrypt in our case
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    # passlib and bcrypt are loaded by the first login or signup, not by every worker start
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto") #Telling passlib the hashiong algorithm which is bcrypt in our case
 
 def hash(password: str) -> str:
     """
     Hash a password using bcrypt.
     """
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 def verify(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password) # when verifying a password, the algorithm is identified automatically:
\ No newline at end of file
+    return pwd_context().verify(plain_password, hashed_password) # when verifying a password, the algorithm is identified automatically:
\ No newline at end of file
@@ -0,0 +1,8 @@
+"""gunicorn worker class named in gunicorn.conf.py"""
+from uvicorn_worker import UvicornWorker as BaseUvicornWorker
+from .config import settings
+
+
+class UvicornWorker(BaseUvicornWorker):
+    # "auto" picks uvloop and httptools when they are installed, asyncio and h11 otherwise
+    CONFIG_KWARGS = {**BaseUvicornWorker.CONFIG_KWARGS, "loop": settings.uvicorn_loop, "http": settings.uvicorn_http}
@@ -0,0 +1,109 @@
+"""Capture the SQL a repository call emits and snapshot its EXPLAIN plans."""
+import math
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan", "Bitmap Heap Scan"}
+
+# Exponent of time vs. data size above which a query counts as super-linear
+SUPERLINEAR_EXPONENT = 1.2
+# Timings below this are dominated by round trips, so scaling is not judged on them
+NOISE_FLOOR_MS = 1.0
+
+
+class StatementRecorder:
+    """Records every statement sent to the database while active."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.active = False
+        self.statements: List[tuple] = []
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active and statement.lstrip().upper().startswith(EXPLAINABLE):
+            self.statements.append((statement, parameters))
+
+    @contextmanager
+    def recording(self):
+        self.statements = []
+        self.active = True
+        try:
+            yield self.statements
+        finally:
+            self.active = False
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def explain(conn: Connection, statement: str, parameters) -> dict:
+    """EXPLAIN (not ANALYZE) a captured statement, so writes are never executed."""
+    savepoint = conn.begin_nested()
+    try:
+        row = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    except DBAPIError as exc:
+        # e.g. reads from a temp table the call created, which went away with its rollback
+        savepoint.rollback()
+        return {"Node Type": "Not explainable", "Error": str(exc.orig).splitlines()[0]}
+    savepoint.commit()
+    return row[0]["Plan"]
+
+
+def walk(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def summarize(plan: dict) -> dict:
+    """Reduce a plan to what regressions are judged on: cost and scan type per relation."""
+    scans: Dict[str, List[str]] = {}
+    for node in walk(plan):
+        relation = node.get("Relation Name")
+        if relation:
+            scans.setdefault(relation, []).append(node["Node Type"])
+    return {
+        "root": plan["Node Type"],
+        "total_cost": plan.get("Total Cost"),
+        "scans": {relation: sorted(set(nodes)) for relation, nodes in scans.items()},
+    }
+
+
+def scan_regressions(baseline: dict, current: dict) -> List[str]:
+    """Relations that were read through an index in the baseline but are now seq scanned."""
+    flags = []
+    for relation, nodes in current["scans"].items():
+        before = set(baseline["scans"].get(relation, []))
+        if "Seq Scan" in nodes and "Seq Scan" not in before and before & INDEX_NODES:
+            flags.append(f"{relation}: {'/'.join(sorted(before & INDEX_NODES))} -> Seq Scan")
+    return flags
+
+
+def compare_plans(baseline: List[dict], current: List[dict], cost_tolerance: float = 0.5) -> List[str]:
+    """Flags for a call's plans against a saved baseline, statement by statement."""
+    flags = []
+    if len(baseline) != len(current):
+        flags.append(f"statement count {len(baseline)} -> {len(current)}")
+    for i, (before, after) in enumerate(zip(baseline, current)):
+        for flag in scan_regressions(before, after):
+            flags.append(f"stmt {i}: {flag}")
+        if before.get("total_cost") and after.get("total_cost"):
+            growth = after["total_cost"] / before["total_cost"] - 1
+            if growth > cost_tolerance:
+                flags.append(f"stmt {i}: cost {before['total_cost']:.0f} -> {after['total_cost']:.0f}")
+    return flags
+
+
+def scaling_exponent(small: dict, large: dict) -> Optional[float]:
+    """log(time ratio) / log(size ratio) between two dataset sizes; ~1 is linear, ~0 is flat."""
+    if large["size"] <= small["size"]:
+        return None
+    if max(small["median_ms"], large["median_ms"]) < NOISE_FLOOR_MS or small["median_ms"] <= 0:
+        return None
+    return math.log(large["median_ms"] / small["median_ms"]) / math.log(large["size"] / small["size"])
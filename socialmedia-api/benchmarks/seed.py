@@ -0,0 +1,162 @@
+"""Seed a benchmark database with a synthetic social graph.
+
+Rows are generated server side with generate_series so a 1M post dataset
+loads in seconds instead of going through the ORM one row at a time.
+"""
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app import utils
+from app.maintenance.partitions import ensure_partitions
+
+API_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = ["tech", "sports", "music", "news", "art", "science", "travel", "food"]
+
+# Every seeded user shares this password so login can be benchmarked too
+BENCH_PASSWORD = "benchmark"
+
+
+@dataclass
+class DatasetSize:
+    posts: int
+    users_per_post: float = 0.1
+    votes_per_post: int = 3
+    follows_per_user: int = 20
+
+    @property
+    def users(self) -> int:
+        return max(int(self.posts * self.users_per_post), 100)
+
+    @property
+    def label(self) -> str:
+        if self.posts >= 1_000_000 and self.posts % 1_000_000 == 0:
+            return f"{self.posts // 1_000_000}m"
+        if self.posts >= 1_000 and self.posts % 1_000 == 0:
+            return f"{self.posts // 1_000}k"
+        return str(self.posts)
+
+
+def alembic_env(database_url: str) -> dict:
+    """Environment for running alembic/app code against the benchmark database."""
+    url = urlparse(database_url)
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_HOSTNAME": url.hostname or "localhost",
+        "DATABASE_PORT": str(url.port or 5432),
+        "DATABASE_USERNAME": url.username or "postgres",
+        "DATABASE_PASSWORD": url.password or "",
+        "DATABASE_NAME": url.path.lstrip("/"),
+    })
+    env.setdefault("SECRET_KEY", "benchmark")
+    env.setdefault("ALGORITHM", "HS256")
+    env.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+    return env
+
+
+def reset_schema(engine: Engine, database_url: str) -> None:
+    """Drop everything and rebuild the schema from the alembic migrations."""
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    subprocess.run(
+        [sys.executable, "-m", "alembic", "upgrade", "head"],
+        cwd=API_ROOT,
+        env=alembic_env(database_url),
+        check=True,
+    )
+    # Pooled connections predate the migrations and miss any ALTER DATABASE ... SET they made
+    engine.dispose()
+
+
+def vacuum(engine: Engine) -> None:
+    """VACUUM ANALYZE so plans see fresh statistics and an up to date visibility map.
+
+    Without it index only scans look expensive (every row needs a heap fetch) until
+    autovacuum happens to run, which makes plans flip between runs.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
+
+
+def seed(conn: Connection, size: DatasetSize) -> dict:
+    """Insert users, posts, votes and follows for the given size. Returns row counts."""
+    # Imports the models, which read the database settings the caller has set by now
+    from app.repositories.database.versions import HOT_SCORE_SQL
+    users = size.users
+    categories = "ARRAY[" + ",".join(f"'{c}'" for c in CATEGORIES) + "]"
+
+    conn.execute(text("""
+        INSERT INTO users (email, username, full_name, password, created_at)
+        SELECT 'bench' || g || '@example.com', 'bench_' || g, 'Bench User ' || g,
+               :password, now() - make_interval(mins => g)
+        FROM generate_series(1, :users) g
+    """), {"users": users, "password": utils.hash(BENCH_PASSWORD)})
+
+    conn.execute(text(f"INSERT INTO categories (name) SELECT unnest({categories})"))
+
+    # Posts are spread over the last year and skewed towards a few prolific authors
+    ensure_partitions(conn, since=datetime.now(timezone.utc) - timedelta(days=366))
+    conn.execute(text(f"""
+        INSERT INTO posts (title, content, category, category_id, published, rating, user_id, created_at)
+        SELECT 'Post ' || g,
+               repeat('lorem ipsum dolor sit amet ', 1 + g % 30),
+               c.name, c.id,
+               g % 20 <> 0,
+               g % 5,
+               1 + ((g::bigint * 7919) % CASE WHEN g % 4 = 0 THEN 50 ELSE :users END),
+               now() - make_interval(mins => ((g::bigint * 13) % 525600)::int)
+        FROM generate_series(1, :posts) g JOIN categories c ON c.name = ({categories})[1 + g % {len(CATEGORIES)}]
+    """), {"posts": size.posts, "users": users})
+
+    # Every post gets a few votes so the aggregate joins have real work to do
+    conn.execute(text("""
+        INSERT INTO votes (post_id, user_id, dir, post_created_at)
+        SELECT p.id, 1 + ((p.id * 31 + k * 7919) % :users),
+               CASE WHEN (p.id + k) % 4 = 0 THEN -1 ELSE 1 END, p.created_at
+        FROM posts p
+        CROSS JOIN generate_series(1, :votes_per_post) k
+        ON CONFLICT DO NOTHING
+    """), {"users": users, "votes_per_post": size.votes_per_post})
+    # Net votes and hot score as the votes would have left them, posts without votes keep the
+    # score of their created_at
+    conn.execute(text(f"""
+        UPDATE posts p SET net_votes = c.net_votes,
+                           hot_score = {HOT_SCORE_SQL.format(net_votes="c.net_votes", created_at="p.created_at")}
+        FROM (SELECT q.id, q.created_at, coalesce(sum(v.dir), 0)::int AS net_votes
+              FROM posts q LEFT JOIN votes v ON v.post_id = q.id AND v.post_created_at = q.created_at
+              GROUP BY q.id, q.created_at) c
+        WHERE p.id = c.id AND p.created_at = c.created_at
+    """))
+
+    conn.execute(text("""
+        INSERT INTO followers (follower_id, following_id)
+        SELECT u, 1 + ((u + k * 104729) % :users)
+        FROM generate_series(1, :users) u
+        CROSS JOIN generate_series(1, :follows) k
+        WHERE u <> 1 + ((u + k * 104729) % :users)
+        ON CONFLICT DO NOTHING
+    """), {"users": users, "follows": size.follows_per_user})
+
+    # User 1 is a "celebrity" followed by everyone, user 2 follows user 1 back (mutual)
+    conn.execute(text("""
+        INSERT INTO followers (follower_id, following_id)
+        SELECT u, 1 FROM generate_series(2, :users) u
+        ON CONFLICT DO NOTHING
+    """), {"users": users})
+    conn.execute(text("""
+        INSERT INTO followers (follower_id, following_id) VALUES (1, 2)
+        ON CONFLICT DO NOTHING
+    """))
+
+    counts = {}
+    for table in ("users", "posts", "votes", "followers"):
+        counts[table] = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+    return counts
@@ -0,0 +1,56 @@
+"""Production server: gunicorn supervising uvicorn worker processes.
+
+    gunicorn -c gunicorn.conf.py "app.main:create_app()"
+
+One worker process per core. Requests are async, but bcrypt, Pydantic validation and JSON
+encoding run on the CPU, and one process only ever uses one core for them. Every setting
+reads an environment variable, so the same image runs on any machine size:
+
+    WEB_CONCURRENCY                 worker processes (default: the cores this process may use)
+    GUNICORN_PRELOAD                import the app once in the arbiter before forking (default false)
+    GUNICORN_TIMEOUT                seconds a silent worker is given before it is killed and replaced
+    GUNICORN_GRACEFUL_TIMEOUT       seconds workers get to finish their requests on reload or shutdown
+    GUNICORN_MAX_REQUESTS           restart a worker after this many requests, 0 never (default 0)
+    GUNICORN_MAX_REQUESTS_JITTER    random extra requests, so workers do not all restart together
+    GUNICORN_KEEPALIVE              seconds an idle keep-alive connection stays open
+
+`kill -HUP <arbiter pid>` reloads: new workers start with the new code and configuration, the
+old ones finish their requests within GUNICORN_GRACEFUL_TIMEOUT. With GUNICORN_PRELOAD the
+code is imported by the arbiter, so a reload does not pick up new code; restart instead.
+
+Each worker has its own connection pool (DB_POOL_SIZE, DB_MAX_OVERFLOW in app/config.py) and
+its own event loop and HTTP parser (UVICORN_LOOP, UVICORN_HTTP, see app/workers.py).
+"""
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def env_bool(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+# sched_getaffinity honours CPU pinning (taskset, container cpusets), cpu_count does not
+workers = env_int("WEB_CONCURRENCY", len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)
+worker_class = "app.workers.UvicornWorker"
+preload_app = env_bool("GUNICORN_PRELOAD", False)
+timeout = env_int("GUNICORN_TIMEOUT", 60)
+graceful_timeout = env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+max_requests = env_int("GUNICORN_MAX_REQUESTS", 0)
+max_requests_jitter = env_int("GUNICORN_MAX_REQUESTS_JITTER", 0)
+keepalive = env_int("GUNICORN_KEEPALIVE", 5)
+# Behind the container platform's load balancer
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "*")
+accesslog = "-" if env_bool("GUNICORN_ACCESS_LOG", False) else None
+
+
+def post_fork(server, worker):
+    # A preloaded app may have created its engine in the arbiter. Connections it opened
+    # there must not be shared by the forked workers: drop them from this worker's pool
+    # without closing them under the other processes
+    if server.cfg.preload_app:
+        from app.database import dispose_engine
+        dispose_engine(close=False)
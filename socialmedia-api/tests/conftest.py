@@ -0,0 +1,8 @@
+"""Run from socialmedia-api with python -m pytest; tests that need the database skip without it."""
+import os
+
+# app.config requires the database settings, even though nothing here connects
+for name, value in {"DATABASE_HOSTNAME": "localhost", "DATABASE_PORT": "5432", "DATABASE_USERNAME": "postgres",
+                    "DATABASE_PASSWORD": "", "DATABASE_NAME": "socialmedia", "SECRET_KEY": "test",
+                    "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "30"}.items():
+    os.environ.setdefault(name, value)
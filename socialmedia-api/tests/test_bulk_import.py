@@ -0,0 +1,64 @@
+"""Bulk post imports (repositories/database/bulk_repository.py) against the DATABASE_* database.
+
+Everything runs in one transaction that is rolled back; skipped when the database cannot be reached.
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from app.database import get_engine
+from app.repositories.database.bulk_repository import BulkRepository
+
+
+@pytest.fixture
+def db():
+    try:
+        connection = get_engine().connect()
+    except OperationalError as exc:
+        pytest.skip(f"no database: {exc}")
+    transaction = connection.begin()
+    # Commits of the repository only release savepoints of the outer transaction
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+
+
+def free_post_id(db: Session) -> int:
+    """An id no post has; like any rolled back insert, taking it is not undone"""
+    return db.execute(text("SELECT nextval('posts_id_seq')")).scalar()
+
+
+def test_duplicate_ids_in_one_batch_insert_the_first_row(db):
+    user_id = db.execute(text("SELECT min(id) FROM users")).scalar()
+    if user_id is None:
+        pytest.skip("no users")
+    post_id = free_post_id(db)
+    now = datetime.now(timezone.utc)
+    rows = [f'{{"id": {post_id}, "title": "first", "content": "c", "category": "general", "rating": 1, '
+            f'"user_id": {user_id}, "created_at": "{(now - timedelta(minutes=minutes)).isoformat()}"}}'
+            for minutes in (1, 2)]
+    rows[1] = rows[1].replace('"first"', '"second"')
+
+    result = BulkRepository(db).import_rows("posts", rows)
+
+    assert (result["inserted"], result["skipped"]) == (1, 1)
+    assert db.execute(text("SELECT title FROM posts WHERE id = :id"), {"id": post_id}).scalars().all() == ["first"]
+
+
+def test_existing_ids_are_skipped(db):
+    existing = db.execute(text("SELECT id, user_id FROM posts ORDER BY id LIMIT 1")).first()
+    if existing is None:
+        pytest.skip("no posts")
+    created_at = datetime.now(timezone.utc).isoformat()
+    row = (f'{{"id": {existing.id}, "title": "again", "content": "c", "category": "general", "rating": 1, '
+           f'"user_id": {existing.user_id}, "created_at": "{created_at}"}}')
+
+    result = BulkRepository(db).import_rows("posts", [row])
+
+    assert (result["inserted"], result["skipped"]) == (0, 1)
+    assert db.execute(text("SELECT count(*) FROM posts WHERE id = :id"), {"id": existing.id}).scalar() == 1
@@ -0,0 +1,258 @@
+"""app/cache.py with a MemoryStore as the L2, and the Bloom filters of user_filters.py"""
+import pytest
+from app import cache as cache_module
+from app.cache import Cache, MemoryStore
+from app.repositories.database.user_filters import UserFilters
+
+
+class Loader:
+    """load() for Namespace.get that counts its calls"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.values.pop(0) if len(self.values) > 1 else self.values[0]
+
+
+def make_cache(store=None, beta=0.0) -> Cache:
+    return Cache(store, "test", ttl_jitter=0.0, early_refresh_beta=beta)
+
+
+def test_l1_hit_does_not_load():
+    users = make_cache().namespace("users", ttl=60, max_entries=10)
+    load = Loader({"id": 1})
+    assert users.get(1, load) == {"id": 1}
+    assert users.get(1, load) == {"id": 1}
+    assert load.calls == 1
+    assert users.stats()["l1_hits"] == 1 and users.stats()["misses"] == 1
+
+
+def test_l2_is_shared_between_workers():
+    store = MemoryStore()
+    first, second = make_cache(store), make_cache(store)
+    load = Loader({"id": 1})
+    first.namespace("users", ttl=60, max_entries=10).get(1, load, tags=("user:1",))
+    assert second.namespace("users", ttl=60, max_entries=10).get(1, load, tags=("user:1",)) == {"id": 1}
+    assert load.calls == 1
+    assert second.namespaces["users"].stats()["l2_hits"] == 1
+
+
+def test_invalidate_bumps_tag_version_in_l2():
+    store = MemoryStore()
+    first, second = make_cache(store), make_cache(store)
+    # local_ttl=0: the second worker checks its L1 entry against the L2 on every read
+    users = second.namespace("users", ttl=60, max_entries=10, local_ttl=0)
+    load = Loader("old", "new")
+    assert users.get(1, load, tags=("user:1",)) == "old"
+    first.invalidate("user:1")
+    assert store.mget(["test:tag:user:1"]) == [b"1"]
+    assert users.get(1, load, tags=("user:1",)) == "new"
+    assert load.calls == 2
+
+
+def test_invalidate_drops_tagged_l1_entries_only():
+    users = make_cache().namespace("users", ttl=60, max_entries=10)
+    users.get(1, Loader("one"), tags=("user:1",))
+    users.get(2, Loader("two"), tags=("user:2",))
+    users.cache.invalidate("user:1")
+    load = Loader("one again")
+    assert users.get(1, load, tags=("user:1",)) == "one again"
+    assert users.get(2, load, tags=("user:2",)) == "two"
+    assert load.calls == 1
+    assert users.stats()["invalidations"] == 1
+
+
+def test_invalidation_during_load_keeps_value_out_of_l1():
+    store = MemoryStore()
+    cache = make_cache(store)
+    users = cache.namespace("users", ttl=60, max_entries=10)
+    values = iter(["read before the write", "read after the write"])
+
+    def load():
+        value = next(values)
+        if value == "read before the write":
+            cache.invalidate("user:1")  # A write commits while the value is read
+        return value
+
+    assert users.get(1, load, tags=("user:1",)) == "read before the write"
+    assert users.stats()["entries"] == 0
+    # The L2 copy carries the tag versions from before the load, so it is not served either
+    assert users.get(1, load, tags=("user:1",)) == "read after the write"
+    assert users.stats()["entries"] == 1
+    assert not cache._loading and not cache._changed
+
+
+def test_evict_local_during_load_keeps_value_out_of_l1():
+    cache = make_cache()
+    users = cache.namespace("users", ttl=60, max_entries=10)
+
+    def load():
+        cache.evict_local("user:1")
+        return "stale"
+
+    users.get(1, load, tags=("user:1",))
+    assert users.stats()["entries"] == 0
+
+
+def test_failed_load_ends_it():
+    cache = make_cache(MemoryStore())
+    users = cache.namespace("users", ttl=60, max_entries=10)
+
+    def load():
+        raise RuntimeError("database down")
+
+    with pytest.raises(RuntimeError):
+        users.get(1, load, tags=("user:1",))
+    assert not cache._loading
+    assert users.get(1, Loader("back"), tags=("user:1",)) == "back"
+
+
+def test_missing_values_are_cached():
+    store = MemoryStore()
+    first, second = make_cache(store), make_cache(store)
+    users = first.namespace("users", ttl=60, max_entries=10, negative_ttl=5)
+    load = Loader(None)
+    assert users.get(404, load) is None
+    assert users.get(404, load) is None
+    assert second.namespace("users", ttl=60, max_entries=10).get(404, load) is None
+    assert load.calls == 1
+    assert users.stats()["negative_hits"] == 1
+    assert second.namespaces["users"].stats()["negative_hits"] == 1
+
+
+def test_negative_ttl_applies_to_missing_values(monkeypatch):
+    users = make_cache().namespace("users", ttl=60, max_entries=10, negative_ttl=5)
+    users.get(404, Loader(None))
+    users.get(1, Loader("one"))
+    now = cache_module.time.time()
+    monkeypatch.setattr(cache_module.time, "time", lambda: now + 10)
+    load = Loader("found now")
+    assert users.get(404, load) == "found now"
+    assert users.get(1, load) == "one"
+    assert load.calls == 1
+
+
+def test_lru_evicts_least_recently_read():
+    users = make_cache().namespace("users", ttl=60, max_entries=2)
+    users.get("a", Loader("a"))
+    users.get("b", Loader("b"))
+    users.get("a", Loader("unused"))
+    users.get("c", Loader("c"))
+    assert users.stats()["evictions"] == 1
+    load = Loader("b again")
+    assert users.get("a", load) == "a"
+    assert users.get("b", load) == "b again"
+    assert load.calls == 1
+
+
+def test_early_refresh_before_expiry(monkeypatch):
+    users = make_cache(beta=1.0).namespace("users", ttl=60, max_entries=10)
+    users.get(1, Loader("first"))
+    record = users._entries[1][0]
+    record.delta = 10  # A slow load, refreshed well before its expiry
+    monkeypatch.setattr(cache_module.random, "random", lambda: 0.0)
+    load = Loader("refreshed")
+    assert users.get(1, load) == "first"
+    assert load.calls == 0
+    # Close to 1 the draw puts the refresh point past the expiry: this reader loads again
+    monkeypatch.setattr(cache_module.random, "random", lambda: 0.9999)
+    assert users.get(1, load) == "refreshed"
+    assert load.calls == 1
+    assert users.stats()["early_refreshes"] == 1
+
+
+def test_early_refresh_off_with_beta_zero(monkeypatch):
+    users = make_cache(beta=0.0).namespace("users", ttl=60, max_entries=10)
+    users.get(1, Loader("first"))
+    users._entries[1][0].delta = 10
+    monkeypatch.setattr(cache_module.random, "random", lambda: 0.9999)
+    assert users.get(1, Loader("refreshed")) == "first"
+    assert users.stats()["early_refreshes"] == 0
+
+
+class FailingStore(MemoryStore):
+    def mget(self, keys):
+        raise ConnectionError("l2 down")
+
+
+def test_failing_l2_falls_back_to_load():
+    cache = make_cache(FailingStore())
+    users = cache.namespace("users", ttl=60, max_entries=10)
+    load = Loader("loaded")
+    assert users.get(1, load) == "loaded"
+    assert load.calls == 1
+    assert cache.stats()["l2"]["errors"] == 1
+
+
+def test_forget_drops_both_tiers():
+    store = MemoryStore()
+    users = make_cache(store).namespace("users", ttl=60, max_entries=10)
+    users.get(1, Loader("one"))
+    users.forget(1)
+    assert store.mget(["test:users:1"]) == [None]
+    assert users.stats()["entries"] == 0
+
+
+def test_user_filters_look_everything_up_until_built():
+    filters = UserFilters(0.01)
+    assert not filters.ready
+    assert filters.might_have_email("nobody@example.com")
+    filters.add("early@example.com", "early")  # No filters yet, nothing to add to
+    assert filters.stats() == {"ready": False, "definite_misses": 0, "lookups": 0}
+
+
+def test_user_filters_rebuild():
+    filters = UserFilters(0.001)
+    filters.rebuild(2, [("a@example.com", "alice"), ("b@example.com", None)])
+    assert filters.ready
+    assert filters.might_have_email("a@example.com") and filters.might_have_email("b@example.com")
+    assert filters.might_have_username("alice")
+    assert not filters.might_have_email("nobody@example.com")
+    filters.add("c@example.com", "carol")
+    assert filters.might_have_username("carol")
+    # A rebuild replaces the filters: names of users no longer there are dropped
+    filters.rebuild(1, [("c@example.com", "carol")])
+    assert not filters.might_have_username("alice")
+    stats = filters.stats()
+    assert stats["emails_added"] == 1 and stats["usernames_added"] == 1
+    assert stats["definite_misses"] == 2
+
+
+def test_user_filters_keep_names_added_during_rebuild():
+    filters = UserFilters(0.001)
+    filters.rebuild(1, [("old@example.com", "old")])
+
+    def users():
+        yield "a@example.com", "alice"
+        # Written by a request while the build reads the table past this user
+        filters.add("new@example.com", "newcomer")
+        yield "b@example.com", "bob"
+
+    filters.rebuild(2, users())
+    assert filters.might_have_email("new@example.com") and filters.might_have_username("newcomer")
+    assert filters._pending is None
+
+
+def test_user_filters_failed_rebuild_keeps_old_filters():
+    filters = UserFilters(0.001)
+    filters.rebuild(1, [("a@example.com", "alice")])
+
+    def users():
+        yield "b@example.com", "bob"
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        filters.rebuild(2, users())
+    assert filters.might_have_email("a@example.com")
+    assert not filters.might_have_email("b@example.com")
+    assert filters._pending is None
+
+
+def test_user_filters_disabled():
+    filters = UserFilters(0.01, enabled=False)
+    filters.rebuild(1, [("a@example.com", "alice")])
+    assert not filters.ready
+    assert filters.might_have_email("nobody@example.com")
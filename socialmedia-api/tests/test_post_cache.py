@@ -0,0 +1,25 @@
+"""The hot post cache of GET /posts/{id} (repositories/database/post_cache.py)"""
+from app.repositories.database.post_cache import HotPostCache
+from app.repositories.database.post_rows import PostRow
+
+
+def post(post_id: int, user_id: int, full_name: str = "Owner") -> PostRow:
+    return PostRow("title", "content", "general", True, None, post_id, None, user_id,
+                   "owner@example.com", "owner", full_name, None, 0, 0, 0)
+
+
+def test_served_for_its_version_only():
+    posts = HotPostCache(max_entries=10, ttl=60)
+    posts.get(1, 1, lambda: post(1, 7))
+    assert posts.get(1, 1, lambda: post(1, 7, "Reloaded")).owner_full_name == "Owner"
+    assert posts.get(1, 2, lambda: post(1, 7, "Reloaded")).owner_full_name == "Reloaded"
+
+
+def test_invalidate_owner_drops_their_posts_only():
+    posts = HotPostCache(max_entries=10, ttl=60)
+    for post_id, user_id in [(1, 7), (2, 8), (3, 7)]:
+        posts.get(post_id, 1, lambda post_id=post_id, user_id=user_id: post(post_id, user_id))
+    posts.invalidate_owner(7)
+    assert posts.stats()["entries"] == 1
+    assert posts.get(1, 1, lambda: post(1, 7, "Renamed")).owner_full_name == "Renamed"
+    assert posts.get(2, 1, lambda: post(2, 8, "Renamed")).owner_full_name == "Owner"